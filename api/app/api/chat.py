@@ -1,16 +1,47 @@
 from fastapi import APIRouter, HTTPException, status
 import logging
-from app.models.models import QueryRequest, QueryResponse
+from typing import List, Optional
+from app.core.config import settings
+from app.models.models import QueryRequest, QueryResponse, SessionCreateRequest, SessionCreateResponse
 from app.services.llm_services import (
     route_query,
     rewrite_query_for_search,
     generate_final_answer
 )
 from app.services.search_service import perform_hybrid_search
+from app.services.session_store import session_store
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+async def resolve_session(request: QueryRequest) -> tuple[Optional[str], Optional[List[str]]]:
+    """
+    Returns (session_id, relevant session chunks), or (None, None) without a
+    session. A session_id this instance does not know (cold start, another
+    serverless instance, expiry) is recreated from session_context_text when
+    the client sent it; clients resend the text only after a 404.
+    """
+    if request.session_id:
+        session_chunks = await session_store.retrieve(
+            request.session_id, request.user_id, request.query_text, settings.SESSION_TOP_K
+        )
+        if session_chunks is not None:
+            return request.session_id, session_chunks
+        if not request.session_context_text:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired.")
+        logger.info("Session '%s' not found; recreating it from the inline session context.", request.session_id)
+    if not request.session_context_text:
+        return None, None
+    # Legacy clients send the whole document every turn; store it once and
+    # hand back a session_id so later turns can send that instead.
+    logger.info("Creating session from inline session context (%d chars).", len(request.session_context_text))
+    try:
+        session_id, _ = await session_store.create(request.user_id, request.session_context_text)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Session context text cannot be empty.")
+    session_chunks = await session_store.retrieve(session_id, request.user_id, request.query_text, settings.SESSION_TOP_K)
+    return session_id, session_chunks
+
 @router.post("/query", response_model=QueryResponse)
 async def handle_rag_query(request: QueryRequest):
     """
@@ -18,8 +49,6 @@ async def handle_rag_query(request: QueryRequest):
     incorporating optional session context from the request.
     """
     logger.info(f"Received query from user '{request.user_id}': '{request.query_text[:50]}...'")
-    if request.session_context_text:
-        logger.info(f"  Including session context (first 100 chars): '{request.session_context_text[:100]}...'")
 
     if not request.query_text:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query text cannot be empty.")
@@ -30,13 +59,17 @@ async def handle_rag_query(request: QueryRequest):
         logger.debug(f"Query intent classified as: {intent}")
 
         if intent == "chit_chat":
+            # The session document is not needed here, so it is not stored (or embedded) yet.
             logger.info("Handling as chit-chat.")
             answer = await generate_final_answer(request.query_text, elastic_context=[], session_context=None)
-            return QueryResponse(answer=answer)
+            return QueryResponse(answer=answer, session_id=request.session_id)
 
         # --- RAG Pipeline for "query_documents" ---
         logger.info("Handling as document query.")
 
+        # --- Session Context: only the session chunks relevant to the question ---
+        session_id, session_chunks = await resolve_session(request)
+
         # --- Component 2: Rewrite Query ---
         rewritten_query = await rewrite_query_for_search(request.query_text)
         logger.debug(f"Rewritten query for search: '{rewritten_query}'")
@@ -50,11 +83,11 @@ async def handle_rag_query(request: QueryRequest):
         final_answer = await generate_final_answer(
             original_query=request.query_text,
             elastic_context=elastic_context_chunks,
-            session_context=request.session_context_text
+            session_context=session_chunks
         )
         logger.info(f"Generated final answer for user '{request.user_id}'.")
 
-        return QueryResponse(answer=final_answer)
+        return QueryResponse(answer=final_answer, session_id=session_id)
 
     except HTTPException as http_exc:
          raise http_exc
@@ -64,3 +97,29 @@ async def handle_rag_query(request: QueryRequest):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while processing your query."
         )
+
+@router.post("/session", response_model=SessionCreateResponse, status_code=status.HTTP_201_CREATED)
+async def create_session(request: SessionCreateRequest):
+    """
+    Stores a session document once: it is chunked and embedded server-side,
+    and later queries send only the returned session_id.
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Session text cannot be empty.")
+    try:
+        session_id, chunk_count = await session_store.create(request.user_id, request.text)
+        return SessionCreateResponse(session_id=session_id, chunk_count=chunk_count)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Session text cannot be empty.")
+    except Exception as e:
+        logger.error(f"Error creating session for user '{request.user_id}': {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while storing the session document."
+        )
+
+@router.delete("/session/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_session(session_id: str, user_id: str):
+    """Removes one of the user's session documents from the store."""
+    if not await session_store.delete(session_id, user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired.")
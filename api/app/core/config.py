@@ -1,4 +1,5 @@
 import os
+import importlib.util
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 from pathlib import Path
@@ -19,14 +20,41 @@ class Settings(BaseSettings):
     EMBEDDING_MODEL_NAME: str = 'sentence-transformers/all-MiniLM-L6-v2'
     EMBEDDING_DIM: int = 384
 
+    # Embedding Service Settings
+    # When set, query/session embeddings come from the backend's /api/embed instead of a local model.
+    EMBEDDING_SERVICE_URL: str | None = os.getenv("EMBEDDING_SERVICE_URL")
+    EMBEDDING_SERVICE_KEY: str | None = os.getenv("EMBEDDING_SERVICE_KEY") # Sent as X-Embed-Key
+    EMBEDDING_SERVICE_TIMEOUT_SECONDS: float = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT_SECONDS", "5"))
+    EMBEDDING_LOCAL_FALLBACK: bool = os.getenv("EMBEDDING_LOCAL_FALLBACK", "false").lower() == "true" # Needs sentence-transformers
+    EMBEDDING_QUERY_CACHE_SIZE: int = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "512"))
+
     # LLM Settings
     GEMINI_MODEL_NAME: str = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash-lite-preview-09-2025")
     # Practical token limit for combined context sent to LLM Answer Generator
     MAX_CONTEXT_TOKENS: int = int(os.getenv("MAX_CONTEXT_TOKENS", "8000"))
+    # Static prompt prefixes: "auto" tries Gemini context caching, "local" keeps them as in-process system instructions
+    GEMINI_CONTEXT_CACHE: str = os.getenv("GEMINI_CONTEXT_CACHE", "local")
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS: int = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+    # Gemini's minimum cacheable prefix for the model; shorter prefixes are not sent to the cache API at all
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS: int = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
 
     # Index Settings
     ES_INDEX_NAME: str = os.getenv("ES_INDEX_NAME", "rag_documents")
 
+    # Session Store Settings
+    # Session documents are chunked and embedded once; later turns retrieve only relevant chunks.
+    SESSION_MAX_ENTRIES: int = int(os.getenv("SESSION_MAX_ENTRIES", "256")) # In-process LRU capacity
+    SESSION_TTL_SECONDS: int = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+    SESSION_REDIS_URL: str | None = os.getenv("SESSION_REDIS_URL") # Optional shared tier; without it, an instance that misses a session has the client resend the text
+    SESSION_CHUNK_SIZE: int = int(os.getenv("SESSION_CHUNK_SIZE", "800")) # characters
+    SESSION_CHUNK_OVERLAP: int = int(os.getenv("SESSION_CHUNK_OVERLAP", "100")) # characters
+    SESSION_TOP_K: int = int(os.getenv("SESSION_TOP_K", "4")) # Session chunks retrieved per query
+
+    # Cold-start Settings
+    # Heavy dependencies (Gemini SDK, tiktoken, sentence-transformers) load lazily on first use.
+    # Set to true to load them eagerly in the startup hook instead.
+    WARMUP_ON_STARTUP: bool = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
     class Config:
         case_sensitive = True
         env_file = '.env'
@@ -41,3 +69,11 @@ if not settings.ELASTIC_CLOUD_ID and not settings.ELASTICSEARCH_URL:
     logger.warning("Neither ELASTIC_CLOUD_ID nor ELASTICSEARCH_URL is set. Elasticsearch connection will fail.")
 elif settings.ELASTIC_CLOUD_ID and not settings.ELASTIC_API_KEY:
     logger.warning("ELASTIC_CLOUD_ID is set, but ELASTIC_API_KEY is missing.")
+
+# sentence-transformers is not in requirements.txt (the embedding service is the
+# default), so a deployment that would encode locally must fail now, not on the first query.
+if (not settings.EMBEDDING_SERVICE_URL or settings.EMBEDDING_LOCAL_FALLBACK) and importlib.util.find_spec("sentence_transformers") is None:
+    raise RuntimeError(
+        "Local embeddings are configured (EMBEDDING_SERVICE_URL is unset or EMBEDDING_LOCAL_FALLBACK=true) "
+        "but sentence-transformers is not installed. Set EMBEDDING_SERVICE_URL to the backend, or install sentence-transformers."
+    )
@@ -0,0 +1,134 @@
+"""
+Cold-start profiling for the serverless API.
+
+Two complementary views are collected:
+
+* ``startup_phase`` records wall-clock time spent in named runtime phases
+  (e.g. lazily importing Gemini or loading the embedding model) inside the
+  running function, so the cost of the first real request is visible.
+* ``profile_imports`` re-imports the function entrypoint in a fresh
+  interpreter with ``-X importtime`` and produces a per-module breakdown.
+  Run it on every build to track cold-start cost over time:
+
+      python -m app.core.profiling --output coldstart_profile.json
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Process start reference point, as close to interpreter start as we can get.
+PROCESS_START = time.perf_counter()
+
+# name -> seconds spent in that phase (first occurrence only)
+startup_timings: Dict[str, float] = {}
+
+@contextmanager
+def startup_phase(name: str):
+    """Times a startup phase and records it once in ``startup_timings``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if name not in startup_timings:
+            startup_timings[name] = elapsed
+            logger.info(f"Startup phase '{name}' took {elapsed * 1000:.1f} ms.")
+
+def get_startup_report() -> dict:
+    """Returns the runtime startup timings collected so far."""
+    return {
+        "uptime_seconds": round(time.perf_counter() - PROCESS_START, 3),
+        "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in startup_timings.items()},
+    }
+
+# Lines emitted by `-X importtime` look like:
+#   import time: self [us] | cumulative | imported package
+#   import time:       153 |        153 |   _io
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+def parse_importtime(stderr: str) -> List[dict]:
+    """Parses `-X importtime` output into a list of per-module records."""
+    records = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        records.append({
+            "module": module,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            # importtime indents nested imports by two spaces per level
+            "depth": max(0, (len(indent) - 1) // 2),
+        })
+    return records
+
+def profile_imports(entrypoint: str = "index", top_n: int = 40) -> dict:
+    """
+    Imports ``entrypoint`` in a fresh interpreter with ``-X importtime``
+    and returns a per-module and per-top-level-package breakdown.
+    """
+    api_root = Path(__file__).resolve().parents[2]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(api_root), env.get("PYTHONPATH")]))
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entrypoint}"],
+        cwd=api_root,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    records = parse_importtime(result.stderr)
+    by_package: Dict[str, float] = {}
+    for record in records:
+        package = record["module"].split(".")[0]
+        by_package[package] = by_package.get(package, 0.0) + record["self_ms"]
+
+    entry_record = next((r for r in records if r["module"] == entrypoint), None)
+    return {
+        "entrypoint": entrypoint,
+        "python": sys.version.split()[0],
+        "import_ok": result.returncode == 0,
+        "error": result.stderr.strip().splitlines()[-1] if result.returncode != 0 and result.stderr else None,
+        "interpreter_wall_ms": round(wall_ms, 1),
+        "entrypoint_cumulative_ms": entry_record["cumulative_ms"] if entry_record else None,
+        "module_count": len(records),
+        "top_modules_by_cumulative_ms": sorted(records, key=lambda r: r["cumulative_ms"], reverse=True)[:top_n],
+        "top_packages_by_self_ms": dict(
+            sorted(((k, round(v, 1)) for k, v in by_package.items()), key=lambda kv: kv[1], reverse=True)[:top_n]
+        ),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile cold-start import time of the API function.")
+    parser.add_argument("--entrypoint", default="index", help="Module to import (default: index).")
+    parser.add_argument("--output", default="coldstart_profile.json", help="Path of the JSON report.")
+    parser.add_argument("--top", type=int, default=40, help="Number of modules/packages to report.")
+    args = parser.parse_args()
+
+    report = profile_imports(args.entrypoint, top_n=args.top)
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Imported '{args.entrypoint}' in {report['entrypoint_cumulative_ms']} ms "
+          f"({report['module_count']} modules). Report written to {args.output}.")
+    for package, ms in list(report["top_packages_by_self_ms"].items())[:10]:
+        print(f"  {package:<30} {ms:>10.1f} ms")
+    if not report["import_ok"]:
+        print(f"Import failed: {report['error']}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from app.core.profiling import get_startup_report, startup_phase
+
+logger = logging.getLogger(__name__)
+
+WARMUP_COMPONENTS = ("elasticsearch", "gemini", "tokenizer", "embedding_model")
+
+def _warm_elasticsearch():
+    from app.services.es_client import get_es_client
+    with startup_phase("elasticsearch_client"):
+        get_es_client()
+
+def _warm_gemini():
+    from app.services.llm_services import get_model, STATIC_PROMPTS
+    for prompt_name in STATIC_PROMPTS:
+        if get_model(prompt_name) is None:
+            raise RuntimeError("Gemini model unavailable.")
+
+def _warm_tokenizer():
+    from app.services.llm_services import get_tokenizer
+    if get_tokenizer() is None:
+        raise RuntimeError("tiktoken tokenizer unavailable.")
+
+def _warm_embedding_model():
+    from app.core.config import settings
+    from app.services.embedding_client import embedding_client
+    if settings.EMBEDDING_SERVICE_URL:
+        # Only open the pooled HTTP client; the remote model is already warm.
+        embedding_client.prepare()
+        return
+    from app.services.search_service import get_embedding_model
+    model = get_embedding_model()
+    # One tiny encode pays the first-inference cost before real traffic does.
+    with startup_phase("embedding_first_encode"):
+        model.encode("warm-up", convert_to_tensor=False)
+
+_WARMERS = {
+    "elasticsearch": _warm_elasticsearch,
+    "gemini": _warm_gemini,
+    "tokenizer": _warm_tokenizer,
+    "embedding_model": _warm_embedding_model,
+}
+
+async def warm_up(components: tuple[str, ...] = WARMUP_COMPONENTS) -> dict:
+    """
+    Loads the lazily initialized dependencies concurrently in worker threads.
+    Safe to call repeatedly: already-loaded components return immediately.
+    """
+    unknown = [c for c in components if c not in _WARMERS]
+    if unknown:
+        raise ValueError(f"Unknown warm-up components: {unknown}")
+
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_WARMERS[c]) for c in components),
+        return_exceptions=True
+    )
+    status = {}
+    for component, result in zip(components, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Warm-up of '{component}' failed: {result}")
+            status[component] = f"error: {result}"
+        else:
+            status[component] = "ok"
+    return {"components": status, **get_startup_report()}
@@ -4,7 +4,17 @@ from typing import List, Optional
 class QueryRequest(BaseModel):
     user_id: str = Field(..., description="Unique identifier for the user.")
     query_text: str = Field(..., description="The user's question or message.")
-    session_context_text: Optional[str] = Field(None, description="Text extracted from a user-uploaded file for the current session.")
+    session_id: Optional[str] = Field(None, description="ID of a session document created via /api/session.")
+    session_context_text: Optional[str] = Field(None, description="Text extracted from a user-uploaded file. Sent once, it is stored as a session and the returned session_id should be used on later turns; resend it only if that session_id gets a 404.")
 
 class QueryResponse(BaseModel):
     answer: str = Field(..., description="The AI-generated answer.")
+    session_id: Optional[str] = Field(None, description="Session ID to send on later turns instead of the session text.")
+
+class SessionCreateRequest(BaseModel):
+    user_id: str = Field(..., description="Unique identifier for the user.")
+    text: str = Field(..., description="Text extracted from a user-uploaded file for the current session.")
+
+class SessionCreateResponse(BaseModel):
+    session_id: str = Field(..., description="Identifier to send as `session_id` on later queries.")
+    chunk_count: int = Field(..., description="Number of chunks the session document was split into.")
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.profiling import startup_phase
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingClient:
+    """
+    Gets embeddings from the backend's /api/embed endpoint so this function
+    does not have to bundle torch and a SentenceTransformer. Uses one pooled
+    HTTP client per instance and keeps a small LRU of recent query vectors.
+    With no EMBEDDING_SERVICE_URL (or when the service fails and
+    EMBEDDING_LOCAL_FALLBACK is on) it encodes locally instead, which needs
+    `sentence-transformers` installed.
+    """
+
+    def __init__(self, service_url: Optional[str], cache_size: int):
+        self.service_url = service_url.rstrip("/") if service_url else None
+        self.cache_size = cache_size
+        self._query_cache: "OrderedDict[tuple[str, bool], list[float]]" = OrderedDict()
+        self._http = None
+
+    def _get_http(self):
+        if self._http is None:
+            import httpx
+            with startup_phase("embedding_http_client"):
+                self._http = httpx.AsyncClient(
+                    base_url=self.service_url,
+                    timeout=httpx.Timeout(settings.EMBEDDING_SERVICE_TIMEOUT_SECONDS),
+                    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                    headers={"X-Embed-Key": settings.EMBEDDING_SERVICE_KEY} if settings.EMBEDDING_SERVICE_KEY else None,
+                )
+        return self._http
+
+    async def _embed_remote(self, texts: List[str], normalize: bool) -> np.ndarray:
+        response = await self._get_http().post("/api/embed", json={"texts": texts, "normalize": normalize})
+        response.raise_for_status()
+        return np.asarray(response.json()["vectors"], dtype=np.float32)
+
+    @staticmethod
+    async def _embed_local(texts: List[str], normalize: bool) -> np.ndarray:
+        from app.services.search_service import get_embedding_model
+        model = get_embedding_model()
+        vectors = await asyncio.to_thread(
+            model.encode, texts, batch_size=32, show_progress_bar=False, normalize_embeddings=normalize
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+    async def embed(self, texts: List[str], normalize: bool = False) -> np.ndarray:
+        """Embeds texts in one batch. Returns an (n, dim) float32 array."""
+        if not self.service_url:
+            return await self._embed_local(texts, normalize)
+        try:
+            return await self._embed_remote(texts, normalize)
+        except Exception as e:
+            if not settings.EMBEDDING_LOCAL_FALLBACK:
+                raise
+            logger.warning(f"Embedding service failed ({e}); encoding locally.")
+            return await self._embed_local(texts, normalize)
+
+    async def embed_query(self, text: str, normalize: bool = False) -> List[float]:
+        """Embeds a single query, serving repeats from the LRU."""
+        key = (text, normalize)
+        vector = self._query_cache.get(key)
+        if vector is not None:
+            self._query_cache.move_to_end(key)
+            return vector
+        vector = (await self.embed([text], normalize))[0].tolist()
+        self._query_cache[key] = vector
+        while len(self._query_cache) > self.cache_size:
+            self._query_cache.popitem(last=False)
+        return vector
+
+    def prepare(self) -> None:
+        """Creates the pooled HTTP client ahead of the first request."""
+        if self.service_url:
+            self._get_http()
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+embedding_client = EmbeddingClient(
+    service_url=settings.EMBEDDING_SERVICE_URL,
+    cache_size=settings.EMBEDDING_QUERY_CACHE_SIZE,
+)
@@ -1,41 +1,165 @@
-import google.generativeai as genai
 from app.core.config import settings
+from app.core.profiling import startup_phase
+import asyncio
 import logging
-import tiktoken
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
-model = None
-try:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-    generation_config = genai.GenerationConfig(max_output_tokens=8192)
+# --- Lazy Gemini / tokenizer loading ---
+# `google.generativeai` and `tiktoken` are heavy imports. They are loaded on
+# first real use (or by the warm-up hook) instead of at module import, so a
+# cold start only pays for them when a request actually needs them.
+# Each load is single-flight: a caller arriving while the warm-up thread is
+# loading waits for that load instead of seeing "unavailable".
+genai = None
+_genai_init_attempted = False
+_genai_lock = threading.Lock()
+tokenizer = None
+_tokenizer_init_attempted = False
+_tokenizer_lock = threading.Lock()
+
+# --- Static prompt models ---
+# Each prompt's fixed instructions and examples are the `system_instruction`
+# of a long-lived model, so requests only send the query and context. With
+# GEMINI_CONTEXT_CACHE=auto the instruction is also put in a Gemini context
+# cache if it reaches GEMINI_CONTEXT_CACHE_MIN_TOKENS; "local" (the default)
+# keeps it in-process only. Building a model may create a cache (a blocking
+# API call), so it only happens in `get_model`, off the event loop.
+models: dict[str, object] = {}
+_model_expiry: dict[str, float] = {}
+static_prompt_tokens: dict[str, int] = {}
+CACHE_REFRESH_MARGIN_SECONDS = 300
+
+def _get_genai():
+    global genai, _genai_init_attempted
+    if genai is not None or _genai_init_attempted:
+        return genai
+    with _genai_lock:
+        if genai is None and not _genai_init_attempted:
+            try:
+                with startup_phase("gemini_sdk"):
+                    import google.generativeai as _genai
+                    _genai.configure(api_key=settings.GEMINI_API_KEY)
+                genai = _genai
+            except Exception as e:
+                logger.error(f"CRITICAL: Failed to initialize Gemini SDK: {e}", exc_info=True)
+            finally:
+                # Only marked once the attempt has finished, so concurrent callers wait above.
+                _genai_init_attempted = True
+    return genai
+
+def _build_model(sdk, prompt_name: str):
+    generation_config = sdk.GenerationConfig(max_output_tokens=8192)
     safety_settings=[
         {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
         {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
         {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
         {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
     ]
-    model = genai.GenerativeModel(
+    system_instruction = STATIC_PROMPTS[prompt_name]
+    static_tokens = estimate_token_count(system_instruction)
+    if settings.GEMINI_CONTEXT_CACHE == "auto" and static_tokens < settings.GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+        logger.info(f"Prompt '{prompt_name}' ({static_tokens} tokens) is below the context cache minimum. Using system_instruction only.")
+    elif settings.GEMINI_CONTEXT_CACHE == "auto":
+        try:
+            from datetime import timedelta
+            cached = sdk.caching.CachedContent.create(
+                model=settings.GEMINI_MODEL_NAME,
+                display_name=f"rag-{prompt_name}",
+                system_instruction=system_instruction,
+                ttl=timedelta(seconds=settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS),
+            )
+            static_prompt_tokens[prompt_name] = getattr(cached.usage_metadata, "total_token_count", 0) or static_tokens
+            _model_expiry[prompt_name] = time.time() + settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS
+            logger.info(f"Prompt '{prompt_name}' served from Gemini context cache '{cached.name}'.")
+            return sdk.GenerativeModel.from_cached_content(
+                cached_content=cached, generation_config=generation_config, safety_settings=safety_settings
+            )
+        except Exception as e:
+            logger.info(f"Context cache unavailable for prompt '{prompt_name}' ({e}). Using system_instruction only.")
+
+    static_prompt_tokens[prompt_name] = static_tokens
+    return sdk.GenerativeModel(
         model_name=settings.GEMINI_MODEL_NAME,
         generation_config=generation_config,
-        safety_settings=safety_settings
+        safety_settings=safety_settings,
+        system_instruction=system_instruction,
     )
-    logger.info(f"Gemini model '{settings.GEMINI_MODEL_NAME}' initialized.")
-except Exception as e:
-    logger.error(f"CRITICAL: Failed to initialize Gemini model: {e}", exc_info=True)
 
-try:
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-except Exception as e:
-     logger.warning(f"Could not load tiktoken tokenizer: {e}. Context truncation might be less accurate.")
-     tokenizer = None
+_model_lock = threading.Lock()
+
+def _loaded_model(prompt_name: str):
+    """The built model for a prompt if it exists and its context cache is not about to expire."""
+    expires_at = _model_expiry.get(prompt_name)
+    if prompt_name in models and (expires_at is None or time.time() < expires_at - CACHE_REFRESH_MARGIN_SECONDS):
+        return models[prompt_name]
+    return None
+
+def get_model(prompt_name: str = "answer"):
+    """
+    Returns the long-lived model for a static prompt, or None if Gemini is unavailable.
+    Blocking (SDK import, context cache creation); request handlers use `get_model_async`.
+    """
+    model = _loaded_model(prompt_name)
+    if model is not None:
+        return model
+    sdk = _get_genai()
+    if sdk is None:
+        return None
+    with _model_lock:
+        model = _loaded_model(prompt_name) # Built by a concurrent caller while we waited
+        if model is not None:
+            return model
+        try:
+            with startup_phase(f"gemini_model_{prompt_name}"):
+                models[prompt_name] = _build_model(sdk, prompt_name)
+            logger.info(f"Gemini model '{settings.GEMINI_MODEL_NAME}' initialized for prompt '{prompt_name}'.")
+        except Exception as e:
+            logger.error(f"CRITICAL: Failed to initialize Gemini model for prompt '{prompt_name}': {e}", exc_info=True)
+            return None
+        return models[prompt_name]
+
+async def get_model_async(prompt_name: str = "answer"):
+    """`get_model` for the event loop: a cold or in-flight load is awaited in a worker thread."""
+    model = _loaded_model(prompt_name)
+    if model is not None:
+        return model
+    return await asyncio.to_thread(get_model, prompt_name)
+
+def get_tokenizer(wait: bool = True):
+    """
+    Returns the shared tiktoken encoding, or None if unavailable. With
+    `wait=False`, returns None instead of waiting for a load in progress.
+    """
+    global tokenizer, _tokenizer_init_attempted
+    if tokenizer is not None or _tokenizer_init_attempted:
+        return tokenizer
+    if not _tokenizer_lock.acquire(blocking=wait):
+        return None
+    try:
+        if tokenizer is None and not _tokenizer_init_attempted:
+            try:
+                with startup_phase("tiktoken_tokenizer"):
+                    import tiktoken
+                    tokenizer = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                 logger.warning(f"Could not load tiktoken tokenizer: {e}. Context truncation might be less accurate.")
+            finally:
+                _tokenizer_init_attempted = True
+    finally:
+        _tokenizer_lock.release()
+    return tokenizer
 
 def estimate_token_count(text: str) -> int:
+    # Never blocks the event loop on a tokenizer load; counts words until it is ready.
+    tokenizer = get_tokenizer(wait=False)
     if not tokenizer or not text:
         return len(text.split())
     return len(tokenizer.encode(text))
 
-ROUTER_PROMPT = '''Your job is to classify the user's intent based on their query. The two possible intents are "chit_chat" and "query_documents".
+ROUTER_SYSTEM_INSTRUCTION = '''Your job is to classify the user's intent based on their query. The two possible intents are "chit_chat" and "query_documents".
 
 1.  **chit_chat**: The user is having a general conversation, asking a question not related to specific documents, or expressing a greeting.
     *   Examples: "Hello", "How are you?", "What's the weather like?", "Who won the world series?"
@@ -43,24 +167,51 @@ ROUTER_PROMPT = '''Your job is to classify the user's intent based on their quer
 2.  **query_documents**: The user is asking a question that is expected to be answered from a specific set of documents.
     *   Examples: "What is the policy on remote work?", "Summarize the project proposal.", "Compare the results from the Q3 report to the Q4 report."
 
-Respond with ONLY "chit_chat" or "query_documents".
+Respond with ONLY "chit_chat" or "query_documents".'''
 
-User Query: "{query}"
+ROUTER_PROMPT = '''User Query: "{query}"
 Intent:'''
 
-REWRITER_PROMPT = '''You are an expert query rewriter. Your task is to transform a user's conversational query into an optimized, keyword-rich query for a vector database search.
+REWRITER_SYSTEM_INSTRUCTION = '''You are an expert query rewriter. Your task is to transform a user's conversational query into an optimized, keyword-rich query for a vector database search.
 
-Focus on extracting key terms, concepts, and entities. Remove conversational filler.
+Focus on extracting key terms, concepts, and entities. Remove conversational filler.'''
 
-User Query: "{query}"
+REWRITER_PROMPT = '''User Query: "{query}"
 Rewritten Query:'''
 
+token_usage: dict[str, dict[str, int]] = {}
+
+def _record_usage(prompt_name: str, response) -> None:
+    """Splits a response's prompt tokens into the static (system instruction) and dynamic parts."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    static = min(cached_tokens or static_prompt_tokens.get(prompt_name, 0), prompt_tokens)
+    totals = token_usage.setdefault(prompt_name, {"requests": 0, "static": 0, "dynamic": 0, "cached": 0, "response": 0})
+    totals["requests"] += 1
+    totals["static"] += static
+    totals["dynamic"] += prompt_tokens - static
+    totals["cached"] += cached_tokens
+    totals["response"] += getattr(usage, "candidates_token_count", 0) or 0
+    logger.info(f"LLM '{prompt_name}' prompt tokens: {static} static ({cached_tokens} cached) + {prompt_tokens - static} dynamic.")
+
+def get_token_usage_report() -> dict:
+    """Per-prompt token totals for this instance, with the average dynamic tokens per request."""
+    return {
+        name: {**totals, "avg_dynamic_per_request": round(totals["dynamic"] / totals["requests"], 1) if totals["requests"] else 0}
+        for name, totals in token_usage.items()
+    }
+
 async def route_query(query: str) -> str:
+    model = await get_model_async("router")
     if not model:
         return "query_documents" # Default behavior if router fails
     try:
         prompt = ROUTER_PROMPT.format(query=query)
         response = await model.generate_content_async(prompt)
+        _record_usage("router", response)
         intent = response.text.strip().lower()
         if "chit_chat" in intent:
             return "chit_chat"
@@ -70,18 +221,19 @@ async def route_query(query: str) -> str:
         return "query_documents"
 
 async def rewrite_query_for_search(query: str) -> str:
+    model = await get_model_async("rewriter")
     if not model:
         return query # Return original query if rewriter fails
     try:
         prompt = REWRITER_PROMPT.format(query=query)
         response = await model.generate_content_async(prompt)
+        _record_usage("rewriter", response)
         return response.text.strip()
     except Exception as e:
         logger.error(f"Error rewriting query: {e}", exc_info=True)
         return query
 
-ANSWER_GENERATOR_PROMPT_TEMPLATE = '''
-You are an advanced AI assistant ('Big Brain') 🧠 for a RAG system. Your goal is to provide highly accurate and synthesized answers based *solely* on the provided context sections.
+ANSWER_SYSTEM_INSTRUCTION = '''You are an advanced AI assistant ('Big Brain') 🧠 for a RAG system. Your goal is to provide highly accurate and synthesized answers based *solely* on the provided context sections.
 
 Objective: Carefully analyze the `[QUESTION]` and the `[CONTEXT]` snippets (which may include general knowledge from Elasticsearch and specific session content). Construct a comprehensive and coherent answer by synthesizing information *only* from the `[CONTEXT]`.
 
@@ -104,9 +256,9 @@ Critical Instructions:
 *   **Example 3:**
     *   [CONTEXT]: "Document 1: The project deadline is November 10th."
     *   [QUESTION]: "What is the capital of France?"
-    *   [ANSWER]: "I'm sorry, I couldn't find an answer to that in the provided documents."
----
-Current Task:
+    *   [ANSWER]: "I'm sorry, I couldn't find an answer to that in the provided documents."'''
+
+ANSWER_GENERATOR_PROMPT_TEMPLATE = '''Current Task:
 
 [CONTEXT]
 {context_str}
@@ -116,53 +268,53 @@ Current Task:
 
 [ANSWER]:'''
 
-async def generate_final_answer(original_query: str, elastic_context: list[str], session_context: str | None) -> str:
+STATIC_PROMPTS = {
+    "router": ROUTER_SYSTEM_INSTRUCTION,
+    "rewriter": REWRITER_SYSTEM_INSTRUCTION,
+    "answer": ANSWER_SYSTEM_INSTRUCTION,
+}
+
+async def generate_final_answer(original_query: str, elastic_context: list[str], session_context: list[str] | None) -> str:
+    """
+    `session_context` holds the session chunks already retrieved as relevant to
+    the query (see session_store), not the whole session document.
+    """
+    model = await get_model_async("answer")
     if not model:
         logger.error("Answer Generator: Gemini model not available.")
         return "Sorry, I encountered an error and cannot generate an answer right now."
 
-    combined_context_parts = []
-    if elastic_context:
-        combined_context_parts.extend([f"Retrieved Document Snippet:\n{chunk}" for chunk in elastic_context])
-    if session_context:
-        combined_context_parts.append(f"User Provided Session Context:\n{session_context}")
+    elastic_parts = [f"Retrieved Document Snippet:\n{chunk}" for chunk in elastic_context or []]
+    session_parts = [f"User Provided Session Context:\n{chunk}" for chunk in session_context or []]
 
-    if not combined_context_parts:
+    if not elastic_parts and not session_parts:
         logger.info("Answer Generator: No context provided (neither Elastic nor session).")
         return "I'm sorry, I couldn't find an answer to that in the provided documents."
 
     RESERVED_TOKENS = 500
     MAX_EFFECTIVE_CONTEXT_TOKENS = settings.MAX_CONTEXT_TOKENS - RESERVED_TOKENS
 
-    full_context_str = "\n\n---\n\n".join(combined_context_parts)
-    estimated_tokens = estimate_token_count(full_context_str)
-    final_context_str = full_context_str
-
-    if estimated_tokens > MAX_EFFECTIVE_CONTEXT_TOKENS:
-        logger.warning(f"Combined context ({estimated_tokens} tokens) exceeds limit ({MAX_EFFECTIVE_CONTEXT_TOKENS}). Truncating.")
-        elastic_str = "\n\n---\n\n".join([f"Retrieved Document Snippet:\n{chunk}" for chunk in elastic_context])
-        elastic_tokens = estimate_token_count(elastic_str)
-        remaining_tokens = MAX_EFFECTIVE_CONTEXT_TOKENS - elastic_tokens
-
-        if remaining_tokens > 100 and session_context:
-            truncated_session_context = session_context[:int(remaining_tokens * 3)]
-            if tokenizer:
-                session_tokens = tokenizer.encode(session_context)
-                truncated_session_context = tokenizer.decode(session_tokens[:remaining_tokens])
-
-            final_context_str = elastic_str + f"\n\n---\n\nUser Provided Session Context (truncated):\n{truncated_session_context}..."
-            logger.info("Truncated session context to fit within token limit.")
-        else:
-            final_context_str = elastic_str
-            logger.warning("Session context dropped due to token limit after keeping Elastic context.")
-
-    elif not combined_context_parts:
-         final_context_str = "{empty}"
+    # Elastic context is kept whole; relevant session chunks are added while they fit.
+    context_parts = list(elastic_parts)
+    used_tokens = estimate_token_count("\n\n---\n\n".join(elastic_parts)) if elastic_parts else 0
+    dropped_session_chunks = 0
+    for part in session_parts:
+        part_tokens = estimate_token_count(part)
+        if used_tokens + part_tokens > MAX_EFFECTIVE_CONTEXT_TOKENS:
+            dropped_session_chunks += 1
+            continue
+        context_parts.append(part)
+        used_tokens += part_tokens
+    if dropped_session_chunks:
+        logger.warning(f"Dropped {dropped_session_chunks} session chunk(s) to fit the {MAX_EFFECTIVE_CONTEXT_TOKENS}-token context limit.")
+
+    final_context_str = "\n\n---\n\n".join(context_parts) if context_parts else "{empty}"
 
     prompt = ANSWER_GENERATOR_PROMPT_TEMPLATE.format(context_str=final_context_str, original_query=original_query)
 
     try:
         response = await model.generate_content_async(prompt)
+        _record_usage("answer", response)
 
         if not response.parts:
              logger.warning("Answer Generator received empty response parts, potentially blocked.")
@@ -1,20 +1,30 @@
-from sentence_transformers import SentenceTransformer
 from app.core.config import settings
+from app.core.profiling import startup_phase
 from app.services.es_client import get_es_client
+from app.services.embedding_client import embedding_client
 import logging
-from typing import List
+from typing import List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 logger = logging.getLogger(__name__)
 
 embedding_model = None
 
-def get_embedding_model() -> SentenceTransformer:
-    """Initializes and returns a thread-safe SentenceTransformer model."""
+def get_embedding_model() -> "SentenceTransformer":
+    """
+    Initializes and returns a thread-safe SentenceTransformer model.
+    `sentence_transformers` (and torch) are imported here, on first use,
+    to keep them off the cold-start import path.
+    """
     global embedding_model
     if embedding_model is None:
         try:
             logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL_NAME}")
-            embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
+            with startup_phase("embedding_model"):
+                from sentence_transformers import SentenceTransformer
+                embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
             logger.info("Embedding model loaded successfully.")
         except Exception as e:
             logger.error(f"Failed to load embedding model: {e}", exc_info=True)
@@ -25,13 +35,12 @@ async def perform_hybrid_search(user_id: str, query: str) -> List[str]:
     """Performs a hybrid search (BM25 + kNN) in Elasticsearch."""
     try:
         es = get_es_client()
-        model = get_embedding_model()
+        query_vector = await embedding_client.embed_query(query)
     except Exception as e:
         logger.error(f"Search prerequisites failed: {e}")
         return []
 
     try:
-        query_vector = model.encode(query, convert_to_tensor=False).tolist()
 
         search_body = {
             "query": {
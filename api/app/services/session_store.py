@@ -0,0 +1,202 @@
+import base64
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embedding_client import embedding_client
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SessionDocument:
+    """A session document, chunked and embedded once at upload time."""
+    user_id: str
+    chunks: List[str]
+    vectors: np.ndarray # (n_chunks, dim), L2-normalized float32; empty when the document fits in SESSION_TOP_K chunks
+    created_at: float
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "user_id": self.user_id,
+            "chunks": self.chunks,
+            "shape": list(self.vectors.shape),
+            "vectors": base64.b64encode(self.vectors.astype(np.float32).tobytes()).decode("ascii"),
+            "created_at": self.created_at,
+        })
+
+    @classmethod
+    def from_json(cls, payload: str | bytes) -> "SessionDocument":
+        data = json.loads(payload)
+        vectors = np.frombuffer(base64.b64decode(data["vectors"]), dtype=np.float32).reshape(data["shape"])
+        return cls(user_id=data["user_id"], chunks=data["chunks"], vectors=vectors, created_at=data["created_at"])
+
+
+def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
+    """Splits text into ~chunk_size character windows, preferring paragraph/sentence breaks."""
+    text = text.strip()
+    if len(text) <= chunk_size:
+        return [text] if text else []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # Back off to the last natural break inside the window, if there is one.
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = text.rfind(separator, start + chunk_size // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        # Start the overlap on a word boundary rather than mid-word.
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return chunks
+
+
+class SessionStore:
+    """
+    Stores session documents so the client uploads them once instead of on
+    every turn. An in-process LRU serves warm instances; an optional Redis
+    tier lets sessions survive cold starts and be shared across instances.
+    Without it, a query that reaches an instance without the session gets a
+    404 and the client resends the document once.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, redis_url: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local: "OrderedDict[str, SessionDocument]" = OrderedDict()
+        self._redis_url = redis_url
+        self._redis = None
+
+    def _get_redis(self):
+        if self._redis is None and self._redis_url:
+            try:
+                import redis.asyncio as redis
+                self._redis = redis.from_url(self._redis_url)
+            except ImportError:
+                logger.warning("SESSION_REDIS_URL is set but the 'redis' package is not installed. Using in-process store only.")
+                self._redis_url = None
+        return self._redis
+
+    def _put_local(self, session_id: str, document: SessionDocument) -> None:
+        self._local[session_id] = document
+        self._local.move_to_end(session_id)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def create(self, user_id: str, text: str) -> tuple[str, int]:
+        """
+        Chunks and embeds a session document. Returns (session_id, chunk_count).
+        The session_id is derived from (user_id, text), so re-sending the same
+        document (as legacy clients do every turn) reuses the stored session.
+        A document of at most SESSION_TOP_K chunks is always sent whole, so it
+        is not embedded.
+        """
+        chunks = chunk_text(text, settings.SESSION_CHUNK_SIZE, settings.SESSION_CHUNK_OVERLAP)
+        if not chunks:
+            raise ValueError("Session document is empty.")
+        session_id = self._session_id(user_id, text)
+        existing = await self.get(session_id)
+        if existing is not None and existing.user_id == user_id:
+            return session_id, len(existing.chunks)
+        if len(chunks) > settings.SESSION_TOP_K:
+            vectors = await embedding_client.embed(chunks, normalize=True)
+        else:
+            vectors = np.empty((0, 0), dtype=np.float32)
+        document = SessionDocument(
+            user_id=user_id,
+            chunks=chunks,
+            vectors=vectors,
+            created_at=time.time(),
+        )
+        self._put_local(session_id, document)
+
+        redis = self._get_redis()
+        if redis:
+            try:
+                await redis.set(self._redis_key(session_id), document.to_json(), ex=self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Could not persist session {session_id} to Redis: {e}")
+        logger.info(f"Created session '{session_id}' for user '{user_id}' with {len(chunks)} chunks.")
+        return session_id, len(chunks)
+
+    async def get(self, session_id: str) -> Optional[SessionDocument]:
+        document = self._local.get(session_id)
+        if document is not None:
+            if time.time() - document.created_at > self.ttl_seconds:
+                del self._local[session_id]
+                return None
+            self._local.move_to_end(session_id)
+            return document
+
+        redis = self._get_redis()
+        if redis:
+            try:
+                payload = await redis.get(self._redis_key(session_id))
+                if payload:
+                    document = SessionDocument.from_json(payload)
+                    self._put_local(session_id, document)
+                    return document
+            except Exception as e:
+                logger.warning(f"Could not load session {session_id} from Redis: {e}")
+        return None
+
+    async def delete(self, session_id: str, user_id: str) -> bool:
+        """Removes a session. Returns False if it does not exist (or belongs to another user)."""
+        document = await self.get(session_id)
+        if document is None or document.user_id != user_id:
+            return False
+        self._local.pop(session_id, None)
+        redis = self._get_redis()
+        if redis:
+            try:
+                await redis.delete(self._redis_key(session_id))
+            except Exception as e:
+                logger.warning(f"Could not delete session {session_id} from Redis: {e}")
+        return True
+
+    async def retrieve(self, session_id: str, user_id: str, query: str, top_k: int) -> Optional[List[str]]:
+        """
+        Returns the session chunks most similar to the query, in document order.
+        Returns None if the session does not exist (or belongs to another user).
+        """
+        document = await self.get(session_id)
+        if document is None or document.user_id != user_id:
+            return None
+        if len(document.chunks) <= top_k or not len(document.vectors):
+            return list(document.chunks)
+
+        query_vector = await embedding_client.embed_query(query, normalize=True)
+        scores = document.vectors @ np.asarray(query_vector, dtype=np.float32)
+        top_indices = np.argpartition(-scores, top_k)[:top_k]
+        return [document.chunks[i] for i in sorted(top_indices)]
+
+    @staticmethod
+    def _session_id(user_id: str, text: str) -> str:
+        return hashlib.sha256(f"{user_id}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _redis_key(session_id: str) -> str:
+        return f"rag:session:{session_id}"
+
+
+session_store = SessionStore(
+    max_entries=settings.SESSION_MAX_ENTRIES,
+    ttl_seconds=settings.SESSION_TTL_SECONDS,
+    redis_url=settings.SESSION_REDIS_URL,
+)
@@ -1,6 +1,12 @@
-from fastapi import FastAPI
-from mangum import Mangum
-from app.api.chat import router as chat_router
+from app.core.profiling import startup_phase, get_startup_report
+with startup_phase("app_import"):
+    from fastapi import FastAPI
+    from mangum import Mangum
+    from app.api.chat import router as chat_router
+    from app.core.config import settings
+    from app.core.warmup import warm_up
+    from app.services.llm_services import get_token_usage_report
+    from app.services.embedding_client import embedding_client
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -15,10 +21,28 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     logger.info("Application startup...")
+    if settings.WARMUP_ON_STARTUP:
+        await warm_up()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Application shutdown.")
+    await embedding_client.aclose()
+
+@app.post("/api/warmup")
+async def warmup_endpoint():
+    """Loads heavy dependencies ahead of real traffic (e.g. from a scheduled ping)."""
+    return await warm_up()
+
+@app.get("/api/startup-profile")
+async def startup_profile_endpoint():
+    """Reports how long each lazily loaded startup phase took in this instance."""
+    return get_startup_report()
+
+@app.get("/api/llm-usage")
+async def llm_usage_endpoint():
+    """Reports static vs. dynamic prompt tokens per LLM call site in this instance."""
+    return get_token_usage_report()
 
 app.include_router(chat_router, prefix="/api")
 
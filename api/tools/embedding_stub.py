@@ -0,0 +1,58 @@
+"""
+Local stand-in for the backend's /api/embed endpoint, for developing and
+testing the api/ app without torch or the Cloud Run backend.
+
+Vectors are deterministic pseudo-embeddings derived from a hash of each
+text: identical texts get identical vectors, but similarity carries no
+meaning. The request and response shapes match the real endpoint.
+
+Usage (from api/):
+    python -m tools.embedding_stub --port 8081
+    EMBEDDING_SERVICE_URL=http://127.0.0.1:8081 uvicorn index:app
+"""
+import argparse
+import hashlib
+from typing import List
+
+import numpy as np
+from fastapi import FastAPI
+from pydantic import BaseModel, Field
+
+DIM = 384
+
+app = FastAPI(title="Embedding service stand-in")
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str] = Field(..., min_length=1)
+    normalize: bool = False
+
+
+def fake_vector(text: str, normalize: bool) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    if normalize:
+        vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+@app.post("/api/embed")
+async def embed(request: EmbedRequest):
+    return {
+        "model": "stub",
+        "dim": DIM,
+        "vectors": [fake_vector(text, request.normalize) for text in request.texts],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
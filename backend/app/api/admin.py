@@ -0,0 +1,85 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from app.core.config import settings
+from app.services.slow_query_log import slow_query_log
+from app.services.prompt_cache import prompt_cache
+from app.services.tenant_scheduler import tenant_scheduler
+from app.services.model_registry import model_registry
+from app.services.circuit_breaker import breaker_report
+from app.core.log_export import logging_report
+from app.services.answer_index import answer_index_report
+import asyncio
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def verify_admin_key(x_admin_key: str | None = Header(None)):
+    """
+    Requires the X-Admin-Key header to match ADMIN_API_KEY. Fails closed: the
+    endpoints expose user ids and raw queries, so they are disabled while no key is set.
+    """
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin endpoints are disabled (ADMIN_API_KEY is not set).")
+    if not x_admin_key or not hmac.compare_digest(x_admin_key.encode(), settings.ADMIN_API_KEY.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin key.")
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(verify_admin_key)])
+
+@router.get("/slow-queries")
+async def list_slow_queries(limit: int = Query(20, ge=1, le=500)):
+    """
+    Lists the slowest recently captured hybrid searches, with their query body,
+    timings and the ES profile of the fused query and its BM25/kNN halves.
+    """
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "sample_rate": slow_query_log.sample_rate,
+        "captured": len(slow_query_log.entries),
+        "profiles_skipped": slow_query_log.profiles_skipped,
+        "queries": slow_query_log.slowest(limit),
+    }
+
+@router.get("/prompt-cache")
+async def prompt_cache_status():
+    """Shows each static prompt's size in tokens and whether it is served from a Gemini context cache."""
+    return {"mode": prompt_cache.mode, "prompts": prompt_cache.report()}
+
+@router.get("/ingestion/tenants")
+async def ingestion_tenants():
+    """Per-tenant ingestion backlog, running tasks, quota and queue wait times."""
+    try:
+        tenants = await asyncio.to_thread(tenant_scheduler.report)
+    except Exception as e:
+        logger.error("Could not read tenant ingestion state: %s", e, exc_info=True)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Ingestion state unavailable.")
+    return {
+        "max_concurrency_per_tenant": settings.TENANT_MAX_CONCURRENCY,
+        "tenants": dict(sorted(tenants.items(), key=lambda item: -item[1]["backlog"])),
+    }
+
+@router.get("/breakers")
+async def circuit_breakers():
+    """State of this instance's Elasticsearch and Gemini circuit breakers (closed, open or half_open)."""
+    return breaker_report()
+
+@router.get("/models")
+async def loaded_models():
+    """Models resident in this process (one per name and device), their memory and load time, and process RSS."""
+    return model_registry.report()
+
+@router.get("/logging")
+async def log_export_status():
+    """Log export queue depth, dropped and sampled-out records, and batch sizes for this instance."""
+    return logging_report()
+
+@router.get("/answer-index")
+async def answer_index_status():
+    """
+    Offline answer index: the corpus it was built from vs. the current one,
+    stored answers, and the share of this instance's answers served without a live LLM call.
+    """
+    try:
+        return await answer_index_report()
+    except Exception as e:
+        logger.error("Could not read answer index state: %s", e, exc_info=True)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Answer index state unavailable.")
@@ -1,69 +1,280 @@
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+import asyncio
 import logging
+from typing import List
 # Use the correct QueryRequest without session context
-from app.models.models import QueryRequest as ChatQueryRequest, QueryResponse
+from app.models.models import QueryRequest as ChatQueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResult
+from app.core.config import settings
 from app.services.llm_services import (
     route_query,
     rewrite_query_for_search,
+    plan_query,
     generate_final_answer # Needs only elastic_context now
 )
-from app.services.search_service import perform_hybrid_search
+from app.services.search_service import perform_hybrid_search, perform_hybrid_search_batch
+from app.services.adaptive_retrieval import adaptive_retrieve, is_keyword_query, cut_by_scores
+from app.services.answer_index import lookup_answer, lookup_answers, record_answer
+from app.services.circuit_breaker import breakers, CircuitOpenError
+from app.core.metrics import time_stage, query_intents_total
+from app.core.traffic_recorder import annotate, user_bucket
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+GENERATION_UNAVAILABLE = "Answer generation is temporarily unavailable. Please retry shortly."
+
+def _generation_unavailable(e: CircuitOpenError) -> HTTPException:
+    """503 with Retry-After for a request that cannot be answered while the Gemini circuit is open."""
+    retry_after = max(1, int(e.retry_after))
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=GENERATION_UNAVAILABLE,
+        headers={"Retry-After": str(retry_after)},
+    )
+
 @router.post("/query", response_model=QueryResponse)
 async def handle_rag_query(request: ChatQueryRequest): # Use correct model name
     """
     Handles user queries using the 4-component RAG pipeline against
     pre-loaded and user-specific indexed data.
     """
-    logger.info(f"Received query from user '{request.user_id}': '{request.query_text[:50]}...'")
+    logger.info("Received query from user '%s': '%.50s...'", request.user_id, request.query_text)
 
     if not request.query_text:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query text cannot be empty.")
+    annotate(user_bucket=user_bucket(request.user_id), query_chars=[len(request.query_text)])
 
+    # Degraded modes while a circuit breaker is open (see circuit_breaker):
+    # no ES search -> answer without retrieval; no rewrite -> search the raw query;
+    # no generation -> fail fast with 503.
+    degraded = []
     try:
+        # --- Offline answer index: a close match to a pre-answered question needs no LLM call ---
+        # (unless the user's own documents also match; those are only searched live)
+        stored = await lookup_answer(request.user_id, request.query_text) if settings.ANSWER_INDEX_ALIAS else None
+        if stored:
+            logger.info("Answered from the answer index (similarity %.3f to '%.50s').", stored.similarity, stored.question)
+            annotate(intent="answer_index")
+            record_answer("answer_index")
+            return QueryResponse(answer=stored.answer, sources=stored.sources)
+
         # --- Component 1: Route Query ---
-        intent = await route_query(request.query_text)
-        logger.debug(f"Query intent classified as: {intent}")
+        # With QUERY_PLANNER=single one structured call also returns the search query
+        # and an optional file filter; if it falls back, only the routing is reused.
+        planned_query, file_name = None, None
+        if settings.QUERY_PLANNER == "single":
+            with time_stage("plan"):
+                plan = await plan_query(request.query_text, rewrite=False)
+            intent = plan.intent
+            if plan.source == "planner":
+                planned_query, file_name = plan.search_query, plan.file_name
+        else:
+            with time_stage("route"):
+                intent = await route_query(request.query_text)
+        query_intents_total.labels(intent=intent).inc()
+        annotate(intent=intent)
+        logger.debug("Query intent classified as: %s", intent)
 
         if intent == "chit_chat":
             logger.info("Handling as chit-chat.")
             # Pass empty context list to answer generator for chit-chat
-            answer = await generate_final_answer(request.query_text, elastic_context=[], session_context=None)
+            with time_stage("generate"):
+                answer = await generate_final_answer(request.query_text, elastic_context=[], session_context=None)
+            record_answer("llm")
             return QueryResponse(answer=answer)
 
         # --- RAG Pipeline for "query_documents" ---
         logger.info("Handling as document query.")
 
-        # --- Component 2: Rewrite Query ---
-        rewritten_query = await rewrite_query_for_search(request.query_text)
-        logger.debug(f"Rewritten query for search: '{rewritten_query}'")
+        if not breakers["es_search"].available():
+            logger.warning("Search circuit is open; answering without retrieval.")
+            degraded.append("retrieval_unavailable")
+            elastic_context_chunks = []
+        elif settings.ADAPTIVE_RETRIEVAL:
+            # --- Components 2 & 3: Rewrite only when needed, size context by scores ---
+            elastic_context_chunks = await adaptive_retrieve(request.user_id, request.query_text, planned_query, file_name)
+        else:
+            # --- Component 2: Rewrite Query ---
+            if planned_query:
+                rewritten_query = planned_query
+            elif breakers["gemini_rewrite"].available():
+                with time_stage("rewrite"):
+                    rewritten_query = await rewrite_query_for_search(request.query_text)
+            else:
+                degraded.append("rewrite_skipped")
+                rewritten_query = request.query_text
+            logger.debug("Rewritten query for search: '%s'", rewritten_query)
 
-        # --- Component 3: Database Search (Elastic Cloud Hybrid) ---
-        # Search includes user-specific AND preloaded docs via user_id filtering logic in search_service
-        elastic_context_chunks = await perform_hybrid_search(request.user_id, rewritten_query)
+            # --- Component 3: Database Search (Elastic Cloud Hybrid) ---
+            # Search includes user-specific AND preloaded docs via user_id filtering logic in search_service
+            elastic_context_chunks = await perform_hybrid_search(request.user_id, rewritten_query, file_name=file_name)
+        if not elastic_context_chunks and "retrieval_unavailable" not in degraded and not breakers["es_search"].available():
+            # The search circuit opened during this request.
+            degraded.append("retrieval_unavailable")
         if not elastic_context_chunks:
             logger.info("No relevant context found in documents (user or preloaded).")
             # Let Component 4 handle the "not found" response
 
         # --- Component 4: Generate Final Answer ---
         # Pass only elastic_context, session_context is None
-        final_answer = await generate_final_answer(
-            original_query=request.query_text,
-            elastic_context=elastic_context_chunks,
-            session_context=None # No session context in this version
-        )
-        logger.info(f"Generated final answer for user '{request.user_id}'.")
+        with time_stage("generate"):
+            final_answer = await generate_final_answer(
+                original_query=request.query_text,
+                elastic_context=elastic_context_chunks,
+                session_context=None, # No session context in this version
+                retrieval_available="retrieval_unavailable" not in degraded
+            )
+        logger.info("Generated final answer for user '%s'.", request.user_id)
+        record_answer("llm")
 
-        return QueryResponse(answer=final_answer)
+        if degraded:
+            annotate(degraded=degraded)
+        return QueryResponse(answer=final_answer, degraded=degraded or None)
 
     except HTTPException as http_exc:
          raise http_exc
+    except CircuitOpenError as e:
+        logger.warning("Failing query for user '%s' fast: %s", request.user_id, e)
+        raise _generation_unavailable(e)
     except Exception as e:
-        logger.error(f"Error processing query for user '{request.user_id}': {e}", exc_info=True)
+        logger.error("Error processing query for user '%s': %s", request.user_id, e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred while processing your query."
         )
+
+
+@router.post("/query/batch", response_class=StreamingResponse)
+async def handle_rag_query_batch(request: BatchQueryRequest):
+    """
+    Answers many queries in one request. Queries are routed and rewritten with
+    bounded concurrency, embedded in one batched `encode`, retrieved with a
+    single ES `_msearch`, and answered with bounded concurrency. Results are
+    streamed back as NDJSON (one `BatchQueryResult` per line) as each answer
+    finishes, so they arrive out of order; use `index` to match them up.
+    """
+    if len(request.queries) > settings.BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {settings.BATCH_MAX_QUERIES} queries."
+        )
+    logger.info("Received batch of %d queries.", len(request.queries))
+    annotate(
+        batch_size=len(request.queries),
+        user_bucket=[user_bucket(q.user_id) for q in request.queries],
+        query_chars=[len(q.query_text) for q in request.queries],
+    )
+    return StreamingResponse(_stream_batch_answers(request.queries), media_type="application/x-ndjson")
+
+
+async def _stream_batch_answers(queries: List[ChatQueryRequest]):
+    llm_slots = asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
+
+    async def bounded(stage: str, fn, *args, **kwargs):
+        async with llm_slots:
+            with time_stage(stage):
+                return await fn(*args, **kwargs)
+
+    # --- Offline answer index: one batched lookup; matched queries skip the pipeline ---
+    stored = (
+        await lookup_answers([(query.user_id, query.query_text) for query in queries]) if settings.ANSWER_INDEX_ALIAS
+        else [None] * len(queries)
+    )
+
+    # --- Components 1 & 2: Route and rewrite (bounded concurrency) ---
+    # Each plan is (intent, search query, file filter).
+    async def plan(query: ChatQueryRequest, stored_answer):
+        if not query.query_text:
+            return None, None, None
+        if stored_answer:
+            return "answer_index", None, None
+        if settings.QUERY_PLANNER == "single":
+            query_plan = await bounded("plan", plan_query, query.query_text, rewrite=False)
+            intent = query_plan.intent
+            if query_plan.source == "planner":
+                query_intents_total.labels(intent=intent).inc()
+                return intent, query_plan.search_query, query_plan.file_name
+        else:
+            intent = await bounded("route", route_query, query.query_text)
+        query_intents_total.labels(intent=intent).inc()
+        if intent == "chit_chat":
+            return intent, None, None
+        if settings.ADAPTIVE_RETRIEVAL and is_keyword_query(query.query_text):
+            return intent, query.query_text, None
+        if not breakers["gemini_rewrite"].available():
+            return intent, query.query_text, None
+        return intent, await bounded("rewrite", rewrite_query_for_search, query.query_text), None
+
+    plans = await asyncio.gather(*(plan(q, s) for q, s in zip(queries, stored)), return_exceptions=True)
+    annotate(intent=[None if isinstance(p, BaseException) else p[0] for p in plans])
+
+    # --- Component 3: One batched embed + one _msearch for all document queries ---
+    search_positions = [
+        i for i, p in enumerate(plans)
+        if not isinstance(p, BaseException) and p[0] == "query_documents"
+    ]
+    retrieval_available = breakers["es_search"].available()
+    if not retrieval_available:
+        logger.warning("Search circuit is open; answering the batch without retrieval.")
+        contexts = [[] for _ in search_positions]
+    elif settings.ADAPTIVE_RETRIEVAL:
+        scored = await perform_hybrid_search_batch(
+            [(queries[i].user_id, plans[i][1]) for i in search_positions],
+            top_k=settings.ADAPTIVE_MAX_K, with_scores=True,
+            file_names=[plans[i][2] for i in search_positions]
+        )
+        contexts = [[text for text, _ in hits[:cut_by_scores(hits)[0]]] for hits in scored]
+    else:
+        contexts = await perform_hybrid_search_batch(
+            [(queries[i].user_id, plans[i][1]) for i in search_positions],
+            file_names=[plans[i][2] for i in search_positions]
+        )
+    context_by_position = dict(zip(search_positions, contexts))
+    retrieval_available = retrieval_available and (any(contexts) or breakers["es_search"].available())
+
+    # --- Component 4: Generate answers (bounded concurrency), streamed as they finish ---
+    async def answer(i: int) -> BatchQueryResult:
+        query = queries[i]
+        result = BatchQueryResult(index=i, user_id=query.user_id)
+        plan_result = plans[i]
+        if isinstance(plan_result, BaseException):
+            logger.error("Batch query %s failed during planning: %s", i, plan_result)
+            result.error = "An unexpected error occurred while processing this query."
+            return result
+        intent = plan_result[0]
+        if intent is None:
+            result.error = "Query text cannot be empty."
+            return result
+        if stored[i]:
+            result.answer, result.sources = stored[i].answer, stored[i].sources
+            record_answer("answer_index")
+            return result
+        result.intent = intent
+        if intent == "query_documents" and not retrieval_available:
+            result.degraded = ["retrieval_unavailable"]
+        try:
+            result.answer = await bounded(
+                "generate", generate_final_answer,
+                original_query=query.query_text,
+                elastic_context=context_by_position.get(i, []),
+                session_context=None,
+                retrieval_available=retrieval_available or intent != "query_documents"
+            )
+            record_answer("llm")
+        except CircuitOpenError:
+            result.error = GENERATION_UNAVAILABLE
+        except Exception as e:
+            logger.error("Batch query %s failed during generation: %s", i, e, exc_info=True)
+            result.error = "An unexpected error occurred while processing this query."
+        return result
+
+    tasks = [asyncio.create_task(answer(i)) for i in range(len(queries))]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            result = await finished
+            yield result.model_dump_json(exclude_none=True) + "\n"
+    finally:
+        # Stop outstanding generations if the client disconnects mid-stream.
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from app.core.config import settings
+from app.core.metrics import time_stage
+from app.models.models import EmbedRequest, EmbedResponse
+from app.services.model_registry import get_embedding_model
+import asyncio
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def verify_embed_key(x_embed_key: str | None = Header(None)):
+    """Requires the X-Embed-Key header to match EMBED_API_KEY; the endpoint is disabled while it is unset."""
+    if not settings.EMBED_API_KEY:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Embedding service is disabled (EMBED_API_KEY is not set).")
+    if not x_embed_key or not hmac.compare_digest(x_embed_key.encode(), settings.EMBED_API_KEY.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid embedding service key.")
+
+router = APIRouter(dependencies=[Depends(verify_embed_key)])
+
+@router.post("/embed", response_model=EmbedResponse)
+async def embed_texts(request: EmbedRequest):
+    """
+    Embeds a batch of texts with the search embedding model in one `encode`
+    call, so clients without a local model get the same vectors as search.
+    """
+    if len(request.texts) > settings.EMBED_MAX_TEXTS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.EMBED_MAX_TEXTS} texts may be embedded per request."
+        )
+    model = get_embedding_model()
+    if model is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Embedding model is not loaded.")
+
+    with time_stage("embed"):
+        vectors = await asyncio.to_thread(
+            model.encode, request.texts, batch_size=64, show_progress_bar=False,
+            normalize_embeddings=request.normalize
+        )
+    return EmbedResponse(
+        model=settings.EMBEDDING_MODEL_NAME,
+        dim=int(vectors.shape[1]),
+        vectors=vectors.tolist()
+    )
@@ -1,8 +1,17 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, status
-from app.models.models import UploadResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Query, Response, status
+from app.models.models import UploadResponse, DeleteDocumentResponse
 from app.tasks.processing import process_document
 from app.core.config import settings
+from app.services.es_client import get_es_client
+from app.services.document_store import delete_document as delete_document_chunks
+from app.services.tenant_scheduler import tenant_scheduler, TenantBacklogFull, SMALL_FILE_PRIORITY
+from app.services.inline_ingest import INLINE_CONTENT_TYPES, is_inline_eligible, ingest_inline
+from app.core.traffic_recorder import annotate, user_bucket
+import asyncio
 import logging
+import time
+from typing import Literal
+import uuid
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -17,53 +26,143 @@ SUPPORTED_FILE_TYPES = {
 
 @router.post("/upload", response_model=UploadResponse, status_code=status.HTTP_202_ACCEPTED)
 async def upload_document(
+    response: Response,
     user_id: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    refresh: Literal["false", "true", "wait_for"] = Form("false")
 ):
     """
     Accepts a file upload, saves it temporarily, and queues it for processing.
+    Small .txt/.md files are indexed inline instead (201 with `indexed_chunks`);
+    with refresh=wait_for they are searchable when the response returns.
+    """
+    logger.info("Received file upload '%s' for user '%s'.", file.filename, user_id)
+    annotate(user_bucket=user_bucket(user_id), content_type=file.content_type, inline=False)
+    # Check the declared size first so a large text upload is not read into memory here.
+    if settings.INLINE_INGEST_MAX_BYTES and is_inline_eligible(file.content_type, file.size or 0):
+        content = await file.read()
+        await file.seek(0)
+        if is_inline_eligible(file.content_type, len(content)):
+            # Inline uploads count against the tenant's backlog like queued ones;
+            # on fallback the reservation carries over to the queued task.
+            backlog = await _admit(user_id)
+            try:
+                indexed = await ingest_inline(user_id, file.filename, content, refresh=refresh)
+            except Exception as e:
+                logger.warning("Inline ingest of '%s' failed (%s); queueing it instead.", file.filename, e)
+                indexed = None
+            if indexed is None:
+                return await _save_and_queue(user_id, file, replace=False, backlog=backlog)
+            await asyncio.to_thread(tenant_scheduler.finish, user_id)
+            annotate(upload_bytes=len(content), inline=True)
+            response.status_code = status.HTTP_201_CREATED
+            return UploadResponse(
+                file_name=file.filename,
+                content_type=file.content_type,
+                message="File indexed.",
+                indexed_chunks=indexed
+            )
+    return await _save_and_queue(user_id, file, replace=False)
+
+@router.put("/documents", response_model=UploadResponse, status_code=status.HTTP_202_ACCEPTED)
+async def replace_document(
+    user_id: str = Form(...),
+    file: UploadFile = File(...)
+):
+    """
+    Uploads a new version of a document. Once the new version is indexed, the
+    previous chunks of (user_id, file_name) are deleted by ID.
     """
-    logger.info(f"Received file upload '{file.filename}' for user '{user_id}'.")
+    logger.info("Received replacement of '%s' for user '%s'.", file.filename, user_id)
+    annotate(user_bucket=user_bucket(user_id), content_type=file.content_type, inline=False)
+    return await _save_and_queue(user_id, file, replace=True)
+
+@router.delete("/documents", response_model=DeleteDocumentResponse)
+async def delete_document(
+    user_id: str = Query(...),
+    file_name: str = Query(...)
+):
+    """Removes every indexed chunk of (user_id, file_name)."""
+    logger.info("Deleting document '%s' for user '%s'.", file_name, user_id)
+    try:
+        deleted = await delete_document_chunks(get_es_client(), user_id, file_name)
+    except Exception as e:
+        logger.error("Error deleting '%s' for user '%s': %s", file_name, user_id, e, exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while deleting the document."
+        )
+    if not deleted:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found.")
+    return DeleteDocumentResponse(user_id=user_id, file_name=file_name, deleted_chunks=deleted)
+
+async def _admit(user_id: str) -> int:
+    """Reserves a slot in the tenant's upload backlog; 429 over quota."""
+    try:
+        # The scheduler (and the Celery broker below) use blocking Redis clients; keep them off the event loop.
+        return await asyncio.to_thread(tenant_scheduler.admit, user_id)
+    except TenantBacklogFull as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many uploads pending for this user ({e.backlog}, limit {e.quota}). Retry once some have finished.",
+            headers={"Retry-After": str(settings.TENANT_RETRY_SECONDS * 6)}
+        )
 
+async def _save_and_queue(user_id: str, file: UploadFile, replace: bool, backlog: int | None = None) -> UploadResponse:
+    """Saves the upload and queues it. `backlog` is passed when the caller already admitted it."""
     if file.content_type not in SUPPORTED_FILE_TYPES:
-        logger.warning(f"Unsupported file type '{file.content_type}' for file '{file.filename}'.")
+        logger.warning("Unsupported file type '%s' for file '%s'.", file.content_type, file.filename)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Unsupported file type. Supported types are: PDF, DOCX, TXT, MD."
         )
 
+    content = await file.read()
+    annotate(upload_bytes=len(content))
+    if backlog is None:
+        backlog = await _admit(user_id)
+
     try:
         # Ensure the temporary upload directory exists
         temp_dir = Path(settings.TEMP_UPLOAD_DIR)
         temp_dir.mkdir(parents=True, exist_ok=True)
 
-        # Create a safe filename and path
+        # Create a safe, unique filename and path. The UUID keeps a replacement
+        # from overwriting an earlier upload of the same file still being processed.
         file_extension = SUPPORTED_FILE_TYPES[file.content_type]
-        # Using a simple approach for filename, but a more robust unique name generator
-        # (like UUID) would be better in a high-concurrency environment.
-        safe_filename = f"{user_id}_{Path(file.filename).stem}_{Path(file.filename).suffix}"
+        safe_filename = f"{user_id}_{Path(file.filename).stem}_{uuid.uuid4().hex[:8]}{file_extension}"
         temp_file_path = temp_dir / safe_filename
 
         # Save the file to the temporary location
         with open(temp_file_path, "wb") as buffer:
-            buffer.write(await file.read())
+            buffer.write(content)
 
-        logger.info(f"File '{file.filename}' saved temporarily to '{temp_file_path}'.")
+        logger.info("File '%s' saved temporarily to '%s'.", file.filename, temp_file_path)
 
         # --- Queue the processing task with Celery ---
-        # The task will handle parsing, embedding, and indexing.
-        task = process_document.delay(str(temp_file_path), user_id, file.filename)
-        logger.info(f"Queued document processing task with ID: {task.id}")
+        # The task will handle parsing, embedding, and indexing. Small files
+        # take the priority lane; large ones sink as the tenant's weighted backlog grows.
+        priority = tenant_scheduler.priority_for(user_id, len(content), backlog)
+        lane = "small" if priority == SMALL_FILE_PRIORITY else "standard"
+        task = await asyncio.to_thread(
+            process_document.apply_async,
+            args=(str(temp_file_path), user_id, file.filename),
+            kwargs={"replace": replace, "enqueued_at": time.time(), "lane": lane},
+            priority=priority,
+        )
+        logger.info("Queued document processing task with ID: %s (priority %s, tenant backlog %s).", task.id, priority, backlog)
 
         return UploadResponse(
             file_name=file.filename,
             content_type=file.content_type,
-            message="File uploaded and queued for processing.",
+            message="File uploaded and queued for replacement." if replace else "File uploaded and queued for processing.",
             task_id=task.id
         )
 
     except Exception as e:
-        logger.error(f"Error during file upload for user '{user_id}': {e}", exc_info=True)
+        await asyncio.to_thread(tenant_scheduler.finish, user_id)
+        logger.error("Error during file upload for user '%s': %s", user_id, e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred during file upload."
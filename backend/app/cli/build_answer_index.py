@@ -0,0 +1,240 @@
+"""
+Builds the offline answer index for the preloaded corpus (see
+app/services/answer_index.py).
+
+1. Questions: mined from a random sample of ANSWER_INDEX_MAX_CHUNKS preloaded
+   chunks, with one Gemini call and up to ANSWER_INDEX_QUESTIONS_PER_CHUNK
+   questions per chunk. Questions imported with --questions (.txt with one
+   per line, or .jsonl with a "question" field) are added, as are those
+   imported into the previous build. Exact and near-duplicate questions are
+   dropped.
+2. Answers: questions are retrieved against the preloaded corpus in batched
+   _msearch calls and answered from that context, --concurrency calls at a
+   time. A question is skipped when no retrieved chunk reaches
+   ANSWER_INDEX_MIN_CONTEXT_SIMILARITY (cosine) to it, or when generation
+   reports that the context does not answer it. Only real answers are stored,
+   never a "could not find" reply.
+3. The answers go into a new index, which replaces the previous one behind
+   ANSWER_INDEX_ALIAS.
+
+bulk_load runs this after publishing a rebuilt corpus. With --if-stale the
+build only runs when the answer index does not match the current corpus,
+which suits a scheduled job.
+
+Usage:
+    python -m app.cli.build_answer_index
+    python -m app.cli.build_answer_index --questions faq.txt --no-mine
+    python -m app.cli.build_answer_index --if-stale
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from elasticsearch.helpers import async_bulk
+from app.core.config import settings, load_secrets
+from app.services.es_client import get_es_client, close_es_client
+from app.services.model_registry import get_embedding_model
+from app.services.search_service import perform_hybrid_search_batch
+from app.services.llm_services import mine_questions, generate_stored_answer
+from app.services import answer_index
+
+logger = logging.getLogger(__name__)
+
+MIN_CHUNK_CHARS = 200 # Shorter chunks (headers, tables of contents) make poor questions
+DUPLICATE_SIMILARITY = 0.95 # Questions at least this similar to a kept one are dropped
+SEARCH_BATCH_SIZE = 64 # Questions per batched retrieval
+
+
+def load_questions(path: Path) -> List[str]:
+    """Questions from a .txt file (one per line) or a .jsonl file (a "question" field per line)."""
+    lines = [line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    if path.suffix.lower() == ".jsonl":
+        return [str(json.loads(line)["question"]).strip() for line in lines]
+    return lines
+
+
+def deduplicate(questions: List[str], vectors: np.ndarray) -> List[int]:
+    """Positions of the questions to keep, in order: first occurrences, without near-duplicates."""
+    normalized = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    kept: List[int] = []
+    seen = set()
+    for i, question in enumerate(questions):
+        key = " ".join(question.lower().split())
+        if key in seen:
+            continue
+        if kept and float(np.max(normalized[kept] @ normalized[i])) >= DUPLICATE_SIMILARITY:
+            continue
+        seen.add(key)
+        kept.append(i)
+    return kept
+
+
+class AnswerIndexBuilder:
+    def __init__(self, questions_path: Optional[Path] = None, mine: bool = True,
+                 max_chunks: Optional[int] = None, concurrency: Optional[int] = None,
+                 keep_previous: bool = False, seed: int = 0):
+        self.questions_path = questions_path
+        self.mine = mine
+        self.max_chunks = settings.ANSWER_INDEX_MAX_CHUNKS if max_chunks is None else max_chunks
+        self.slots = asyncio.Semaphore(concurrency or settings.BATCH_LLM_CONCURRENCY)
+        self.keep_previous = keep_previous
+        self.seed = seed
+        self.stats = {"chunks_sampled": 0, "mined": 0, "imported": 0, "duplicates": 0,
+                      "without_context": 0, "low_relevance": 0, "not_answered": 0, "answers": 0}
+
+    async def sample_chunks(self, es_client) -> List[str]:
+        """A reproducible random sample of preloaded chunks."""
+        response = await es_client.search(
+            index=settings.PRELOADED_INDEX_ALIAS,
+            size=min(self.max_chunks, 10000), # index.max_result_window
+            _source=["chunk_text"],
+            query={"function_score": {"query": {"match_all": {}}, "random_score": {"seed": self.seed, "field": "_seq_no"}}},
+            request_timeout=120,
+        )
+        chunks = [hit["_source"]["chunk_text"] for hit in response["hits"]["hits"] if hit.get("_source", {}).get("chunk_text")]
+        return [chunk for chunk in chunks if len(chunk) >= MIN_CHUNK_CHARS]
+
+    async def mine_from(self, chunks: List[str]) -> List[str]:
+        async def one(chunk: str) -> List[str]:
+            async with self.slots:
+                return await mine_questions(chunk, settings.ANSWER_INDEX_QUESTIONS_PER_CHUNK)
+        mined = await asyncio.gather(*(one(chunk) for chunk in chunks))
+        return [question for questions in mined for question in questions]
+
+    async def answer(self, question: str, context: List[str]) -> Optional[str]:
+        async with self.slots:
+            text = await generate_stored_answer(question, context)
+        if text is None:
+            self.stats["not_answered"] += 1
+        return text
+
+    @staticmethod
+    async def relevant(model, question_vectors: np.ndarray, contexts: List[List[str]]) -> List[bool]:
+        """Whether each question's best context chunk reaches ANSWER_INDEX_MIN_CONTEXT_SIMILARITY."""
+        chunks = list({chunk for context in contexts for chunk in context})
+        if not chunks:
+            return [False] * len(contexts)
+        chunk_vectors = await asyncio.to_thread(model.encode, chunks, batch_size=128, show_progress_bar=False,
+                                                convert_to_numpy=True, normalize_embeddings=True)
+        position = {chunk: n for n, chunk in enumerate(chunks)}
+        questions = question_vectors / np.maximum(np.linalg.norm(question_vectors, axis=1, keepdims=True), 1e-12)
+        relevant = []
+        for question, context in zip(questions, contexts):
+            best = max((float(chunk_vectors[position[chunk]] @ question) for chunk in context), default=-1.0)
+            relevant.append(best >= settings.ANSWER_INDEX_MIN_CONTEXT_SIMILARITY)
+        return relevant
+
+    async def run(self, if_stale: bool = False) -> dict:
+        if not answer_index.enabled():
+            raise RuntimeError("The answer index needs ANSWER_INDEX_ALIAS and PRELOADED_INDEX_ALIAS.")
+        es_client = get_es_client()
+        version = await answer_index.corpus_version(es_client)
+        if version is None:
+            raise RuntimeError("No preloaded corpus behind PRELOADED_INDEX_ALIAS; run bulk_load --rebuild-preloaded first.")
+        if if_stale and await answer_index.answered_version(es_client) == version:
+            logger.info(f"Answer index is current for corpus '{version}'; nothing to do.")
+            return {"corpus_version": version, "skipped": "current"}
+        model = get_embedding_model()
+        if model is None:
+            raise RuntimeError("Embedding model is not available.")
+        started = time.perf_counter()
+
+        # --- Questions ---
+        imported = await answer_index.stored_questions(es_client, "imported")
+        if self.questions_path:
+            imported += load_questions(self.questions_path)
+        mined = []
+        if self.mine:
+            chunks = await self.sample_chunks(es_client)
+            self.stats["chunks_sampled"] = len(chunks)
+            mined = await self.mine_from(chunks)
+        self.stats["imported"], self.stats["mined"] = len(imported), len(mined)
+        questions = imported + mined
+        origins = ["imported"] * len(imported) + ["mined"] * len(mined)
+        if not questions:
+            raise RuntimeError("No questions to answer (nothing mined or imported).")
+        vectors = await asyncio.to_thread(model.encode, questions, batch_size=128, show_progress_bar=False, convert_to_numpy=True)
+        kept = deduplicate(questions, vectors)
+        self.stats["duplicates"] = len(questions) - len(kept)
+        logger.info(f"Answering {len(kept)} questions ({len(imported)} imported, {len(mined)} mined, "
+                    f"{self.stats['duplicates']} duplicates dropped).")
+
+        # --- Answers ---
+        contexts: List[List[str]] = []
+        for start in range(0, len(kept), SEARCH_BATCH_SIZE):
+            contexts += await perform_hybrid_search_batch(
+                [(settings.PRELOADED_DOCS_USER_ID, questions[i]) for i in kept[start:start + SEARCH_BATCH_SIZE]]
+            )
+        with_context = [(i, context) for i, context in zip(kept, contexts) if context]
+        self.stats["without_context"] = len(kept) - len(with_context)
+        relevant = await self.relevant(model, vectors[[i for i, _ in with_context]], [context for _, context in with_context])
+        answerable = [item for item, ok in zip(with_context, relevant) if ok]
+        self.stats["low_relevance"] = len(with_context) - len(answerable)
+        answers = await asyncio.gather(*(self.answer(questions[i], context) for i, context in answerable))
+
+        # --- Index and publish ---
+        index = answer_index.new_index_name()
+        await answer_index.create_index(es_client, index, version)
+        actions = [
+            {
+                "_index": index,
+                "_source": {
+                    "question": questions[i],
+                    "question_vector": vectors[i].tolist(),
+                    "answer": text,
+                    "sources": context,
+                    "origin": origins[i],
+                },
+            }
+            for (i, context), text in zip(answerable, answers) if text
+        ]
+        self.stats["answers"], failed = await async_bulk(es_client, actions, raise_on_error=False, request_timeout=120)
+        if failed or not actions:
+            await es_client.indices.delete(index=index, ignore_unavailable=True)
+            raise RuntimeError(f"Answer index build failed ({len(failed)} failed writes, {len(actions)} answers); "
+                               "the previous answer index stays in place.")
+        published = await answer_index.publish(es_client, index, keep_previous=self.keep_previous)
+        return {
+            "corpus_version": version,
+            **self.stats,
+            "elapsed_seconds": round(time.perf_counter() - started, 2),
+            "published": published,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline answer index for the preloaded corpus.")
+    parser.add_argument("--questions", default=None, help="Questions to import: .txt (one per line) or .jsonl (\"question\" field).")
+    parser.add_argument("--no-mine", action="store_true", help="Only answer imported questions (including those of the previous build).")
+    parser.add_argument("--max-chunks", type=int, default=None, help="Chunks sampled for mining (default: ANSWER_INDEX_MAX_CHUNKS).")
+    parser.add_argument("--concurrency", type=int, default=None, help="Concurrent Gemini calls (default: BATCH_LLM_CONCURRENCY).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the chunk sample.")
+    parser.add_argument("--if-stale", action="store_true", help="Only build if the answer index does not match the current corpus.")
+    parser.add_argument("--keep-previous", action="store_true", help="Keep the index the alias pointed to before.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_secrets()
+    if not answer_index.enabled():
+        parser.error("ANSWER_INDEX_ALIAS and PRELOADED_INDEX_ALIAS must both be set")
+
+    builder = AnswerIndexBuilder(
+        questions_path=Path(args.questions) if args.questions else None, mine=not args.no_mine,
+        max_chunks=args.max_chunks, concurrency=args.concurrency, keep_previous=args.keep_previous, seed=args.seed
+    )
+
+    async def _run():
+        try:
+            return await builder.run(if_stale=args.if_stale)
+        finally:
+            await close_es_client()
+
+    print(json.dumps(asyncio.run(_run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
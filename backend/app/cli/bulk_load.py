@@ -0,0 +1,399 @@
+"""
+High-throughput bulk loader for the preloaded (general) document corpus.
+
+Walks a directory, parses and chunks files in a process pool, embeds chunks in
+large batches and indexes them with parallel bulk workers. While loading into
+the shared tenant index, periodic refresh is suspended through the same Redis
+refcount as ingestion workers use (document_store.suspended_refresh); a
+--rebuild-preloaded index is private to the load, so it also runs with zero
+replicas. Settings are restored at the end and the index is force-merged.
+Completed files are appended to a checkpoint file, so an interrupted run
+resumes where it left off. A re-loaded file that now has fewer chunks has its
+leftover chunks deleted.
+
+With --rebuild-preloaded (requires PRELOADED_INDEX_ALIAS), the corpus goes into
+a fresh read-optimized index that is published behind the alias once fully
+loaded (see app/services/preloaded_index.py). Re-run with the same --index to
+resume an interrupted rebuild. With ANSWER_INDEX_ALIAS set, the offline answer
+index is then rebuilt for the new corpus (app/cli/build_answer_index.py).
+
+Usage:
+    python -m app.cli.bulk_load /data/general_docs --checkpoint bulk_load.ckpt
+    python -m app.cli.bulk_load /data/general_docs --rebuild-preloaded
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from elasticsearch.helpers import async_bulk
+from app.core.config import settings, load_secrets
+from app.services.es_client import get_es_client, close_es_client
+from app.services.document_store import (
+    document_key, chunk_id, fetch_chunk_ids, bulk_delete_ids, suspended_refresh
+)
+from app.services.embedding import encode_length_sorted
+from app.services import preloaded_index, answer_index
+from app.cli.build_answer_index import AnswerIndexBuilder
+from app.tasks.processing import (
+    parse_file, split_into_chunks, create_index_if_not_exists
+)
+from app.services.model_registry import get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_SUFFIXES = {".pdf", ".docx", ".txt", ".md"}
+# Deterministic generation for bulk-loaded chunks: re-running a file overwrites
+# its chunks in place instead of duplicating them.
+BULK_GENERATION = "bulk"
+
+
+def parse_and_chunk(path: str) -> list[str]:
+    """Runs in a worker process: parse one file and split it into chunks."""
+    return split_into_chunks(parse_file(path))
+
+
+@dataclass
+class LoadStats:
+    started_at: float = field(default_factory=time.perf_counter)
+    files_done: int = 0
+    files_failed: int = 0
+    files_skipped: int = 0
+    chunks_indexed: int = 0
+    chunks_failed: int = 0
+    chunks_deleted: int = 0
+
+    def report(self) -> dict:
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "files_done": self.files_done,
+            "files_failed": self.files_failed,
+            "files_skipped_from_checkpoint": self.files_skipped,
+            "chunks_indexed": self.chunks_indexed,
+            "chunks_failed": self.chunks_failed,
+            "stale_chunks_deleted": self.chunks_deleted,
+            "docs_per_second": round(self.files_done / elapsed, 2),
+            "chunks_per_second": round(self.chunks_indexed / elapsed, 2),
+        }
+
+
+class Checkpoint:
+    """Append-only record of files that were fully indexed."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done: set[str] = set()
+        if path.exists():
+            self.done = {line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()}
+        self._handle = open(path, "a", encoding="utf-8")
+
+    def mark_done(self, relative_path: str) -> None:
+        self.done.add(relative_path)
+        self._handle.write(relative_path + "\n")
+        self._handle.flush()
+
+    def close(self) -> None:
+        self._handle.close()
+
+
+class BulkLoader:
+    def __init__(self, root: Path, args: argparse.Namespace):
+        self.root = root
+        self.args = args
+        self.index = args.index or settings.ES_INDEX_NAME
+        self.user_id = args.user_id or settings.PRELOADED_DOCS_USER_ID
+        self.stats = LoadStats()
+        self.rebuild = args.rebuild_preloaded
+        self.checkpoint = Checkpoint(Path(args.checkpoint))
+        # relative path -> chunks of that file not yet acknowledged by ES
+        self._outstanding: dict[str, int] = {}
+        self._chunk_counts: dict[str, int] = {}
+        self._file_failed: set[str] = set()
+        # A freshly created rebuild index has no chunks from earlier loads to clean up.
+        self._fresh_index = False
+
+    def discover(self) -> list[Path]:
+        files = sorted(p for p in self.root.rglob("*") if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES)
+        pending = []
+        for path in files:
+            if str(path.relative_to(self.root)) in self.checkpoint.done:
+                self.stats.files_skipped += 1
+            else:
+                pending.append(path)
+        return pending
+
+    @asynccontextmanager
+    async def tuned_for_load(self, es_client):
+        """
+        Runs the load with periodic refresh off, then refreshes (and optionally
+        force-merges) the index. Only a private rebuild index also drops its
+        replicas; the shared tenant index goes through the refcounted
+        suspension, so concurrent ingestion workers never restore each other's -1.
+        """
+        if self.rebuild:
+            original = await self.tune_index_for_load(es_client)
+            try:
+                yield
+            finally:
+                await es_client.indices.put_settings(index=self.index, settings={"index": original})
+                logger.info(f"Restored index settings {original}.")
+                await self.finish_index(es_client)
+        else:
+            try:
+                async with suspended_refresh(es_client, self.index):
+                    yield
+            finally:
+                await self.finish_index(es_client)
+
+    async def tune_index_for_load(self, es_client) -> dict:
+        """Disables refresh and replicas for the load. Returns the settings to restore."""
+        current = await es_client.indices.get_settings(index=self.index, name="index.refresh_interval,index.number_of_replicas", include_defaults=True)
+        index_settings = next(iter(current.values()))
+        merged = {**index_settings.get("defaults", {}).get("index", {}), **index_settings.get("settings", {}).get("index", {})}
+        original = {
+            "refresh_interval": merged.get("refresh_interval", settings.ES_REFRESH_INTERVAL),
+            "number_of_replicas": merged.get("number_of_replicas", "1"),
+        }
+        await es_client.indices.put_settings(index=self.index, settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+        logger.info(f"Index '{self.index}' tuned for bulk load (original settings: {original}).")
+        return original
+
+    async def finish_index(self, es_client) -> None:
+        await es_client.indices.refresh(index=self.index)
+        if self.args.force_merge_segments > 0:
+            logger.info(f"Force-merging '{self.index}' to {self.args.force_merge_segments} segment(s)...")
+            await es_client.indices.forcemerge(
+                index=self.index, max_num_segments=self.args.force_merge_segments, request_timeout=3600
+            )
+
+    def _actions(self, batch: list[tuple[str, int, str]], vectors) -> list[dict]:
+        actions = []
+        for (relative_path, chunk_number, text), vector in zip(batch, vectors):
+            actions.append({
+                "_index": self.index,
+                "_id": chunk_id(document_key(self.user_id, relative_path), BULK_GENERATION, chunk_number),
+                "_source": {
+                    "user_id": self.user_id,
+                    "file_name": relative_path,
+                    "generation": BULK_GENERATION,
+                    "chunk_text": text,
+                    "chunk_vector": vector.tolist(),
+                },
+            })
+        return actions
+
+    def _acknowledge(self, batch: list[tuple[str, int, str]], failed_ids: set[str]) -> list[str]:
+        """Marks chunks as written. Returns the files whose chunks are now all in."""
+        completed = []
+        for relative_path, chunk_number, _ in batch:
+            if failed_ids and chunk_id(document_key(self.user_id, relative_path), BULK_GENERATION, chunk_number) in failed_ids:
+                self._file_failed.add(relative_path)
+            self._outstanding[relative_path] -= 1
+            if self._outstanding[relative_path] == 0:
+                del self._outstanding[relative_path]
+                if relative_path in self._file_failed:
+                    self.stats.files_failed += 1
+                else:
+                    completed.append(relative_path)
+        return completed
+
+    async def _delete_stale_chunks(self, es_client, relative_path: str) -> None:
+        """
+        Chunk IDs are positional, so re-loading a file that now splits into
+        fewer chunks overwrites the first ones and leaves the rest behind.
+        Deletes those leftovers, as a replace does for a new generation.
+        """
+        doc_key = document_key(self.user_id, relative_path)
+        current = {chunk_id(doc_key, BULK_GENERATION, i) for i in range(self._chunk_counts.pop(relative_path, 0))}
+        stale = [_id for _id in await fetch_chunk_ids(es_client, self.user_id, relative_path, index=self.index) if _id not in current]
+        if stale:
+            deleted = await bulk_delete_ids(es_client, stale, index=self.index)
+            self.stats.chunks_deleted += deleted
+            logger.info(f"Removed {deleted} stale chunks of '{relative_path}'.")
+
+    async def _complete(self, es_client, relative_path: str) -> None:
+        """Cleans up after a fully indexed file and checkpoints it."""
+        if not self._fresh_index:
+            try:
+                await self._delete_stale_chunks(es_client, relative_path)
+            except Exception as e:
+                # The file stays out of the checkpoint, so the next run retries it.
+                logger.error(f"Could not remove stale chunks of '{relative_path}': {e}")
+                self.stats.files_failed += 1
+                return
+        self.stats.files_done += 1
+        self.checkpoint.mark_done(relative_path)
+
+    async def _index_worker(self, es_client, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            batch, actions = item
+            try:
+                success, failed = await async_bulk(
+                    es_client, actions, chunk_size=self.args.bulk_size,
+                    raise_on_error=False, raise_on_exception=False, request_timeout=120
+                )
+                failed_ids = {next(iter(f.values())).get("_id") for f in failed}
+            except Exception as e:
+                logger.error(f"Bulk request failed: {e}")
+                success, failed_ids = 0, {a["_id"] for a in actions}
+            self.stats.chunks_indexed += success
+            self.stats.chunks_failed += len(failed_ids)
+            for relative_path in self._acknowledge(batch, failed_ids):
+                await self._complete(es_client, relative_path)
+            queue.task_done()
+
+    async def _embed_and_enqueue(self, batch: list[tuple[str, int, str]], queue: asyncio.Queue) -> None:
+        # Chunks here are already token-sized by split_into_chunks, so they are
+        # only length-bucketed (re-splitting would break per-file accounting).
+        vectors = await asyncio.to_thread(
+            encode_length_sorted, get_embedding_model(), [text for _, _, text in batch],
+            batch_size=self.args.encode_batch_size
+        )
+        await queue.put((batch, self._actions(batch, vectors)))
+
+    async def run(self) -> dict:
+        files = self.discover()
+        logger.info(f"Found {len(files)} files to load ({self.stats.files_skipped} already in checkpoint).")
+        if files:
+            await self.load(files)
+        report = self.stats.report()
+        if self.rebuild:
+            if self.stats.files_failed or self.stats.chunks_failed:
+                logger.warning(f"Not publishing '{self.index}': some files failed. Re-run with --index {self.index} to retry them.")
+            else:
+                report["published"] = await preloaded_index.publish(
+                    get_es_client(), self.index, keep_previous=self.args.keep_previous
+                )
+                if answer_index.enabled() and not self.args.skip_answer_index:
+                    report["answer_index"] = await self.rebuild_answer_index()
+        return report
+
+    async def rebuild_answer_index(self) -> dict:
+        """Regenerates the offline answers for the corpus just published (stale answers are not served meanwhile)."""
+        try:
+            return await AnswerIndexBuilder().run()
+        except Exception as e:
+            logger.error(f"Answer index rebuild failed: {e}. Re-run `python -m app.cli.build_answer_index`.", exc_info=True)
+            return {"error": str(e)}
+
+    async def load(self, files: list[Path]) -> None:
+        if get_embedding_model() is None:
+            raise RuntimeError("Embedding model is not available.")
+
+        es_client = get_es_client()
+        if self.rebuild:
+            self._fresh_index = await preloaded_index.create_index(es_client, self.index)
+        else:
+            await create_index_if_not_exists()
+        async with self.tuned_for_load(es_client):
+            await self._load_files(es_client, files)
+
+    async def _load_files(self, es_client, files: list[Path]) -> None:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.args.bulk_workers * 2)
+        workers = [asyncio.create_task(self._index_worker(es_client, queue)) for _ in range(self.args.bulk_workers)]
+        # Parsed files waiting to be embedded hold their full text in memory,
+        # so only a couple of results per parser process may be outstanding.
+        parse_slots = asyncio.Semaphore(self.args.parse_workers * 2)
+        last_report = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=self.args.parse_workers) as pool:
+                async def parse_one(path: Path):
+                    await parse_slots.acquire()
+                    try:
+                        return path, await loop.run_in_executor(pool, parse_and_chunk, str(path)), None
+                    except Exception as e:
+                        return path, None, e
+
+                buffer: list[tuple[str, int, str]] = []
+                for next_done in asyncio.as_completed([parse_one(path) for path in files]):
+                    path, chunks, error = await next_done
+                    # Released once the chunks are in the buffer; embedding below applies the backpressure.
+                    parse_slots.release()
+                    if error:
+                        logger.error(f"Failed to parse {path}: {error}")
+                        self.stats.files_failed += 1
+                        continue
+                    relative_path = str(path.relative_to(self.root))
+                    if not chunks:
+                        await self._complete(es_client, relative_path)
+                        continue
+                    self._outstanding[relative_path] = len(chunks)
+                    self._chunk_counts[relative_path] = len(chunks)
+                    buffer.extend((relative_path, i, text) for i, text in enumerate(chunks))
+                    while len(buffer) >= self.args.embed_batch_size:
+                        batch, buffer = buffer[:self.args.embed_batch_size], buffer[self.args.embed_batch_size:]
+                        await self._embed_and_enqueue(batch, queue)
+                    if time.perf_counter() - last_report > 10:
+                        last_report = time.perf_counter()
+                        report = self.stats.report()
+                        logger.info(f"Progress: {report['files_done']} files, {report['chunks_indexed']} chunks "
+                                    f"({report['docs_per_second']} docs/s, {report['chunks_per_second']} chunks/s)")
+                if buffer:
+                    await self._embed_and_enqueue(buffer, queue)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.checkpoint.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load the preloaded document corpus into Elasticsearch.")
+    parser.add_argument("directory", help="Directory to walk for .pdf, .docx, .txt and .md files.")
+    parser.add_argument("--checkpoint", default=None, help="File recording fully indexed files, for resume (default: bulk_load.ckpt, or one per rebuild index).")
+    parser.add_argument("--index", default=None, help="Target index (default: ES_INDEX_NAME, or a new timestamped index with --rebuild-preloaded).")
+    parser.add_argument("--rebuild-preloaded", action="store_true", help="Load into a new read-optimized index and swap PRELOADED_INDEX_ALIAS to it.")
+    parser.add_argument("--keep-previous", action="store_true", help="With --rebuild-preloaded, keep the index the alias pointed to before.")
+    parser.add_argument("--skip-answer-index", action="store_true", help="With --rebuild-preloaded, do not rebuild the offline answer index (ANSWER_INDEX_ALIAS).")
+    parser.add_argument("--user-id", default=None, help="Owner ID for the chunks (default: PRELOADED_DOCS_USER_ID).")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 2, help="Parser processes.")
+    parser.add_argument("--embed-batch-size", type=int, default=1024, help="Chunks per embedding call.")
+    parser.add_argument("--encode-batch-size", type=int, default=128, help="Model forward-pass batch size.")
+    parser.add_argument("--bulk-workers", type=int, default=4, help="Concurrent bulk indexing requests.")
+    parser.add_argument("--bulk-size", type=int, default=500, help="Actions per bulk request.")
+    parser.add_argument("--force-merge-segments", type=int, default=1, help="Segments to force-merge to afterwards (0 to skip).")
+    parser.add_argument("--report", default=None, help="Optional path for the JSON throughput report.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_secrets()
+    root = Path(args.directory).resolve()
+    if not root.is_dir():
+        parser.error(f"{root} is not a directory")
+    if args.rebuild_preloaded:
+        if not settings.PRELOADED_INDEX_ALIAS:
+            parser.error("--rebuild-preloaded requires PRELOADED_INDEX_ALIAS")
+        args.index = args.index or preloaded_index.new_index_name()
+        args.checkpoint = args.checkpoint or f"bulk_load.{args.index}.ckpt"
+        logger.info(f"Rebuilding the preloaded corpus into '{args.index}' (resume with --index {args.index}).")
+    elif settings.PRELOADED_INDEX_ALIAS and not args.user_id:
+        logger.warning("PRELOADED_INDEX_ALIAS is set: preloaded docs in ES_INDEX_NAME are not searched. Use --rebuild-preloaded.")
+    args.checkpoint = args.checkpoint or "bulk_load.ckpt"
+
+    async def _run():
+        try:
+            return await BulkLoader(root, args).run()
+        finally:
+            await close_es_client()
+
+    report = asyncio.run(_run())
+    print(json.dumps(report, indent=2))
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Replays a recorded traffic trace (see app/core/traffic_recorder.py) with the
+original arrival times, at 1x or Nx speed.
+
+Each record is turned back into a request of the same shape: a query of the
+recorded length (chit-chat records get a greeting so the router sends them
+down the same path), a batch of the same size, or an upload of the same
+byte size, from a synthetic user per recorded user bucket. Requests are sent
+at `(ts - first_ts) / speed` after the start, concurrently, whatever the
+responses do.
+
+Targets:
+- `--target URL`: a running instance with its real dependencies.
+- `--stub`: the app in-process with Gemini, Elasticsearch, the embedding
+  model and Celery stubbed out. Each stub sleeps for the stage time recorded
+  for that request, so differences from the recorded latency come from the
+  app itself (or from load), not from the dependencies.
+
+Reports the latency distribution per route, the divergence from the
+recorded latencies, status mismatches and how late requests were sent.
+
+Usage (from backend/):
+    python -m app.cli.replay_traffic /tmp/traffic/requests.jsonl --target http://localhost:8080 --speed 2
+    python -m app.cli.replay_traffic /tmp/traffic/requests.jsonl --stub --output replay.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import statistics
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+WORDS = (
+    "policy revenue quarter customer refund privacy contract employee remote "
+    "security report project deadline budget forecast compliance onboarding"
+).split()
+CHIT_CHAT = "hello there, how are you doing today"
+
+# Record being replayed by the current request; read by the in-process stubs.
+_replay_record: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("replay_record", default=None)
+
+
+# --- Trace Loading ---
+
+def load_trace(paths: list[str], routes: Optional[set[str]] = None) -> list[dict]:
+    """Reads trace files, including rotated siblings (requests.jsonl.1, ...), as one list sorted by start time."""
+    files = []
+    for raw in paths:
+        path = Path(raw)
+        files.extend(path.parent.glob(path.name + ".*"))
+        files.append(path)
+    records = []
+    for path in files:
+        if not path.is_file():
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping malformed line in {path}.")
+                    continue
+                if routes is None or record.get("route") in routes:
+                    records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+# --- Request Synthesis ---
+
+def _text_of_length(chars: int, rng: random.Random) -> str:
+    words = []
+    length = -1
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:max(chars, 1)]
+
+def _query_text(chars: int, intent: Optional[str], rng: random.Random) -> str:
+    if intent == "chit_chat":
+        return CHIT_CHAT[:max(chars, 5)]
+    return _text_of_length(chars, rng)
+
+def build_request(record: dict, index: int, max_upload_bytes: int) -> dict:
+    """Returns httpx request arguments reproducing the record's shape."""
+    rng = random.Random(index)
+    route, method = record["route"], record["method"]
+    bucket = record.get("user_bucket", 0)
+    if route == "/api/query":
+        chars = (record.get("query_chars") or [40])[0]
+        return {"method": method, "url": route, "json": {
+            "user_id": f"replay-user-{bucket}", "query_text": _query_text(chars, record.get("intent"), rng)
+        }}
+    if route == "/api/query/batch":
+        size = record.get("batch_size", 1)
+        chars = record.get("query_chars") or [40] * size
+        buckets = bucket if isinstance(bucket, list) else [bucket] * size
+        intents = record.get("intent") if isinstance(record.get("intent"), list) else [None] * size
+        return {"method": method, "url": route, "json": {"queries": [
+            {"user_id": f"replay-user-{b}", "query_text": _query_text(c, i, rng)}
+            for b, c, i in zip(buckets, chars, intents)
+        ]}}
+    # Uploads: same size and lane; non-text files are sent as text of the same size.
+    size = min(record.get("upload_bytes", 1024), max_upload_bytes)
+    content_type = record.get("content_type") if record.get("content_type") in ("text/plain", "text/markdown") else "text/plain"
+    suffix = ".md" if content_type == "text/markdown" else ".txt"
+    body = _text_of_length(size, rng).encode()
+    return {"method": method, "url": route, "data": {"user_id": f"replay-user-{bucket}"},
+            "files": {"file": (f"replay-{index}{suffix}", body, content_type)}}
+
+
+# --- Stubbed Dependencies ---
+
+def _recorded_stage_seconds(stage: str, per_call_divisor: int = 1) -> float:
+    record = _replay_record.get() or {}
+    return record.get("stage_ms", {}).get(stage, 0.0) / 1000 / max(per_call_divisor, 1)
+
+def _batch_divisor() -> int:
+    record = _replay_record.get() or {}
+    return record.get("batch_size", 1)
+
+class _StubEncoder:
+    max_seq_length = 256
+
+    def encode(self, texts, **kwargs):
+        import numpy as np
+        time.sleep(_recorded_stage_seconds("embed"))
+        if isinstance(texts, str):
+            return np.zeros(384, dtype=np.float32)
+        return np.zeros((len(texts), 384), dtype=np.float32)
+
+    @property
+    def tokenizer(self):
+        return None
+
+class _StubES:
+    async def search(self, **kwargs):
+        await asyncio.sleep(_recorded_stage_seconds("es_search"))
+        return {"took": 1, "hits": {"hits": []}}
+
+    async def msearch(self, searches, **kwargs):
+        await asyncio.sleep(_recorded_stage_seconds("es_search"))
+        return {"responses": [{"hits": {"hits": []}} for _ in searches[1::2]]}
+
+def install_stubs() -> None:
+    """Replaces Gemini, Elasticsearch, the embedding model and Celery with recorded-latency stubs."""
+    from app.core.config import settings
+    from app.services import llm_services, es_client, inline_ingest
+    from app.services.model_registry import model_registry
+    from app.services.tenant_scheduler import tenant_scheduler
+    from app.tasks.processing import process_document
+
+    async def get_prompt(name, system_instruction):
+        return SimpleNamespace(model=None, static_tokens=0)
+
+    async def generate(call_site, prompt, contents, generation_config=None):
+        await asyncio.sleep(_recorded_stage_seconds(call_site, _batch_divisor()))
+        if call_site == "route":
+            text = "chit_chat" if CHIT_CHAT[:5] in contents else "query_documents"
+        elif call_site == "plan":
+            intent = "chit_chat" if CHIT_CHAT[:5] in contents else "query_documents"
+            text = json.dumps({"intent": intent, "search_query": "replayed response", "file_name": None})
+        else:
+            text = "replayed response"
+        return SimpleNamespace(parts=[text], text=text, usage_metadata=None, prompt_feedback=None)
+
+    async def bulk(client, actions, **kwargs):
+        await asyncio.sleep(_recorded_stage_seconds("bulk_index"))
+        return len(list(actions)), []
+
+    async def create_index():
+        return None
+
+    settings.CHUNK_SIZE_TOKENS = 0 # Character chunking: no tokenizer download
+    llm_services._get_prompt = get_prompt
+    llm_services._generate = generate
+    es_client.es_client = _StubES()
+    model_registry.sentence_transformer = lambda *args, **kwargs: _StubEncoder()
+    inline_ingest.async_bulk = bulk
+    inline_ingest.create_index_if_not_exists = create_index
+    inline_ingest.embed_chunks = lambda model, chunks, **kwargs: SimpleNamespace(
+        chunks=chunks, vectors=model.encode(chunks)
+    )
+    tenant_scheduler.admit = lambda user_id: 0
+    process_document.apply_async = lambda *args, **kwargs: SimpleNamespace(id="replay")
+
+
+# --- Replay ---
+
+async def _send(client, record: dict, index: int, scheduled: float, started: float, args) -> dict:
+    lag_ms = (time.perf_counter() - started - scheduled) * 1000
+    request = build_request(record, index, args.max_upload_bytes)
+    token = _replay_record.set(record)
+    start = time.perf_counter()
+    status, error = None, None
+    try:
+        response = await client.request(**request)
+        await response.aread()
+        status = response.status_code
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        _replay_record.reset(token)
+    return {
+        "route": record["route"],
+        "recorded_ms": record.get("duration_ms"),
+        "replayed_ms": (time.perf_counter() - start) * 1000,
+        "recorded_status": record.get("status"),
+        "status": status,
+        "error": error,
+        "send_lag_ms": lag_ms,
+    }
+
+async def replay(records: list[dict], args) -> list[dict]:
+    import httpx
+    if args.stub:
+        install_stubs()
+        from main import app
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://replay"
+    else:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=args.max_in_flight))
+        base_url = args.target.rstrip("/")
+
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    first_ts = records[0]["ts"]
+    tasks = []
+
+    async def bounded(record, index, scheduled, started):
+        async with in_flight:
+            return await _send(client, record, index, scheduled, started, args)
+
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        for index, record in enumerate(records):
+            scheduled = (record["ts"] - first_ts) / args.speed
+            delay = scheduled - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(bounded(record, index, scheduled, started)))
+        return await asyncio.gather(*tasks)
+
+
+# --- Report ---
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": round(ordered[-1], 2)}
+
+def build_report(results: list[dict]) -> dict:
+    report = {"requests": len(results), "send_lag_ms": _percentiles([r["send_lag_ms"] for r in results]), "routes": {}}
+    for route in sorted({r["route"] for r in results}):
+        rows = [r for r in results if r["route"] == route]
+        paired = [r for r in rows if r["recorded_ms"] is not None and r["error"] is None]
+        deltas = [r["replayed_ms"] - r["recorded_ms"] for r in paired]
+        ratios = [r["replayed_ms"] / r["recorded_ms"] for r in paired if r["recorded_ms"] > 0]
+        report["routes"][route] = {
+            "count": len(rows),
+            "errors": sum(1 for r in rows if r["error"]),
+            "status_mismatches": sum(1 for r in rows if r["error"] is None and r["status"] != r["recorded_status"]),
+            "recorded_ms": _percentiles([r["recorded_ms"] for r in rows if r["recorded_ms"] is not None]),
+            "replayed_ms": _percentiles([r["replayed_ms"] for r in rows if r["error"] is None]),
+            "divergence": {
+                "median_delta_ms": round(statistics.median(deltas), 2) if deltas else None,
+                "p90_abs_delta_ms": _percentiles([abs(d) for d in deltas]).get("p90"),
+                "median_ratio": round(statistics.median(ratios), 3) if ratios else None,
+            },
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", nargs="+", help="Trace file(s); rotated siblings are included automatically.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target", help="Base URL of a running instance.")
+    target.add_argument("--stub", action="store_true", help="Replay in-process with stubbed dependencies.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier (2 = twice as fast).")
+    parser.add_argument("--routes", nargs="+", default=None, help="Only replay these routes.")
+    parser.add_argument("--limit", type=int, default=None, help="Replay at most this many records.")
+    parser.add_argument("--max-in-flight", type=int, default=500)
+    parser.add_argument("--max-upload-bytes", type=int, default=5 * 1024 * 1024)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive.")
+
+    logging.basicConfig(level=logging.WARNING)
+    records = load_trace(args.trace, set(args.routes) if args.routes else None)[:args.limit]
+    if not records:
+        raise SystemExit("No records to replay.")
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"Replaying {len(records)} requests recorded over {span:.1f}s at {args.speed}x "
+          f"({'stubbed dependencies' if args.stub else args.target}).")
+
+    results = asyncio.run(replay(records, args))
+    report = build_report(results)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
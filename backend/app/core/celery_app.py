@@ -1,6 +1,9 @@
 from celery import Celery
+from celery.signals import worker_init
 from app.core.config import settings
+from app.core.metrics import start_worker_metrics_server
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +25,13 @@ try:
         accept_content=['json'],
         timezone='UTC',
         enable_utc=True,
+        # Serve task priorities strictly (0 first) for tenant-fair ingestion; see tenant_scheduler.
+        broker_transport_options={
+            "queue_order_strategy": "priority",
+            "priority_steps": list(range(10)),
+            "sep": ":",
+        },
+        task_default_priority=5,
     )
     logger.info("Celery application configured successfully.")
 
@@ -30,3 +40,19 @@ except Exception as e:
     # Raising the exception might prevent the application from starting,
     # which is desirable if Celery is critical.
     raise
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """Exposes ingestion metrics from the worker parent process, if configured."""
+    if settings.WORKER_METRICS_PORT:
+        start_worker_metrics_server(settings.WORKER_METRICS_PORT)
+
+@worker_init.connect
+def prepare_worker_pool(sender=None, **kwargs):
+    """Partitions CPU threads across pool children and preloads models before the pool forks."""
+    from app.core.worker_resources import partition_threads, preload_models, resource_report
+    concurrency = getattr(sender, "concurrency", None) or celery.conf.worker_concurrency or os.cpu_count() or 1
+    partition_threads(concurrency)
+    if settings.WORKER_PRELOAD_MODEL:
+        preload_models()
+    logger.info(f"Worker parent resources: {resource_report()}")
@@ -11,43 +11,53 @@ load_dotenv(dotenv_path=env_path)
 logger = logging.getLogger(__name__)
 
 # --- Optional: Secret Manager Client ---
-# Initialize client only if needed and library is installed
+# The client is created and secrets are fetched lazily by `load_secrets()`
+# (called from the app lifespan / worker init) so importing this module never
+# blocks on network calls.
 secret_manager_client = None
-try:
-    from google.cloud import secretmanager
-    if os.getenv("GOOGLE_APPLICATION_CREDENTIALS") or os.getenv("GOOGLE_CLOUD_PROJECT"):
-        secret_manager_client = secretmanager.SecretManagerServiceClient()
-        logger.info("Google Secret Manager client initialized.")
-    else:
-        logger.warning("GOOGLE_APPLICATION_CREDENTIALS or GOOGLE_CLOUD_PROJECT not set. Cannot initialize Secret Manager.")
-except ImportError:
-    logger.info("google-cloud-secret-manager not installed. Secrets must be provided directly via environment variables.")
-except Exception as e_sm:
-    logger.error(f"Error initializing Secret Manager client: {e_sm}")
+_secret_manager_init_attempted = False
+
+def get_secret_manager_client():
+    """Initializes the Secret Manager client on first use, if available and configured."""
+    global secret_manager_client, _secret_manager_init_attempted
+    if secret_manager_client is None and not _secret_manager_init_attempted:
+        _secret_manager_init_attempted = True
+        try:
+            from google.cloud import secretmanager
+            if os.getenv("GOOGLE_APPLICATION_CREDENTIALS") or os.getenv("GOOGLE_CLOUD_PROJECT"):
+                secret_manager_client = secretmanager.SecretManagerServiceClient()
+                logger.info("Google Secret Manager client initialized.")
+            else:
+                logger.warning("GOOGLE_APPLICATION_CREDENTIALS or GOOGLE_CLOUD_PROJECT not set. Cannot initialize Secret Manager.")
+        except ImportError:
+            logger.info("google-cloud-secret-manager not installed. Secrets must be provided directly via environment variables.")
+        except Exception as e_sm:
+            logger.error(f"Error initializing Secret Manager client: {e_sm}")
+    return secret_manager_client
 
 def get_secret(secret_name_env_var: str) -> str | None:
     """Fetches secret from GCP Secret Manager if configured, otherwise returns None."""
     secret_resource_name = os.getenv(secret_name_env_var)
-    if secret_manager_client and secret_resource_name:
+    if not secret_resource_name:
+        return None
+    client = get_secret_manager_client()
+    if client:
         try:
             logger.info(f"Fetching secret: {secret_resource_name}")
-            response = secret_manager_client.access_secret_version(name=secret_resource_name)
+            response = client.access_secret_version(name=secret_resource_name)
             return response.payload.data.decode("UTF-8")
         except Exception as e:
             logger.error(f"Failed to fetch secret '{secret_resource_name}': {e}", exc_info=True)
             return None
-    elif secret_resource_name:
-         logger.warning(f"Secret name {secret_name_env_var} is set, but Secret Manager client is not available.")
+    logger.warning(f"Secret name {secret_name_env_var} is set, but Secret Manager client is not available.")
     return None
 
 class Settings(BaseSettings):
     # --- Secrets ---
-    # Attempt to fetch from Secret Manager first, fallback to direct env var
-    _gemini_api_key_secret: str | None = get_secret("GOOGLE_API_KEY_SECRET_NAME")
-    GEMINI_API_KEY: str = _gemini_api_key_secret or os.getenv("GOOGLE_API_KEY", "GEMINI_KEY_MISSING")
-
-    _elastic_api_key_secret: str | None = get_secret("ELASTIC_API_KEY_SECRET_NAME")
-    ELASTIC_API_KEY: str | None = _elastic_api_key_secret or os.getenv("ELASTIC_API_KEY")
+    # Direct env vars are the defaults; `load_secrets()` overrides them from
+    # Secret Manager when the *_SECRET_NAME variables are configured.
+    GEMINI_API_KEY: str = os.getenv("GOOGLE_API_KEY", "GEMINI_KEY_MISSING")
+    ELASTIC_API_KEY: str | None = os.getenv("ELASTIC_API_KEY")
 
     # --- Direct Config ---
     ELASTIC_CLOUD_ID: str | None = os.getenv("ELASTIC_CLOUD_ID")
@@ -58,11 +68,159 @@ class Settings(BaseSettings):
     # --- Model & Index Config ---
     EMBEDDING_MODEL_NAME: str = 'sentence-transformers/all-MiniLM-L6-v2'
     EMBEDDING_DIM: int = 384
+    EMBEDDING_DEVICE: str = os.getenv("EMBEDDING_DEVICE", "auto") # "auto" lets sentence-transformers pick (cuda if available)
     GEMINI_MODEL_NAME: str = os.getenv("GEMINI_MODEL_NAME","gemini-2.5-flash-lite-preview-09-2025")
     MAX_CONTEXT_TOKENS: int = int(os.getenv("MAX_CONTEXT_TOKENS", "8000"))
+    # Static prompt prefixes: "auto" tries Gemini context caching, "local" keeps them as in-process system instructions.
+    GEMINI_CONTEXT_CACHE: str = os.getenv("GEMINI_CONTEXT_CACHE", "local")
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS: int = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+    # Gemini's minimum cacheable prefix for the model; shorter prefixes are not sent to the cache API at all
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS: int = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
     ES_INDEX_NAME: str = os.getenv("ES_INDEX_NAME", "rag_documents")
     PRELOADED_DOCS_USER_ID: str = os.getenv("PRELOADED_DOCS_USER_ID", "_preloaded_") # ID for general docs
 
+    # --- Preloaded Corpus Index ---
+    # When set, the shared preloaded corpus is searched through this alias (a force-merged, replicated,
+    # read-only index built by `bulk_load --rebuild-preloaded`) alongside ES_INDEX_NAME for tenant docs.
+    # Unset keeps preloaded docs in ES_INDEX_NAME under PRELOADED_DOCS_USER_ID.
+    PRELOADED_INDEX_ALIAS: str | None = os.getenv("PRELOADED_INDEX_ALIAS") or None
+    PRELOADED_INDEX_SHARDS: int = int(os.getenv("PRELOADED_INDEX_SHARDS", "1"))
+    PRELOADED_INDEX_REPLICAS: int = int(os.getenv("PRELOADED_INDEX_REPLICAS", "2")) # Extra copies spread read load across nodes
+
+    # --- Offline Answer Index ---
+    # Answers generated offline for likely questions about the preloaded corpus, served without any Gemini call
+    # when a query is close enough to a stored question (build: `python -m app.cli.build_answer_index`).
+    # Needs PRELOADED_INDEX_ALIAS: answers are tied to the corpus index they were generated from.
+    ANSWER_INDEX_ALIAS: str | None = os.getenv("ANSWER_INDEX_ALIAS") or None # e.g. "rag_answers"; unset disables lookups
+    ANSWER_INDEX_MIN_SIMILARITY: float = float(os.getenv("ANSWER_INDEX_MIN_SIMILARITY", "0.92")) # Cosine similarity needed to serve a stored answer
+    ANSWER_INDEX_MAX_CHUNKS: int = int(os.getenv("ANSWER_INDEX_MAX_CHUNKS", "2000")) # Preloaded chunks sampled for question mining per build
+    ANSWER_INDEX_QUESTIONS_PER_CHUNK: int = int(os.getenv("ANSWER_INDEX_QUESTIONS_PER_CHUNK", "3"))
+    ANSWER_INDEX_MIN_CONTEXT_SIMILARITY: float = float(os.getenv("ANSWER_INDEX_MIN_CONTEXT_SIMILARITY", "0.5")) # Build: questions whose best context chunk is less similar are not answered
+    ANSWER_INDEX_TENANT_MIN_SIMILARITY: float = float(os.getenv("ANSWER_INDEX_TENANT_MIN_SIMILARITY", "0.5")) # A user chunk this similar to the query bypasses the stored answer
+
+    # --- Observability ---
+    # Port on which Celery workers serve Prometheus metrics (0 disables it).
+    # With the prefork pool, also set PROMETHEUS_MULTIPROC_DIR so child samples are aggregated.
+    WORKER_METRICS_PORT: int = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+    # --- Log Export (API process) ---
+    # Handlers run on a background thread behind a bounded queue, so log calls never block the event loop.
+    LOG_QUEUE_ENABLED: bool = os.getenv("LOG_QUEUE_ENABLED", "true").lower() == "true"
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000")) # Records beyond this are dropped (and counted)
+    LOG_BATCH_SIZE: int = int(os.getenv("LOG_BATCH_SIZE", "256")) # Records written per exporter batch
+    LOG_INFO_SAMPLE_RATE: float = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0")) # Share of INFO lines kept from LOG_SAMPLED_LOGGERS
+    LOG_SAMPLED_LOGGERS: str = os.getenv( # Comma-separated logger names (children included)
+        "LOG_SAMPLED_LOGGERS", "app.api.chat,app.services.search_service,app.services.llm_services,uvicorn.access"
+    )
+
+    # --- Worker CPU & Memory ---
+    # Load the embedding model in the Celery parent before the prefork pool forks, so children share it copy-on-write.
+    WORKER_PRELOAD_MODEL: bool = os.getenv("WORKER_PRELOAD_MODEL", "true").lower() == "true"
+    WORKER_TORCH_THREADS: int = int(os.getenv("WORKER_TORCH_THREADS", "0")) # Threads per pool child (0 = usable CPUs // concurrency)
+
+    # --- Batch Queries ---
+    BATCH_MAX_QUERIES: int = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+    BATCH_LLM_CONCURRENCY: int = int(os.getenv("BATCH_LLM_CONCURRENCY", "8")) # Concurrent Gemini calls per batch
+
+    # --- Hybrid Fusion ---
+    # "server" uses ES rank.rrf (a licensed feature, ignores weights). "rrf" (weighted RRF) and
+    # "linear" (weighted min-max normalized scores) run BM25 and kNN in one _msearch and fuse client-side.
+    HYBRID_FUSION: str = os.getenv("HYBRID_FUSION", "server")
+    FUSION_BM25_WEIGHT: float = float(os.getenv("FUSION_BM25_WEIGHT", "0.3"))
+    FUSION_KNN_WEIGHT: float = float(os.getenv("FUSION_KNN_WEIGHT", "0.7"))
+    FUSION_RANK_CONSTANT: int = int(os.getenv("FUSION_RANK_CONSTANT", "60"))
+
+    # --- Query Planning ---
+    # "two_call" routes and rewrites with two Gemini calls; "single" asks for intent, search query and an
+    # optional file filter as one JSON response, falling back to the two calls if it does not validate.
+    QUERY_PLANNER: str = os.getenv("QUERY_PLANNER", "two_call")
+
+    # --- Adaptive Retrieval ---
+    # Skips the LLM rewrite for keyword queries or confident first-pass results, and trims
+    # the hit list at a score gap. Decisions are logged (logger app.services.adaptive_retrieval).
+    ADAPTIVE_RETRIEVAL: bool = os.getenv("ADAPTIVE_RETRIEVAL", "false").lower() == "true"
+    ADAPTIVE_KEYWORD_MAX_TERMS: int = int(os.getenv("ADAPTIVE_KEYWORD_MAX_TERMS", "4"))
+    ADAPTIVE_MAX_K: int = int(os.getenv("ADAPTIVE_MAX_K", "8")) # Hits fetched before the cut
+    ADAPTIVE_MIN_K: int = int(os.getenv("ADAPTIVE_MIN_K", "3")) # Never cut below this many hits (see cut_by_scores)
+    ADAPTIVE_SCORE_RATIO: float = float(os.getenv("ADAPTIVE_SCORE_RATIO", "0.5")) # Drop hits below this fraction of the top score
+    ADAPTIVE_SCORE_GAP: float = float(os.getenv("ADAPTIVE_SCORE_GAP", "0.35")) # Cut at a relative drop this large between neighbours
+    # RRF score of a top hit that ranks near the top in both BM25 and kNN (2/(60+3) ~= 0.0317).
+    # Retune it for HYBRID_FUSION=linear, whose scores range over [0, 2].
+    ADAPTIVE_CONFIDENT_SCORE: float = float(os.getenv("ADAPTIVE_CONFIDENT_SCORE", "0.0317"))
+
+    # --- Timeouts & Circuit Breakers ---
+    # Bounded calls plus per-call-site breakers keep an ES or Gemini outage from hanging every request.
+    ES_REQUEST_TIMEOUT_SECONDS: float = float(os.getenv("ES_REQUEST_TIMEOUT_SECONDS", "30"))
+    ES_SEARCH_TIMEOUT_SECONDS: float = float(os.getenv("ES_SEARCH_TIMEOUT_SECONDS", "10"))
+    ES_MAX_RETRIES: int = int(os.getenv("ES_MAX_RETRIES", "2"))
+    GEMINI_TIMEOUT_SECONDS: float = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+    ES_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("ES_BREAKER_FAILURE_THRESHOLD", "5")) # Consecutive failures before opening
+    ES_BREAKER_RECOVERY_SECONDS: float = float(os.getenv("ES_BREAKER_RECOVERY_SECONDS", "30")) # Open time before a half-open probe
+    GEMINI_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("GEMINI_BREAKER_FAILURE_THRESHOLD", "5"))
+    GEMINI_BREAKER_RECOVERY_SECONDS: float = float(os.getenv("GEMINI_BREAKER_RECOVERY_SECONDS", "30"))
+    BREAKER_HALF_OPEN_MAX_CALLS: int = int(os.getenv("BREAKER_HALF_OPEN_MAX_CALLS", "1")) # Concurrent probes while half-open
+
+    # --- Traffic Recording ---
+    # When set, anonymized chat/upload request shapes are written here as rotating JSONL
+    # (replay with `python -m app.cli.replay_traffic`). Files take up to MAX_BYTES * (BACKUP_COUNT + 1)
+    # (300 MB by default), which on Cloud Run's in-memory /tmp counts against instance memory.
+    TRAFFIC_RECORD_PATH: str | None = os.getenv("TRAFFIC_RECORD_PATH")
+    TRAFFIC_RECORD_SAMPLE_RATE: float = float(os.getenv("TRAFFIC_RECORD_SAMPLE_RATE", "1.0"))
+    TRAFFIC_RECORD_MAX_BYTES: int = int(os.getenv("TRAFFIC_RECORD_MAX_BYTES", str(50 * 1024 * 1024)))
+    TRAFFIC_RECORD_BACKUP_COUNT: int = int(os.getenv("TRAFFIC_RECORD_BACKUP_COUNT", "5"))
+    TRAFFIC_RECORD_USER_BUCKETS: int = int(os.getenv("TRAFFIC_RECORD_USER_BUCKETS", "64")) # Users are hashed into this many buckets
+    TRAFFIC_RECORD_SALT: str = os.getenv("TRAFFIC_RECORD_SALT", "")
+
+    # --- Slow Query Log ---
+    SLOW_QUERY_THRESHOLD_MS: float = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "1000"))
+    SLOW_QUERY_SAMPLE_RATE: float = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "0.0")) # Fraction of fast queries to profile anyway
+    SLOW_QUERY_LOG_SIZE: int = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200")) # Ring buffer capacity
+    SLOW_QUERY_LOG_PATH: str | None = os.getenv("SLOW_QUERY_LOG_PATH") # Optional JSONL file
+    # Each profile re-runs a query up to 3 times; these bound that extra load (beyond them, entries keep timings only).
+    SLOW_QUERY_PROFILES_PER_MINUTE: float = float(os.getenv("SLOW_QUERY_PROFILES_PER_MINUTE", "6"))
+    SLOW_QUERY_MAX_IN_FLIGHT: int = int(os.getenv("SLOW_QUERY_MAX_IN_FLIGHT", "2")) # Concurrent profiling re-runs
+
+    # --- Embedding Service ---
+    # /api/embed serves the search embedding model to other services (e.g. the serverless api/ app).
+    EMBED_MAX_TEXTS: int = int(os.getenv("EMBED_MAX_TEXTS", "256"))
+    EMBED_API_KEY: str | None = os.getenv("EMBED_API_KEY") # Required in the X-Embed-Key header; unset disables /api/embed
+
+    # --- Admin ---
+    # /api/admin/* endpoints require this value in the X-Admin-Key header; unset disables them.
+    ADMIN_API_KEY: str | None = os.getenv("ADMIN_API_KEY")
+
+    # --- Tenant-Fair Ingestion ---
+    TENANT_MAX_BACKLOG: int = int(os.getenv("TENANT_MAX_BACKLOG", "200")) # Queued + running uploads per tenant before 429
+    TENANT_QUOTA_OVERRIDES: str | None = os.getenv("TENANT_QUOTA_OVERRIDES") # e.g. "tenant_a=2000,tenant_b=50"
+    TENANT_MAX_CONCURRENCY: int = int(os.getenv("TENANT_MAX_CONCURRENCY", "2")) # Uploads processed at once per tenant
+    TENANT_SLOT_TTL_SECONDS: int = int(os.getenv("TENANT_SLOT_TTL_SECONDS", "3600")) # Reclaims slots of crashed workers
+    TENANT_WEIGHTS: str | None = os.getenv("TENANT_WEIGHTS") # e.g. "tenant_a=4,tenant_b=0.5"; a tenant's backlog counts as backlog / weight
+    TENANT_RETRY_SECONDS: int = int(os.getenv("TENANT_RETRY_SECONDS", "5")) # First delay before retrying a capped task; doubles per deferral
+    TENANT_RETRY_MAX_SECONDS: int = int(os.getenv("TENANT_RETRY_MAX_SECONDS", "120")) # Longest delay between retries of a capped task
+    TENANT_MAX_DEFER_SECONDS: int = int(os.getenv("TENANT_MAX_DEFER_SECONDS", str(6 * 3600))) # A capped task fails once queued this long
+    SMALL_FILE_BYTES: int = int(os.getenv("SMALL_FILE_BYTES", str(256 * 1024))) # Uploads up to this size use the priority lane
+
+    # --- Inline Ingestion ---
+    # .txt/.md uploads up to this size are indexed in the API process instead of via Celery (0 disables).
+    INLINE_INGEST_MAX_BYTES: int = int(os.getenv("INLINE_INGEST_MAX_BYTES", str(64 * 1024)))
+    INLINE_INGEST_WORKERS: int = int(os.getenv("INLINE_INGEST_WORKERS", "2")) # Concurrent inline ingests per instance
+
+    # --- Bulk Write Tuning ---
+    # Writes of at least this many chunks suspend periodic refresh until they finish.
+    BULK_REFRESH_SUSPEND_THRESHOLD: int = int(os.getenv("BULK_REFRESH_SUSPEND_THRESHOLD", "500"))
+    ES_REFRESH_INTERVAL: str = os.getenv("ES_REFRESH_INTERVAL", "1s") # Restored after a suspended write
+    REFRESH_SUSPEND_TTL_SECONDS: int = int(os.getenv("REFRESH_SUSPEND_TTL_SECONDS", "3600"))
+
+    # --- Chunking ---
+    # Chunk size in embedding-model tokens (MiniLM's max_seq_length is 256). 0 = legacy 1000-character chunks.
+    CHUNK_SIZE_TOKENS: int = int(os.getenv("CHUNK_SIZE_TOKENS", "224"))
+    CHUNK_OVERLAP_TOKENS: int = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+    # --- PDF Extraction ---
+    # PDFs with at least PDF_PARALLEL_MIN_PAGES pages are extracted in parallel page ranges.
+    PDF_EXTRACT_WORKERS: int = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1))) # Capped by a worker child's CPU share
+    PDF_PARALLEL_MIN_PAGES: int = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+
     # --- File Handling ---
     TEMP_UPLOAD_DIR: str = os.getenv("TEMP_UPLOAD_DIR", "/tmp/uploads") # Use /tmp in Cloud Run
 
@@ -73,12 +231,34 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-# --- Post-Initialization Validation/Warnings ---
-if "MISSING" in settings.GEMINI_API_KEY:
-    logger.critical("CRITICAL: GEMINI_API_KEY is missing or invalid!")
-if not settings.ELASTIC_CLOUD_ID or not settings.ELASTIC_API_KEY:
-    if not settings.ELASTICSEARCH_URL:
-        logger.critical("CRITICAL: Elasticsearch connection details (Cloud ID & API Key, or URL) are missing!")
+# Env var holding the Secret Manager resource name -> settings attribute it populates
+SECRET_SETTINGS = {
+    "GOOGLE_API_KEY_SECRET_NAME": "GEMINI_API_KEY",
+    "ELASTIC_API_KEY_SECRET_NAME": "ELASTIC_API_KEY",
+}
+_secrets_loaded = False
+
+def load_secrets() -> None:
+    """
+    Fetches secrets from Secret Manager (blocking) and applies them to `settings`.
+    Call once at startup, off the event loop. Subsequent calls are no-ops.
+    """
+    global _secrets_loaded
+    if _secrets_loaded:
+        return
+    for env_var, attribute in SECRET_SETTINGS.items():
+        value = get_secret(env_var)
+        if value:
+            setattr(settings, attribute, value)
+    _secrets_loaded = True
+
+    # --- Post-Load Validation/Warnings ---
+    if "MISSING" in settings.GEMINI_API_KEY:
+        logger.critical("CRITICAL: GEMINI_API_KEY is missing or invalid!")
+    if not settings.ELASTIC_CLOUD_ID or not settings.ELASTIC_API_KEY:
+        if not settings.ELASTICSEARCH_URL:
+            logger.critical("CRITICAL: Elasticsearch connection details (Cloud ID & API Key, or URL) are missing!")
+
 if "localhost" in settings.REDIS_URL or "redis_rag" in settings.REDIS_URL:
      warnings.warn("REDIS_URL is using a default/Docker value. Ensure it's correctly set to your Memorystore Private IP in the GCP environment.", RuntimeWarning)
      logger.warning("REDIS_URL is using a default/Docker value. Ensure it points to Memorystore Private IP in GCP.")
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from app.core.config import load_secrets
+from app.services.es_client import close_es_client, ping_es_client
+from app.services.llm_services import configure_gemini, warm_prompts
+from app.services.model_registry import get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+WARMUP_RETRY_INITIAL_DELAY = 1.0 # seconds
+WARMUP_RETRY_MAX_DELAY = 30.0 # seconds
+# Attempts per component (~3.5 minutes with the backoff above) before it is marked
+# "failed": /readyz then reports a terminal error instead of retrying forever.
+WARMUP_MAX_ATTEMPTS = 12
+
+
+class ReadinessState:
+    """Tracks which startup components are warm. The instance is ready once all are."""
+
+    COMPONENTS = ("secrets", "elasticsearch", "gemini", "embedding_model")
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.components: dict[str, dict] = {
+            name: {"status": "pending", "attempts": 0, "seconds": None, "error": None}
+            for name in self.COMPONENTS
+        }
+
+    @property
+    def ready(self) -> bool:
+        return all(c["status"] == "ready" for c in self.components.values())
+
+    @property
+    def failed(self) -> list[str]:
+        return [name for name, c in self.components.items() if c["status"] == "failed"]
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "failed": self.failed,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 3),
+            "components": self.components,
+        }
+
+readiness = ReadinessState()
+
+
+async def _warm_component(name: str, warm_fn) -> None:
+    """Runs a warm-up step until it succeeds or WARMUP_MAX_ATTEMPTS fail, with capped exponential backoff."""
+    state = readiness.components[name]
+    delay = WARMUP_RETRY_INITIAL_DELAY
+    while True:
+        state["attempts"] += 1
+        start = time.perf_counter()
+        try:
+            await warm_fn()
+            state.update(status="ready", seconds=round(time.perf_counter() - start, 3), error=None)
+            logger.info(f"Startup: '{name}' ready in {state['seconds']}s (attempt {state['attempts']}).")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if state["attempts"] >= WARMUP_MAX_ATTEMPTS:
+                state.update(status="failed", error=str(e))
+                logger.critical(f"Startup: '{name}' failed {state['attempts']} times; giving up: {e}. "
+                                f"The instance stays unready until it is restarted.")
+                return
+            state.update(status="error", error=str(e))
+            logger.error(f"Startup: warming '{name}' failed (attempt {state['attempts']}): {e}. Retrying in {delay:.0f}s.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_DELAY)
+
+async def _warm_secrets():
+    await asyncio.to_thread(load_secrets)
+
+async def _warm_elasticsearch():
+    await ping_es_client()
+
+async def _warm_gemini():
+    if not configure_gemini():
+        raise RuntimeError("Gemini client could not be configured")
+    await warm_prompts()
+
+def _load_and_encode():
+    model = get_embedding_model()
+    if model is None:
+        raise RuntimeError("Embedding model failed to load")
+    # A dummy encode JIT-warms the model so the first real query is not slow.
+    model.encode(["warm-up query"], show_progress_bar=False)
+
+async def _warm_embedding_model():
+    await asyncio.to_thread(_load_and_encode)
+
+async def warm_up():
+    """
+    Warms all dependencies concurrently. Secrets must be loaded before ES and
+    Gemini are configured, while the embedding model loads independently.
+    """
+    async def secrets_then_clients():
+        await _warm_component("secrets", _warm_secrets)
+        if readiness.components["secrets"]["status"] == "failed":
+            for name in ("elasticsearch", "gemini"):
+                readiness.components[name].update(status="failed", error="secrets unavailable")
+            return
+        await asyncio.gather(
+            _warm_component("elasticsearch", _warm_elasticsearch),
+            _warm_component("gemini", _warm_gemini),
+        )
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        secrets_then_clients(),
+        _warm_component("embedding_model", _warm_embedding_model),
+    )
+    if readiness.failed:
+        logger.critical(f"Startup: components {readiness.failed} failed to warm up. Instance is not ready.")
+    else:
+        logger.info(f"Startup: all components warm in {time.perf_counter() - start:.2f}s. Instance is ready.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application lifespan. Warm-up runs in the background so liveness (/healthz)
+    answers immediately, while readiness (/readyz) stays 503 until it completes.
+    """
+    logger.info("Application startup...")
+    warmup_task = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        logger.info("Application shutdown...")
+        warmup_task.cancel()
+        try:
+            await warmup_task
+        except asyncio.CancelledError:
+            pass
+        # Cleanly close the Elasticsearch client connection
+        await close_es_client()
@@ -0,0 +1,246 @@
+"""
+Non-blocking, batched log export for the API process.
+
+Without this, every log call runs the root handlers inline. With Cloud
+Logging on Cloud Run, that means formatting a JSON entry and writing it to
+stdout from inside the event loop, several times per request.
+`install_queue_logging` moves the existing handlers of the root logger and of
+uvicorn's own loggers behind one bounded in-memory queue:
+
+- The calling thread only runs the filters and an append: the sampling
+  filter, then each target handler's level check and filters. Those filters
+  run there because some read request context; Cloud Logging's filter, for
+  one, attaches the trace and HTTP request from the current request. Records
+  are neither formatted nor copied there, so %-style arguments
+  (`logger.info("... %s", value)`) are formatted on the exporter thread,
+  which only formats and emits.
+- One background exporter thread drains the queue in batches of up to
+  LOG_BATCH_SIZE records. A plain stream handler gets its part of a batch
+  in a single write and flush.
+- When the queue is full, a record is dropped and counted; the caller
+  never blocks.
+- INFO records from the high-volume loggers in LOG_SAMPLED_LOGGERS are kept
+  with probability LOG_INFO_SAMPLE_RATE. Warnings and errors are always kept.
+
+Counters: rag_log_records_dropped_total, rag_log_records_sampled_out_total
+and rag_log_queue_depth. /api/admin/logging has the same numbers plus batch
+statistics. benchmarks/bench_logging.py measures the per-request cost.
+"""
+import atexit
+import logging
+import random
+import threading
+from collections import deque
+from typing import Optional, Sequence
+from app.core.config import settings
+from app.core.metrics import log_records_dropped_total, log_records_sampled_out_total, log_queue_depth
+
+# Loggers whose handlers are moved behind the queue ("" is the root logger).
+# uvicorn and uvicorn.access do not propagate to the root and have their own handlers.
+QUEUED_LOGGERS = ("", "uvicorn", "uvicorn.access")
+
+
+class LogSampler(logging.Filter):
+    """Keeps a fraction of INFO records from the given loggers (and their children)."""
+
+    def __init__(self, rate: float, logger_names: Sequence[str]):
+        super().__init__()
+        self.rate = rate
+        self.names = tuple(logger_names)
+        self.prefixes = tuple(f"{name}." for name in logger_names)
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or record.levelno != logging.INFO:
+            return True
+        if record.name not in self.names and not record.name.startswith(self.prefixes):
+            return True
+        if random.random() < self.rate:
+            return True
+        self.sampled_out += 1
+        log_records_sampled_out_total.inc()
+        return False
+
+
+class LogExporter:
+    """Bounded queue of (handlers, record) drained by one background thread in batches."""
+
+    def __init__(self, capacity: int, batch_size: int):
+        self.capacity = capacity
+        self.batch_size = max(1, batch_size)
+        self._pending: deque = deque()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+        self.exported = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="log-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, handlers: Sequence[logging.Handler], record: logging.LogRecord) -> None:
+        """Called on the logging thread: an append, or a counted drop when full. Never blocks."""
+        if len(self._pending) >= self.capacity:
+            self.dropped += 1
+            log_records_dropped_total.labels(level=record.levelname).inc()
+            return
+        self._pending.append((handlers, record))
+        if not self._wake.is_set():
+            self._wake.set()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Exports what is queued and stops the thread."""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(timeout=1.0)
+            self._wake.clear()
+            while self._pending:
+                log_queue_depth.set(len(self._pending))
+                count = min(self.batch_size, len(self._pending))
+                self._export([self._pending.popleft() for _ in range(count)])
+            log_queue_depth.set(0)
+            if self._stopping:
+                return
+
+    def _export(self, batch: list) -> None:
+        self.batches += 1
+        self.exported += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        per_handler: dict[logging.Handler, list] = {}
+        for handlers, record in batch:
+            for handler in handlers:
+                per_handler.setdefault(handler, []).append(record)
+        for handler, records in per_handler.items():
+            if type(handler).emit is logging.StreamHandler.emit:
+                _write_batch(handler, records)
+            else:
+                # Handler.handle() would re-run the filters here, without the caller's context.
+                handler.acquire()
+                try:
+                    for record in records:
+                        handler.emit(record)
+                finally:
+                    handler.release()
+
+    def report(self) -> dict:
+        return {
+            "queue_depth": len(self._pending),
+            "capacity": self.capacity,
+            "batch_size": self.batch_size,
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+        }
+
+
+def _write_batch(handler: logging.StreamHandler, records: list) -> None:
+    """Formats a stream handler's (already filtered) records and writes them with one write and flush."""
+    lines = []
+    for record in records:
+        try:
+            lines.append(handler.format(record) + handler.terminator)
+        except Exception:
+            handler.handleError(record)
+    if not lines:
+        return
+    handler.acquire()
+    try:
+        handler.stream.write("".join(lines))
+        handler.flush()
+    except Exception:
+        handler.handleError(records[-1])
+    finally:
+        handler.release()
+
+
+class QueueingHandler(logging.Handler):
+    """
+    Hands records to the exporter without formatting or locking. Each target's
+    level and filters are applied here, on the calling thread, and the record
+    is queued for the targets that accept it.
+    """
+
+    def __init__(self, exporter: LogExporter, targets: Sequence[logging.Handler]):
+        super().__init__()
+        self.exporter = exporter
+        self.targets = tuple(targets)
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            accepted = tuple(t for t in self.targets if record.levelno >= t.level and t.filter(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if accepted:
+            self.exporter.submit(self.targets if len(accepted) == len(self.targets) else accepted, record)
+
+
+# --- Process-wide state ---
+log_exporter: Optional[LogExporter] = None
+log_sampler: Optional[LogSampler] = None
+_original_handlers: dict[str, list] = {}
+
+
+def install_queue_logging() -> Optional[LogExporter]:
+    """Moves the current handlers of QUEUED_LOGGERS behind the export queue (once per process)."""
+    global log_exporter, log_sampler
+    if log_exporter is not None or not settings.LOG_QUEUE_ENABLED:
+        return log_exporter
+    exporter = LogExporter(settings.LOG_QUEUE_SIZE, settings.LOG_BATCH_SIZE)
+    sampled = [name.strip() for name in settings.LOG_SAMPLED_LOGGERS.split(",") if name.strip()]
+    sampler = LogSampler(settings.LOG_INFO_SAMPLE_RATE, sampled)
+    for name in QUEUED_LOGGERS:
+        target = logging.getLogger(name)
+        if not target.handlers:
+            continue
+        _original_handlers[name] = list(target.handlers)
+        queueing = QueueingHandler(exporter, target.handlers)
+        queueing.addFilter(sampler)
+        target.handlers = [queueing]
+    exporter.start()
+    atexit.register(stop_queue_logging)
+    log_exporter, log_sampler = exporter, sampler
+    logging.getLogger(__name__).info(
+        f"Queued log export enabled for {sorted(_original_handlers) or 'no'} loggers "
+        f"(queue {exporter.capacity}, batch {exporter.batch_size}, INFO sample rate {sampler.rate})."
+    )
+    return exporter
+
+
+def stop_queue_logging() -> None:
+    """Restores the original handlers and flushes the queue (at shutdown)."""
+    global log_exporter
+    if log_exporter is None:
+        return
+    for name, handlers in _original_handlers.items():
+        logging.getLogger(name).handlers = handlers
+    _original_handlers.clear()
+    log_exporter.stop()
+    log_exporter = None
+
+
+def logging_report() -> dict:
+    if log_exporter is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        **log_exporter.report(),
+        "info_sample_rate": log_sampler.rate,
+        "sampled_loggers": list(log_sampler.names),
+        "sampled_out": log_sampler.sampled_out,
+    }
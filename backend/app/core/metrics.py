@@ -0,0 +1,219 @@
+"""
+Prometheus instrumentation for the RAG pipeline and the ingestion worker.
+
+Metric children are resolved once at import (`STAGE_LATENCY[...]` etc.) so the
+hot path only pays for a `perf_counter()` pair and one histogram observe,
+which is cheap enough to leave on under full production load.
+
+Celery prefork workers: set PROMETHEUS_MULTIPROC_DIR (to an empty, writable
+directory) before the worker starts; each child then writes its samples there
+and the worker parent serves the aggregate on WORKER_METRICS_PORT.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from app.core.traffic_recorder import note_stage
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    REGISTRY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets (seconds) spanning sub-millisecond embeds to multi-second LLM calls.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+INGESTION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+PIPELINE_STAGES = ("answer_lookup", "route", "rewrite", "plan", "embed", "es_search", "generate")
+INGESTION_STAGES = ("parse", "chunk", "embed", "bulk_index", "total")
+
+# --- Query Pipeline ---
+pipeline_stage_seconds = Histogram(
+    "rag_pipeline_stage_seconds",
+    "Latency of each RAG query pipeline stage.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+query_intents_total = Counter(
+    "rag_query_intents_total",
+    "Queries by routed intent.",
+    ["intent"],
+)
+query_plans_total = Counter(
+    "rag_query_plans_total",
+    "Single-call query planner outcomes (QUERY_PLANNER=single); fallback_* used the route + rewrite calls.",
+    ["outcome"], # outcome: planned | fallback_invalid | fallback_blocked | fallback_circuit_open | fallback_error
+)
+answers_total = Counter(
+    "rag_answers_total",
+    "Answered queries by answer source; source=answer_index needed no live Gemini call.",
+    ["source"], # source: answer_index | llm
+)
+answer_index_lookups_total = Counter(
+    "rag_answer_index_lookups_total",
+    "Offline answer index lookups.",
+    ["outcome"], # outcome: hit | miss | tenant_docs (user's own documents match) | stale | error
+)
+cache_hits_total = Counter(
+    "rag_cache_hits_total",
+    "Cache lookups that were served from a cache.",
+    ["cache"],
+)
+cache_misses_total = Counter(
+    "rag_cache_misses_total",
+    "Cache lookups that missed.",
+    ["cache"],
+)
+adaptive_retrieval_total = Counter(
+    "rag_adaptive_retrieval_total",
+    "Adaptive retrieval rewrite decisions.",
+    ["decision"], # decision: skipped_keyword | skipped_confident | rewritten | planned
+)
+context_chunks = Histogram(
+    "rag_context_chunks",
+    "Retrieved chunks passed to the answer generator after the adaptive cut.",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20),
+)
+es_errors_total = Counter(
+    "rag_es_errors_total",
+    "Elasticsearch operations that raised an error.",
+    ["operation"],
+)
+gemini_blocked_total = Counter(
+    "rag_gemini_blocked_total",
+    "Gemini responses blocked by safety filters or returned without content.",
+    ["call_site"],
+)
+circuit_state = Gauge(
+    "rag_circuit_state",
+    "Circuit breaker state per dependency call site: 0 closed, 1 half-open, 2 open.",
+    ["breaker"],
+    multiprocess_mode="livemax",
+)
+circuit_rejections_total = Counter(
+    "rag_circuit_rejections_total",
+    "Calls rejected without reaching the dependency because its breaker was open.",
+    ["breaker"],
+)
+llm_tokens_total = Counter(
+    "rag_llm_tokens_total",
+    "Gemini token usage as reported by the API.",
+    ["call_site", "kind"], # kind: prompt | prompt_static | prompt_dynamic | prompt_cached | response
+)
+
+# --- Ingestion (Celery worker) ---
+ingestion_stage_seconds = Histogram(
+    "rag_ingestion_stage_seconds",
+    "Latency of each document ingestion stage in the Celery worker.",
+    ["stage"],
+    buckets=INGESTION_BUCKETS,
+)
+ingested_chunks_total = Counter(
+    "rag_ingested_chunks_total",
+    "Chunks written to Elasticsearch by ingestion.",
+    ["outcome"], # outcome: indexed | failed
+)
+ingestion_queue_wait_seconds = Histogram(
+    "rag_ingestion_queue_wait_seconds",
+    "Time from upload until an ingestion task starts processing (per-tenant stats: /api/admin/ingestion/tenants).",
+    ["lane"], # lane: small | standard
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0),
+)
+embedding_chunks_total = Counter(
+    "rag_embedding_chunks_total",
+    "Chunks embedded during ingestion; outcome=resplit counts chunks that exceeded the model's max_seq_length.",
+    ["outcome"], # outcome: embedded | resplit
+)
+
+# --- Logging (API process, see log_export) ---
+log_records_dropped_total = Counter(
+    "rag_log_records_dropped_total",
+    "Log records dropped because the log export queue was full.",
+    ["level"],
+)
+log_records_sampled_out_total = Counter(
+    "rag_log_records_sampled_out_total",
+    "INFO records skipped by LOG_INFO_SAMPLE_RATE sampling.",
+)
+log_queue_depth = Gauge(
+    "rag_log_queue_depth",
+    "Log records waiting for the background exporter.",
+    multiprocess_mode="livesum",
+)
+
+# Pre-resolved children keep label lookups off the hot path.
+STAGE_LATENCY = {stage: pipeline_stage_seconds.labels(stage=stage) for stage in PIPELINE_STAGES}
+INGESTION_LATENCY = {stage: ingestion_stage_seconds.labels(stage=stage) for stage in INGESTION_STAGES}
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Observes the duration of a query pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY[stage].observe(elapsed)
+        note_stage(stage, elapsed)
+
+@contextmanager
+def time_ingestion_stage(stage: str):
+    """Observes the duration of an ingestion stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        INGESTION_LATENCY[stage].observe(elapsed)
+        note_stage(stage, elapsed)
+
+def record_llm_usage(call_site: str, response, static_tokens: int = 0) -> None:
+    """
+    Adds token counts from a Gemini response's usage metadata. The prompt is
+    split into its static part (system instruction, possibly served from the
+    context cache) and the dynamic per-request part.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt_tokens:
+        static = min(cached_tokens or static_tokens, prompt_tokens)
+        llm_tokens_total.labels(call_site=call_site, kind="prompt").inc(prompt_tokens)
+        llm_tokens_total.labels(call_site=call_site, kind="prompt_static").inc(static)
+        llm_tokens_total.labels(call_site=call_site, kind="prompt_dynamic").inc(prompt_tokens - static)
+        logger.debug(f"LLM '{call_site}' prompt tokens: {static} static ({cached_tokens} cached) + {prompt_tokens - static} dynamic.")
+    if cached_tokens:
+        llm_tokens_total.labels(call_site=call_site, kind="prompt_cached").inc(cached_tokens)
+    if response_tokens:
+        llm_tokens_total.labels(call_site=call_site, kind="response").inc(response_tokens)
+
+def render_metrics() -> tuple[bytes, str]:
+    """Returns the exposition payload and its content type."""
+    return generate_latest(_collection_registry()), CONTENT_TYPE_LATEST
+
+def _collection_registry():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def start_worker_metrics_server(port: int) -> None:
+    """Serves worker metrics over HTTP. Call once, from the Celery worker parent process."""
+    from prometheus_client import start_http_server
+    try:
+        start_http_server(port, registry=_collection_registry())
+        logger.info(f"Worker metrics available on port {port} at /metrics.")
+    except Exception as e:
+        logger.error(f"Could not start worker metrics server on port {port}: {e}")
@@ -0,0 +1,152 @@
+"""
+Opt-in recorder of production request shapes, for realistic load replay
+(see app/cli/replay_traffic.py).
+
+When TRAFFIC_RECORD_PATH is set, the middleware writes one JSON line per
+chat and upload request to a size-rotated file. Records are anonymized: no
+query text, file names or user ids, only shapes and timings:
+
+    {"ts": 1718000000.123, "route": "/api/query", "method": "POST",
+     "status": 200, "duration_ms": 812.4, "ttfb_ms": 812.1,
+     "user_bucket": 17, "intent": "query_documents", "query_chars": [42],
+     "stage_ms": {"route": 210.3, "rewrite": 190.2, "embed": 8.1, ...}}
+
+Handlers add fields with `annotate()`, and `time_stage` adds stage timings
+through `note_stage()`; both are no-ops for requests that are not recorded.
+For batches, `stage_ms` sums each stage over all queries in the batch.
+
+Records are written (and files rotated) by a background thread behind a
+bounded queue (the LogExporter of app/core/log_export.py), so the event loop
+only appends; when the queue is full, records are dropped and counted in
+rag_log_records_dropped_total.
+
+Disk: up to TRAFFIC_RECORD_MAX_BYTES * (TRAFFIC_RECORD_BACKUP_COUNT + 1),
+300 MB with the defaults. On Cloud Run, /tmp is an in-memory filesystem, so
+that counts against the instance's memory limit; lower the limits or point
+TRAFFIC_RECORD_PATH at a mounted volume.
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RECORDED_ROUTES = {
+    ("POST", "/api/query"),
+    ("POST", "/api/query/batch"),
+    ("POST", "/api/upload"),
+    ("PUT", "/api/documents"),
+}
+
+_current_record: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("traffic_record", default=None)
+
+
+def annotate(**fields) -> None:
+    """Adds fields to the record of the current request, if it is being recorded."""
+    record = _current_record.get()
+    if record is not None:
+        record.update(fields)
+
+def note_stage(stage: str, seconds: float) -> None:
+    """Adds a pipeline stage duration to the record of the current request."""
+    record = _current_record.get()
+    if record is not None:
+        stages = record.setdefault("stage_ms", {})
+        stages[stage] = round(stages.get(stage, 0.0) + seconds * 1000, 2)
+
+@contextmanager
+def recording(record: dict):
+    """Collects annotate() and note_stage() output into `record` for the duration of the block."""
+    token = _current_record.set(record)
+    try:
+        yield record
+    finally:
+        _current_record.reset(token)
+
+def user_bucket(user_id: str) -> int:
+    """Stable, salted bucket for a user id, so tenant skew survives anonymization."""
+    digest = hashlib.sha256(f"{settings.TRAFFIC_RECORD_SALT}:{user_id}".encode()).digest()
+    return int.from_bytes(digest[:4], "big") % settings.TRAFFIC_RECORD_USER_BUCKETS
+
+
+class TrafficRecorder:
+    def __init__(self, path: str, max_bytes: int, backup_count: int, sample_rate: float):
+        from app.core.log_export import LogExporter, QueueingHandler # log_export -> metrics -> this module
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._exporter = LogExporter(settings.LOG_QUEUE_SIZE, settings.LOG_BATCH_SIZE)
+        self._sink = logging.getLogger("rag.traffic")
+        self._sink.handlers = [QueueingHandler(self._exporter, [handler])]
+        self._sink.setLevel(logging.INFO)
+        self._sink.propagate = False
+        self._exporter.start()
+        atexit.register(self.close)
+
+    def should_record(self, method: str, path: str) -> bool:
+        return (method, path.rstrip("/")) in RECORDED_ROUTES and (
+            self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        )
+
+    def write(self, record: dict) -> None:
+        try:
+            self._sink.info(json.dumps(record, separators=(",", ":")))
+        except Exception as e:
+            logger.debug("Could not write traffic record: %s", e)
+
+    def close(self) -> None:
+        """Writes out queued records (at shutdown)."""
+        self._exporter.stop()
+
+
+class TrafficRecorderMiddleware:
+    """ASGI middleware recording one anonymized line per chat/upload request (including streamed responses)."""
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.recorder.should_record(scope["method"], scope["path"]):
+            return await self.app(scope, receive, send)
+
+        record = {"ts": round(time.time(), 3), "route": scope["path"], "method": scope["method"]}
+        start = time.perf_counter()
+
+        async def send_and_time(message):
+            if message["type"] == "http.response.start":
+                record["status"] = message["status"]
+                record["ttfb_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            await send(message)
+
+        try:
+            with recording(record):
+                await self.app(scope, receive, send_and_time)
+        finally:
+            record.setdefault("status", 500)
+            record["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self.recorder.write(record)
+
+
+def get_traffic_recorder() -> Optional[TrafficRecorder]:
+    """Returns a recorder when TRAFFIC_RECORD_PATH is set, else None."""
+    if not settings.TRAFFIC_RECORD_PATH:
+        return None
+    logger.info("Recording request shapes to %s (sample rate %s).", settings.TRAFFIC_RECORD_PATH, settings.TRAFFIC_RECORD_SAMPLE_RATE)
+    return TrafficRecorder(
+        settings.TRAFFIC_RECORD_PATH,
+        max_bytes=settings.TRAFFIC_RECORD_MAX_BYTES,
+        backup_count=settings.TRAFFIC_RECORD_BACKUP_COUNT,
+        sample_rate=settings.TRAFFIC_RECORD_SAMPLE_RATE,
+    )
@@ -0,0 +1,155 @@
+"""
+CPU and memory layout of Celery ingestion workers.
+
+With the prefork pool, every child runs its own torch intra-op thread pool,
+which by default is sized to all cores. N children therefore oversubscribe
+the CPU N-fold. And if each child loads its own SentenceTransformer, model
+memory grows N-fold too.
+
+- `partition_threads` (parent, worker_init): sets threads per child to
+  usable cores // pool concurrency, or to WORKER_TORCH_THREADS. It exports
+  the OpenMP/MKL/OpenBLAS limits so children inherit them.
+- `preload_models` (parent): loads the embedding model before the pool forks,
+  so children share the weights copy-on-write. `gc.freeze()` keeps the cyclic
+  collector from writing to, and so copying, those pages. The parent never
+  runs inference: an OpenMP pool started before fork can hang the children.
+- `apply_thread_limits` (child, worker_process_init): applies the limits to
+  torch inside the child.
+- `cpu_share`: the cores one child may use, e.g. for PDF extraction processes.
+- `resource_report`: effective thread counts and shared vs. private memory,
+  logged by the parent and each child at startup.
+"""
+import gc
+import logging
+import os
+import sys
+from typing import Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+# Set in the parent by partition_threads and inherited by forked children.
+_threads_per_child: Optional[int] = None
+
+
+def usable_cpus() -> int:
+    """Cores this process may use: the CPU affinity mask, capped by a cgroup v2 CPU quota (containers)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def threads_for(concurrency: int) -> int:
+    if settings.WORKER_TORCH_THREADS > 0:
+        return settings.WORKER_TORCH_THREADS
+    return max(1, usable_cpus() // max(1, concurrency))
+
+
+def partition_threads(concurrency: int) -> int:
+    """Exports per-child thread limits; call in the parent before the pool starts."""
+    global _threads_per_child
+    _threads_per_child = threads_for(concurrency)
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(_threads_per_child)
+    if concurrency > 1:
+        # Fast tokenizers would otherwise start a thread per core in every child.
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    apply_thread_limits()
+    try:
+        import torch
+        torch.set_num_interop_threads(1) # Only settable before any parallel work; children inherit it
+    except (ImportError, RuntimeError):
+        pass
+    logger.info(f"Worker threads: {_threads_per_child} per child for concurrency {concurrency} "
+                f"on {usable_cpus()} usable CPUs.")
+    return _threads_per_child
+
+
+def cpu_share() -> int:
+    """Cores available to this process: its partitioned share in a worker child, else all usable cores."""
+    return _threads_per_child or usable_cpus()
+
+
+def apply_thread_limits() -> None:
+    """Applies the partitioned thread count to torch (and loaded BLAS libraries) in this process."""
+    threads = _threads_per_child or int(os.environ.get("OMP_NUM_THREADS", "0"))
+    if threads <= 0:
+        return
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except ImportError:
+        pass
+
+
+def _cuda_available() -> bool:
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def preload_models() -> None:
+    """Loads shared models in the parent so forked children inherit them instead of loading their own."""
+    from app.services.model_registry import get_embedding_model
+    if settings.EMBEDDING_DEVICE != "cpu" and _cuda_available():
+        # CUDA cannot be used in a child forked after the parent initialized it.
+        logger.info("Skipping model preload: a GPU is available; each worker child loads its own copy.")
+        return
+    if get_embedding_model() is None:
+        logger.warning("Model preload failed; each worker child will load the model itself.")
+        return
+    gc.collect()
+    gc.freeze()
+
+
+def _smaps_rollup() -> dict:
+    """Memory totals of this process in bytes (Linux only)."""
+    totals = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    totals[parts[0].rstrip(":").lower()] = int(parts[1]) * 1024
+    except OSError:
+        pass
+    return totals
+
+
+def resource_report() -> dict:
+    """Effective thread counts and memory sharing of this process."""
+    report = {
+        "pid": os.getpid(),
+        "usable_cpus": usable_cpus(),
+        "threads_per_child": _threads_per_child,
+        "thread_env": {name: os.environ.get(name) for name in THREAD_ENV_VARS},
+    }
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        report["torch_threads"] = torch.get_num_threads()
+        report["torch_interop_threads"] = torch.get_num_interop_threads()
+    memory = _smaps_rollup()
+    if memory:
+        report["rss_bytes"] = memory.get("rss")
+        report["pss_bytes"] = memory.get("pss") # Shared pages split across the processes sharing them
+        report["shared_bytes"] = memory.get("shared_clean", 0) + memory.get("shared_dirty", 0)
+        report["private_bytes"] = memory.get("private_clean", 0) + memory.get("private_dirty", 0)
+    return report
@@ -1,12 +1,19 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 
 class UploadResponse(BaseModel):
     """Response model for file upload."""
     file_name: str
     content_type: str
     message: str
-    task_id: str
+    task_id: Optional[str] = None # Set when the file was queued for Celery processing
+    indexed_chunks: Optional[int] = None # Set when the file was indexed inline
+
+class DeleteDocumentResponse(BaseModel):
+    """Response model for document deletion."""
+    user_id: str
+    file_name: str
+    deleted_chunks: int
 
 class QueryRequest(BaseModel):
     """Request model for a user query."""
@@ -17,3 +24,30 @@ class QueryRequest(BaseModel):
 class QueryResponse(BaseModel):
     """Response model for a user query."""
     answer: str
+    degraded: Optional[List[str]] = None # e.g. ["retrieval_unavailable", "rewrite_skipped"] while a circuit is open
+    sources: Optional[List[str]] = None # Source chunks, set when the answer came from the offline answer index
+
+class BatchQueryRequest(BaseModel):
+    """Request model for a batch of user queries."""
+    queries: List[QueryRequest] = Field(..., min_length=1, description="The queries to answer.")
+
+class BatchQueryResult(BaseModel):
+    """One streamed result of a batch query, emitted as soon as its answer is ready."""
+    index: int = Field(..., description="Position of the query in the request.")
+    user_id: str
+    intent: Optional[str] = None
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    degraded: Optional[List[str]] = None
+    sources: Optional[List[str]] = None
+
+class EmbedRequest(BaseModel):
+    """Request model for the embedding service."""
+    texts: List[str] = Field(..., min_length=1, description="Texts to embed, in order.")
+    normalize: bool = Field(False, description="L2-normalize the vectors (for cosine similarity via dot product).")
+
+class EmbedResponse(BaseModel):
+    """Response model for the embedding service."""
+    model: str
+    dim: int
+    vectors: List[List[float]]
@@ -0,0 +1,118 @@
+"""
+Adaptive retrieval: spend the rewrite LLM call and prompt context only where they help.
+
+1. Rewrite skip. Short keyword-style queries ("refund policy") are searched
+   as-is. Otherwise the raw query is searched first; if its top hit is
+   confident (ranked near the top by both BM25 and kNN), that result is used
+   and the rewrite is skipped. Only low-confidence queries are rewritten and
+   searched again.
+2. Result cut. Up to ADAPTIVE_MAX_K hits are fetched and the list is cut
+   where scores fall below ADAPTIVE_SCORE_RATIO of the top score or drop
+   sharply (ADAPTIVE_SCORE_GAP) between neighbours, but never below
+   ADAPTIVE_MIN_K hits.
+
+Scores are ES RRF scores: sum(1 / (rank_constant + rank)) over BM25 and kNN,
+so a hit found by both retrievers scores about twice a single-list hit
+(2/61 ~= 0.0328 vs. at most 1/61). Past ADAPTIVE_MIN_K the cut therefore
+mostly drops the hits only one retriever found rather than finding a real
+relevance gap; ADAPTIVE_MIN_K keeps enough context when few hits are in
+both lists.
+Every decision is logged as one `adaptive_retrieval` line for tuning.
+"""
+import json
+import logging
+import re
+from typing import List, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import time_stage, adaptive_retrieval_total, context_chunks
+from app.services.llm_services import rewrite_query_for_search
+from app.services.search_service import perform_hybrid_search_scored
+
+logger = logging.getLogger(__name__)
+
+# Words that mark a conversational question rather than a keyword query.
+CONVERSATIONAL_WORDS = {
+    "what", "why", "how", "when", "where", "who", "which", "can", "could", "would",
+    "should", "please", "tell", "explain", "i", "me", "my", "you", "is", "are", "do", "does",
+}
+_TERM = re.compile(r"[\w'-]+")
+
+
+def is_keyword_query(query_text: str) -> bool:
+    """True for short queries with no question words, e.g. 'data retention policy'."""
+    if "?" in query_text:
+        return False
+    terms = _TERM.findall(query_text.lower())
+    return 0 < len(terms) <= settings.ADAPTIVE_KEYWORD_MAX_TERMS and not CONVERSATIONAL_WORDS.intersection(terms)
+
+
+def is_confident(hits: List[Tuple[str, float]]) -> bool:
+    return bool(hits) and hits[0][1] >= settings.ADAPTIVE_CONFIDENT_SCORE
+
+
+def cut_by_scores(hits: List[Tuple[str, float]]) -> Tuple[int, str]:
+    """
+    Returns how many of the (best-first) hits to keep, and why the list was
+    cut there. At least ADAPTIVE_MIN_K hits are kept.
+    """
+    if len(hits) <= settings.ADAPTIVE_MIN_K:
+        return len(hits), "all"
+    top = hits[0][1]
+    if top <= 0:
+        return min(len(hits), settings.ADAPTIVE_MAX_K), "no_scores"
+    for i in range(max(1, settings.ADAPTIVE_MIN_K), len(hits)):
+        previous, score = hits[i - 1][1], hits[i][1]
+        if score < top * settings.ADAPTIVE_SCORE_RATIO:
+            return i, "threshold"
+        if previous > 0 and (previous - score) / previous >= settings.ADAPTIVE_SCORE_GAP:
+            return i, "gap"
+    return len(hits), "all"
+
+
+def _log_decision(user_id: str, query_text: str, decision: str, hits: List[Tuple[str, float]], kept: int, cut_reason: str, rewritten: Optional[str] = None) -> None:
+    adaptive_retrieval_total.labels(decision=decision).inc()
+    context_chunks.observe(kept)
+    logger.info("adaptive_retrieval " + json.dumps({
+        "user_id": user_id,
+        "query": query_text[:200],
+        "rewrite": decision,
+        "rewritten_query": rewritten,
+        "scores": [round(score, 5) for _, score in hits],
+        "kept": kept,
+        "cut": cut_reason,
+    }))
+
+
+async def adaptive_retrieve(user_id: str, query_text: str, planned_query: Optional[str] = None,
+                            file_name: Optional[str] = None) -> List[str]:
+    """
+    Retrieves context for a document query, rewriting and cutting adaptively.
+    A `planned_query` from the single-call planner cost no extra LLM call, so
+    it is searched directly (with the planner's optional file filter) and only
+    the score cut applies.
+    """
+    if planned_query:
+        hits = await perform_hybrid_search_scored(user_id, planned_query, settings.ADAPTIVE_MAX_K, file_name)
+        kept, cut_reason = cut_by_scores(hits)
+        _log_decision(user_id, query_text, "planned", hits, kept, cut_reason, planned_query)
+        return [text for text, _ in hits[:kept]]
+
+    rewritten = None
+    hits = await perform_hybrid_search_scored(user_id, query_text, settings.ADAPTIVE_MAX_K)
+    if is_keyword_query(query_text):
+        decision = "skipped_keyword"
+    elif is_confident(hits):
+        decision = "skipped_confident"
+    else:
+        decision = "rewritten"
+        with time_stage("rewrite"):
+            rewritten = await rewrite_query_for_search(query_text)
+        if rewritten and rewritten != query_text:
+            rewritten_hits = await perform_hybrid_search_scored(user_id, rewritten, settings.ADAPTIVE_MAX_K)
+            # Keep the first pass if the rewrite found nothing better.
+            if rewritten_hits and (not hits or rewritten_hits[0][1] >= hits[0][1]):
+                hits = rewritten_hits
+
+    kept, cut_reason = cut_by_scores(hits)
+    _log_decision(user_id, query_text, decision, hits, kept, cut_reason, rewritten)
+    return [text for text, _ in hits[:kept]]
@@ -0,0 +1,282 @@
+"""
+Offline answer index for the preloaded corpus.
+
+Much of the traffic against the shared preloaded documents asks a predictable
+set of questions. `python -m app.cli.build_answer_index` mines such questions
+from preloaded chunks, or imports them from a list. It answers them in batch
+with the normal grounded generation and writes question, answer, source
+chunks and the question's embedding into a fresh index behind
+ANSWER_INDEX_ALIAS.
+
+At query time `lookup_answers` embeds the query and runs one kNN search over
+the stored questions. If the closest one has a cosine similarity of at least
+ANSWER_INDEX_MIN_SIMILARITY, its answer is served with its sources. The
+lookup runs before routing, so such a query makes no Gemini call at all.
+Stored answers only know the preloaded corpus. So the same round trip checks
+the user's own documents, and when one of their chunks reaches
+ANSWER_INDEX_TENANT_MIN_SIMILARITY, the query takes the live pipeline, which
+searches both.
+
+Each build records the preloaded index it was generated from, i.e. the
+concrete index behind PRELOADED_INDEX_ALIAS, in the index `_meta`. After
+`bulk_load --rebuild-preloaded` swaps the corpus, lookups count as "stale" and
+fall through to the live pipeline until the answers are rebuilt. bulk_load
+rebuilds them right after publishing.
+
+rag_answers_total{source} gives the share of queries answered without a live
+LLM call; /api/admin/answer-index shows the same for this instance.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from elasticsearch.helpers import async_scan
+from app.core.config import settings
+from app.core.metrics import time_stage, es_errors_total, answers_total, answer_index_lookups_total
+from app.services.es_client import get_es_client
+from app.services.model_registry import get_embedding_model
+from app.services.circuit_breaker import breakers, CircuitOpenError
+from app.services import preloaded_index
+
+logger = logging.getLogger(__name__)
+
+# How long a process trusts its cached corpus and answer index versions.
+VERSION_TTL_SECONDS = 60.0
+
+ANSWER_MAPPING = {
+    "properties": {
+        "question": {"type": "text"},
+        "question_vector": {
+            "type": "dense_vector",
+            "dims": settings.EMBEDDING_DIM,
+            "index": True,
+            "similarity": "cosine"
+        },
+        "answer": {"type": "text", "index": False},
+        "sources": {"type": "text", "index": False},
+        "origin": {"type": "keyword"}, # mined | imported
+    }
+}
+
+
+@dataclass
+class StoredAnswer:
+    question: str
+    answer: str
+    sources: List[str] = field(default_factory=list)
+    similarity: float = 0.0
+
+
+def enabled() -> bool:
+    return bool(settings.ANSWER_INDEX_ALIAS and settings.PRELOADED_INDEX_ALIAS)
+
+
+# --- Versions ---
+
+async def corpus_version(es_client) -> Optional[str]:
+    """The concrete preloaded index behind PRELOADED_INDEX_ALIAS (None before the first build)."""
+    return ",".join(await preloaded_index.aliased_indices(es_client)) or None
+
+
+async def answered_version(es_client) -> Optional[str]:
+    """The corpus version the index behind ANSWER_INDEX_ALIAS was built from (None if there is none)."""
+    if not await es_client.indices.exists_alias(name=settings.ANSWER_INDEX_ALIAS):
+        return None
+    response = await es_client.indices.get_mapping(index=settings.ANSWER_INDEX_ALIAS)
+    versions = {index.get("mappings", {}).get("_meta", {}).get("corpus_version") for index in response.values()}
+    return versions.pop() if len(versions) == 1 else None
+
+
+_versions = {"corpus": None, "answers": None, "checked_at": float("-inf")}
+
+
+async def _answers_current(es_client) -> bool:
+    """Whether the stored answers were built from the corpus that is searched now (cached per process)."""
+    if time.monotonic() - _versions["checked_at"] > VERSION_TTL_SECONDS:
+        corpus, answers = await asyncio.gather(corpus_version(es_client), answered_version(es_client))
+        if (corpus, answers) != (_versions["corpus"], _versions["answers"]):
+            logger.info("Answer index built from '%s'; preloaded corpus is '%s'.", answers, corpus)
+        _versions.update(corpus=corpus, answers=answers, checked_at=time.monotonic())
+    return _versions["answers"] is not None and _versions["answers"] == _versions["corpus"]
+
+
+# --- Query Time ---
+
+def _lookup_body(query_vector: List[float]) -> dict:
+    return {
+        "size": 1,
+        "_source": ["question", "answer", "sources"],
+        "knn": {
+            "field": "question_vector",
+            "query_vector": query_vector,
+            "k": 1,
+            "num_candidates": 20
+        }
+    }
+
+
+def _tenant_match_body(user_id: str, query_vector: List[float]) -> dict:
+    """Finds one of the user's own chunks close enough to the query that it should be searched live."""
+    return {
+        "size": 1,
+        "_source": False,
+        "knn": {
+            "field": "chunk_vector",
+            "query_vector": query_vector,
+            "k": 1,
+            "num_candidates": 20,
+            "similarity": settings.ANSWER_INDEX_TENANT_MIN_SIMILARITY,
+            "filter": [{"term": {"user_id": user_id}}]
+        }
+    }
+
+
+async def lookup_answers(queries: List[Tuple[str, str]]) -> List[Optional[StoredAnswer]]:
+    """
+    For (user_id, query_text) pairs: the stored answer for each query whose
+    closest stored question is similar enough and that matches nothing in the
+    user's own documents, else None, in input order. Never raises: on any
+    failure the queries take the live pipeline.
+    """
+    query_texts = [query_text for _, query_text in queries]
+    results: List[Optional[StoredAnswer]] = [None] * len(query_texts)
+    positions = [i for i, text in enumerate(query_texts) if text]
+    if not enabled() or not positions or not breakers["es_search"].available():
+        return results
+    embedding_model = get_embedding_model()
+    if embedding_model is None:
+        return results
+
+    try:
+        with time_stage("answer_lookup"):
+            es_client = get_es_client()
+            if not await _answers_current(es_client):
+                answer_index_lookups_total.labels(outcome="stale").inc(len(positions))
+                return results
+            texts = [query_texts[i] for i in positions]
+            vectors = await asyncio.to_thread(embedding_model.encode, texts, batch_size=64, show_progress_bar=False)
+            # Per query: the closest stored question, then the user's closest own chunk.
+            searches = []
+            for i, vector in zip(positions, vectors):
+                searches.extend((
+                    {"index": settings.ANSWER_INDEX_ALIAS}, _lookup_body(vector.tolist()),
+                    {"index": settings.ES_INDEX_NAME, "ignore_unavailable": True}, _tenant_match_body(queries[i][0], vector.tolist()),
+                ))
+            async with breakers["es_search"].guard():
+                response = await es_client.msearch(searches=searches, request_timeout=settings.ES_SEARCH_TIMEOUT_SECONDS)
+    except CircuitOpenError:
+        return results
+    except Exception as e:
+        es_errors_total.labels(operation="answer_lookup").inc()
+        answer_index_lookups_total.labels(outcome="error").inc(len(positions))
+        logger.warning("Answer index lookup failed; using the live pipeline: %s", e)
+        return results
+
+    items = list(response.get("responses", []))
+    tenant_matches = 0
+    for n, i in enumerate(positions):
+        answer_item, tenant_item = (items[2 * n:2 * n + 2] + [{}, {}])[:2]
+        hits = answer_item.get("hits", {}).get("hits", [])
+        if not hits:
+            continue
+        similarity = 2 * (hits[0].get("_score") or 0.0) - 1 # ES reports cosine as (1 + cosine) / 2
+        if similarity < settings.ANSWER_INDEX_MIN_SIMILARITY:
+            continue
+        # A failed tenant check counts as a match: the live pipeline is always safe.
+        if "error" in tenant_item or tenant_item.get("hits", {}).get("hits"):
+            tenant_matches += 1
+            continue
+        source = hits[0]["_source"]
+        results[i] = StoredAnswer(source["question"], source["answer"], source.get("sources") or [], round(similarity, 4))
+    served = sum(1 for result in results if result)
+    answer_index_lookups_total.labels(outcome="hit").inc(served)
+    answer_index_lookups_total.labels(outcome="tenant_docs").inc(tenant_matches)
+    answer_index_lookups_total.labels(outcome="miss").inc(len(positions) - served - tenant_matches)
+    return results
+
+
+async def lookup_answer(user_id: str, query_text: str) -> Optional[StoredAnswer]:
+    return (await lookup_answers([(user_id, query_text)]))[0]
+
+
+# Answers served by this process, by source (mirrors rag_answers_total).
+answered = Counter()
+
+
+def record_answer(source: str) -> None:
+    """Counts one answered query; source is "answer_index" or "llm"."""
+    answers_total.labels(source=source).inc()
+    answered[source] += 1
+
+
+# --- Build (app.cli.build_answer_index) ---
+
+def new_index_name() -> str:
+    """Concrete index name for a build, e.g. rag_answers-20240610-120301."""
+    return f"{settings.ANSWER_INDEX_ALIAS}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}"
+
+
+async def create_index(es_client, index: str, version: str) -> None:
+    """Creates an empty answer index recording the corpus version it is built from."""
+    await es_client.indices.create(
+        index=index,
+        mappings={**ANSWER_MAPPING, "_meta": {"corpus_version": version}},
+        settings={
+            "number_of_shards": 1,
+            "number_of_replicas": settings.PRELOADED_INDEX_REPLICAS, # Read by every query, like the corpus
+            "refresh_interval": "-1",
+        },
+    )
+    logger.info("Created answer index '%s' for corpus '%s'.", index, version)
+
+
+async def stored_questions(es_client, origin: str) -> List[str]:
+    """Questions of the given origin in the current answer index (e.g. imported ones, to carry over)."""
+    if not await es_client.indices.exists_alias(name=settings.ANSWER_INDEX_ALIAS):
+        return []
+    return [
+        hit["_source"]["question"]
+        async for hit in async_scan(
+            es_client, index=settings.ANSWER_INDEX_ALIAS, _source=["question"],
+            query={"query": {"term": {"origin": origin}}}
+        )
+    ]
+
+
+async def publish(es_client, index: str, keep_previous: bool = False) -> dict:
+    """Makes a filled answer index read-only and atomically points ANSWER_INDEX_ALIAS at it."""
+    alias = settings.ANSWER_INDEX_ALIAS
+    await es_client.indices.put_settings(index=index, settings={"index": {"refresh_interval": "-1", "blocks.write": True}})
+    await es_client.indices.refresh(index=index)
+    previous = [name for name in await preloaded_index.aliased_indices(es_client, alias) if name != index]
+    actions = [{"remove": {"index": name, "alias": alias}} for name in previous]
+    actions.append({"add": {"index": index, "alias": alias}})
+    await es_client.indices.update_aliases(actions=actions)
+    logger.info("Alias '%s' now points to '%s' (was: %s).", alias, index, previous or 'none')
+    if previous and not keep_previous:
+        await es_client.indices.delete(index=",".join(previous), ignore_unavailable=True)
+    _versions["checked_at"] = float("-inf")
+    return {"alias": alias, "index": index, "previous": previous}
+
+
+async def answer_index_report() -> dict:
+    if not enabled():
+        return {"enabled": False}
+    es_client = get_es_client()
+    corpus, answers = await asyncio.gather(corpus_version(es_client), answered_version(es_client))
+    stored = (await es_client.count(index=settings.ANSWER_INDEX_ALIAS))["count"] if answers else 0
+    total = sum(answered.values())
+    return {
+        "enabled": True,
+        "alias": settings.ANSWER_INDEX_ALIAS,
+        "corpus_version": corpus,
+        "answers_built_from": answers,
+        "current": answers is not None and answers == corpus,
+        "stored_answers": stored,
+        "min_similarity": settings.ANSWER_INDEX_MIN_SIMILARITY,
+        "tenant_min_similarity": settings.ANSWER_INDEX_TENANT_MIN_SIMILARITY,
+        "answered": dict(answered),
+        "answer_index_share": round(answered["answer_index"] / total, 4) if total else None,
+    }
@@ -0,0 +1,195 @@
+"""
+Circuit breakers around Elasticsearch and Gemini.
+
+Without them, an outage in either dependency turns every request into a slow
+hang (client retries, long timeouts) that holds request and worker slots.
+A breaker counts consecutive failures of one dependency call site:
+
+- closed: calls go through. After `failure_threshold` consecutive failures
+  it opens.
+- open: calls are rejected immediately with CircuitOpenError, so callers can
+  degrade (answer without retrieval, skip the rewrite) or fail fast with a
+  clear status. After `recovery_seconds` it becomes half-open.
+- half-open: up to `half_open_max_calls` probe calls go through. A probe
+  success closes the breaker; a probe failure opens it again.
+
+Only failures that indicate the dependency is unhealthy (see
+`is_es_outage` / `is_gemini_outage`) count; a bad request does not trip the
+breaker. State is per process (each API instance and Celery worker child
+learns about an outage on its own), and is exposed on
+/api/admin/breakers and as the rag_circuit_state gauge.
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+from app.core.config import settings
+from app.core.metrics import circuit_state, circuit_rejections_total
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open; retry in {retry_after:.0f}s.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_es_outage(exc: BaseException) -> bool:
+    """Connection errors, timeouts, 429 and 5xx responses count against Elasticsearch breakers."""
+    from elasticsearch import ApiError, TransportError
+    if isinstance(exc, (TransportError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if isinstance(exc, ApiError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def is_bulk_outage(failed: list, succeeded: int) -> bool:
+    """A bulk write that indexed nothing and whose items all failed with 429 or 5xx."""
+    if succeeded or not failed:
+        return False
+    statuses = [next(iter(item.values()), {}).get("status") for item in failed]
+    return all(isinstance(s, int) and (s == 429 or s >= 500) for s in statuses)
+
+
+def is_gemini_outage(exc: BaseException) -> bool:
+    """Timeouts, quota exhaustion and server-side errors count against Gemini breakers."""
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(exc, (google_exceptions.ServerError, google_exceptions.TooManyRequests,
+                            google_exceptions.DeadlineExceeded, google_exceptions.RetryError))
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, recovery_seconds: float,
+                 half_open_max_calls: int = 1, is_failure: Callable[[BaseException], bool] = lambda e: True):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_open_calls = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        circuit_state.labels(breaker=name).set(STATE_VALUES[CLOSED])
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("Circuit '%s': %s -> %s.", self.name, self.state, state)
+        self.state = state
+        circuit_state.labels(breaker=self.name).set(STATE_VALUES[state])
+
+    def retry_after(self) -> float:
+        if self.state != OPEN or self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.recovery_seconds - time.monotonic())
+
+    def available(self) -> bool:
+        """True if a call would currently be let through (without reserving a probe)."""
+        with self._lock:
+            if self.state == OPEN:
+                return self.retry_after() == 0
+            if self.state == HALF_OPEN:
+                return self.half_open_calls < self.half_open_max_calls
+            return True
+
+    def before_call(self) -> None:
+        """Admits a call or raises CircuitOpenError. Moves an expired open breaker to half-open."""
+        with self._lock:
+            if self.state == OPEN and self.retry_after() == 0:
+                self._set_state(HALF_OPEN)
+                self.half_open_calls = 0
+            if self.state == OPEN or (self.state == HALF_OPEN and self.half_open_calls >= self.half_open_max_calls):
+                self.rejected += 1
+                circuit_rejections_total.labels(breaker=self.name).inc()
+                raise CircuitOpenError(self.name, self.retry_after() or self.recovery_seconds)
+            if self.state == HALF_OPEN:
+                self.half_open_calls += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+                self.opened_at = None
+
+    def record_failure(self, exc: BaseException) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = f"{type(exc).__name__}: {exc}"[:300]
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    @asynccontextmanager
+    async def guard(self):
+        """Wraps one call: rejects it while open and records its outcome."""
+        self.before_call()
+        try:
+            yield
+        except CircuitOpenError:
+            raise
+        except BaseException as e:
+            if isinstance(e, Exception) and self.is_failure(e):
+                self.record_failure(e)
+            elif self.state == HALF_OPEN:
+                # A non-outage error (bad request, cancellation) still ends the probe.
+                with self._lock:
+                    self.half_open_calls = max(0, self.half_open_calls - 1)
+            raise
+        else:
+            self.record_success()
+
+    def report(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_seconds": self.recovery_seconds,
+            "retry_after_seconds": round(self.retry_after(), 1),
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+def _es_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name, settings.ES_BREAKER_FAILURE_THRESHOLD, settings.ES_BREAKER_RECOVERY_SECONDS,
+        settings.BREAKER_HALF_OPEN_MAX_CALLS, is_failure=is_es_outage,
+    )
+
+def _gemini_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name, settings.GEMINI_BREAKER_FAILURE_THRESHOLD, settings.GEMINI_BREAKER_RECOVERY_SECONDS,
+        settings.BREAKER_HALF_OPEN_MAX_CALLS, is_failure=is_gemini_outage,
+    )
+
+
+# One breaker per dependency call site.
+breakers: dict[str, CircuitBreaker] = {
+    "es_search": _es_breaker("es_search"),
+    "es_bulk": _es_breaker("es_bulk"),
+    "gemini_route": _gemini_breaker("gemini_route"),
+    "gemini_rewrite": _gemini_breaker("gemini_rewrite"),
+    "gemini_plan": _gemini_breaker("gemini_plan"),
+    "gemini_generate": _gemini_breaker("gemini_generate"),
+    "gemini_mine": _gemini_breaker("gemini_mine"), # Offline question mining (app.cli.build_answer_index)
+    "gemini_store_answer": _gemini_breaker("gemini_store_answer"), # Offline answers (app.cli.build_answer_index)
+}
+
+def breaker_report() -> dict:
+    return {name: breaker.report() for name, breaker in breakers.items()}
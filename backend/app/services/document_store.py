@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+from app.core.config import settings
+from app.core.metrics import es_errors_total
+
+logger = logging.getLogger(__name__)
+
+# --- Chunk Identity ---
+# Chunks get deterministic IDs `<doc_key>:<generation>:<n>`, where doc_key
+# identifies the (user_id, file_name) pair and generation identifies one
+# upload of it. A replace writes a new generation next to the old one and
+# then deletes the old chunk IDs, so no slow delete_by_query scan is needed.
+
+def document_key(user_id: str, file_name: str) -> str:
+    return hashlib.sha1(f"{user_id}\x00{file_name}".encode("utf-8")).hexdigest()[:20]
+
+def new_generation() -> str:
+    return uuid.uuid4().hex[:12]
+
+def chunk_id(doc_key: str, generation: str, chunk_number: int) -> str:
+    return f"{doc_key}:{generation}:{chunk_number}"
+
+
+async def fetch_chunk_ids(es_client: AsyncElasticsearch, user_id: str, file_name: str, exclude_generation: Optional[str] = None, index: Optional[str] = None) -> List[str]:
+    """Returns the IDs of a document's chunks (optionally excluding one generation), without fetching sources."""
+    query = {
+        "bool": {
+            "filter": [
+                {"term": {"user_id": user_id}},
+                {"term": {"file_name": file_name}},
+            ]
+        }
+    }
+    if exclude_generation:
+        query["bool"]["must_not"] = [{"term": {"generation": exclude_generation}}]
+
+    ids = []
+    async for hit in async_scan(
+        es_client,
+        index=index or settings.ES_INDEX_NAME,
+        query={"query": query, "_source": False},
+        size=1000,
+    ):
+        ids.append(hit["_id"])
+    return ids
+
+async def bulk_delete_ids(es_client: AsyncElasticsearch, ids: List[str], index: Optional[str] = None) -> int:
+    """Deletes chunks by ID in bulk. Returns the number deleted. Does not refresh."""
+    if not ids:
+        return 0
+    actions = ({"_op_type": "delete", "_index": index or settings.ES_INDEX_NAME, "_id": _id} for _id in ids)
+    deleted, failed = await async_bulk(es_client, actions, raise_on_error=False, raise_on_exception=False)
+    # A 404 just means the chunk was already gone.
+    real_failures = [f for f in failed if f.get("delete", {}).get("status") != 404]
+    if real_failures:
+        es_errors_total.labels(operation="bulk_delete").inc()
+        logger.error("Failed to delete %d chunks. Example error: %s", len(real_failures), real_failures[0])
+    return deleted
+
+async def delete_document(es_client: AsyncElasticsearch, user_id: str, file_name: str, index: Optional[str] = None) -> int:
+    """Removes every chunk of (user_id, file_name) and makes the removal visible."""
+    index = index or settings.ES_INDEX_NAME
+    ids = await fetch_chunk_ids(es_client, user_id, file_name, index=index)
+    deleted = await bulk_delete_ids(es_client, ids, index=index)
+    if deleted:
+        await es_client.indices.refresh(index=index)
+    logger.info("Deleted %d chunks of '%s' for user '%s'.", deleted, file_name, user_id)
+    return deleted
+
+
+# --- Refresh Control ---
+# Large bulk writes are much cheaper with periodic refresh turned off. Several
+# workers may write at once, so suspensions are reference-counted in Redis:
+# the first writer sets refresh_interval=-1 and the last one restores the
+# configured interval (never a value read back from the index, which could be
+# another writer's -1). The counter uses the asyncio Redis client; one is
+# opened per suspension, since Celery tasks each run in their own event loop.
+
+def _suspension_counter():
+    import redis.asyncio as redis
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+@asynccontextmanager
+async def suspended_refresh(es_client: AsyncElasticsearch, index: Optional[str] = None, enabled: bool = True):
+    """Disables periodic refresh on the index for the duration of a large write."""
+    index = index or settings.ES_INDEX_NAME
+    if not enabled:
+        yield
+        return
+
+    key = f"rag:refresh_suspended:{index}"
+    counter = None
+    try:
+        counter = _suspension_counter()
+        if await counter.incr(key) == 1:
+            await es_client.indices.put_settings(index=index, settings={"index": {"refresh_interval": "-1"}})
+            logger.info("Suspended periodic refresh on '%s' for bulk write.", index)
+        # Self-heal if a worker dies mid-write: the counter expires.
+        await counter.expire(key, settings.REFRESH_SUSPEND_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("Could not suspend refresh on '%s': %s. Writing with normal refresh.", index, e)
+        if counter is not None:
+            await counter.aclose()
+        counter = None
+
+    try:
+        yield
+    finally:
+        if counter is not None:
+            try:
+                if await counter.decr(key) <= 0:
+                    await counter.delete(key)
+                    await es_client.indices.put_settings(
+                        index=index, settings={"index": {"refresh_interval": settings.ES_REFRESH_INTERVAL}}
+                    )
+                    logger.info("Restored refresh_interval=%s on '%s'.", settings.ES_REFRESH_INTERVAL, index)
+            except Exception as e:
+                logger.error("Failed to restore refresh interval on '%s': %s", index, e, exc_info=True)
+            finally:
+                await counter.aclose()
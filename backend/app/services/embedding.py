@@ -0,0 +1,126 @@
+"""
+Length-aware embedding for ingestion.
+
+`SentenceTransformer.encode` pads every forward pass to its longest input and
+silently truncates anything beyond the model's `max_seq_length`. This module
+measures chunks in model tokens, re-splits chunks that would be truncated,
+and encodes length-sorted buckets so each batch is padded to a similar
+length. Output vectors are returned in the original chunk order.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import List
+import numpy as np
+from app.core.config import settings
+from app.core.metrics import embedding_chunks_total
+from app.services.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Room for the [CLS]/[SEP] special tokens the model adds to every input.
+SPECIAL_TOKENS_MARGIN = 2
+
+def get_chunk_tokenizer():
+    """
+    Returns the embedding model's tokenizer without loading the model weights,
+    so chunking can run in processes that never embed (e.g. parse pools).
+    """
+    return model_registry.tokenizer(settings.EMBEDDING_MODEL_NAME)
+
+
+@dataclass
+class EmbeddingResult:
+    chunks: List[str] # May contain more entries than the input if chunks were re-split
+    vectors: np.ndarray # (len(chunks), dim), in `chunks` order
+    input_chunks: int
+    overflowing_chunks: int # Input chunks longer than max_seq_length (would have been truncated)
+    seconds: float
+
+    @property
+    def truncation_rate(self) -> float:
+        return self.overflowing_chunks / self.input_chunks if self.input_chunks else 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return len(self.chunks) / self.seconds if self.seconds else 0.0
+
+
+def token_lengths(tokenizer, texts: List[str]) -> np.ndarray:
+    """Token counts (including special tokens) for each text, without truncation."""
+    if not texts:
+        return np.zeros(0, dtype=np.int64)
+    encoded = tokenizer(
+        texts, add_special_tokens=True, truncation=False,
+        return_attention_mask=False, return_token_type_ids=False, verbose=False
+    )
+    return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+
+def split_by_tokens(tokenizer, text: str, max_tokens: int, overlap: int = 0) -> List[str]:
+    """Splits text into windows of at most `max_tokens` tokens, cutting on token offsets."""
+    offsets = tokenizer(
+        text, add_special_tokens=False, truncation=False,
+        return_offsets_mapping=True, verbose=False
+    )["offset_mapping"]
+    if len(offsets) <= max_tokens:
+        return [text]
+    step = max(1, max_tokens - overlap)
+    pieces = []
+    for start in range(0, len(offsets), step):
+        end = min(start + max_tokens, len(offsets))
+        pieces.append(text[offsets[start][0]:offsets[end - 1][1]])
+        if end == len(offsets):
+            break
+    return pieces
+
+def encode_length_sorted(model, texts: List[str], lengths: np.ndarray | None = None, batch_size: int = 64) -> np.ndarray:
+    """
+    Encodes texts in length-sorted buckets so each forward pass pads to a
+    similar length. Returns vectors in the original `texts` order.
+    """
+    if lengths is None:
+        lengths = token_lengths(model.tokenizer, texts)
+    order = np.argsort(lengths, kind="stable")
+    vectors = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    for bucket_start in range(0, len(order), batch_size):
+        bucket = order[bucket_start:bucket_start + batch_size]
+        vectors[bucket] = model.encode(
+            [texts[i] for i in bucket], batch_size=len(bucket),
+            show_progress_bar=False, convert_to_numpy=True
+        )
+    return vectors
+
+def embed_chunks(model, chunks: List[str], batch_size: int = 64) -> EmbeddingResult:
+    """
+    Embeds chunks with length bucketing. Chunks that exceed the model's
+    `max_seq_length` are re-split (and reported) instead of being truncated.
+    """
+    start = time.perf_counter()
+    input_count = len(chunks)
+    tokenizer = model.tokenizer
+    max_tokens = model.max_seq_length
+    lengths = token_lengths(tokenizer, chunks)
+
+    overflowing = int((lengths > max_tokens).sum())
+    if overflowing:
+        logger.warning(f"{overflowing}/{len(chunks)} chunks exceed max_seq_length={max_tokens}; re-splitting them.")
+        resplit = []
+        for chunk, length in zip(chunks, lengths):
+            if length > max_tokens:
+                resplit.extend(split_by_tokens(tokenizer, chunk, max_tokens - SPECIAL_TOKENS_MARGIN))
+            else:
+                resplit.append(chunk)
+        chunks = resplit
+        lengths = token_lengths(tokenizer, chunks)
+
+    vectors = encode_length_sorted(model, chunks, lengths, batch_size)
+    embedding_chunks_total.labels(outcome="embedded").inc(len(chunks))
+    if overflowing:
+        embedding_chunks_total.labels(outcome="resplit").inc(overflowing)
+    return EmbeddingResult(
+        chunks=chunks,
+        vectors=vectors,
+        input_chunks=input_count,
+        overflowing_chunks=overflowing,
+        seconds=time.perf_counter() - start,
+    )
@@ -16,16 +16,16 @@ def get_es_client() -> AsyncElasticsearch:
                 es_client = AsyncElasticsearch(
                     cloud_id=settings.ELASTIC_CLOUD_ID,
                     api_key=settings.ELASTIC_API_KEY,
-                    request_timeout=30,
-                    max_retries=5,
+                    request_timeout=settings.ES_REQUEST_TIMEOUT_SECONDS,
+                    max_retries=settings.ES_MAX_RETRIES,
                     retry_on_timeout=True
                 )
                 logger.info("Elasticsearch client initialized using Cloud ID.")
             elif settings.ELASTICSEARCH_URL:
                 es_client = AsyncElasticsearch(
                     hosts=[settings.ELASTICSEARCH_URL],
-                    request_timeout=30,
-                    max_retries=5,
+                    request_timeout=settings.ES_REQUEST_TIMEOUT_SECONDS,
+                    max_retries=settings.ES_MAX_RETRIES,
                     retry_on_timeout=True
                 )
                 logger.info("Elasticsearch client initialized using URL.")
@@ -36,6 +36,13 @@ def get_es_client() -> AsyncElasticsearch:
             raise
     return es_client
 
+async def ping_es_client() -> bool:
+    """Initializes the client if needed and checks that the cluster is reachable."""
+    es = get_es_client()
+    if not await es.ping():
+        raise ConnectionError("Elasticsearch ping failed.")
+    return True
+
 async def close_es_client():
     """Closes the Elasticsearch client connection."""
     global es_client
@@ -43,9 +50,3 @@ async def close_es_client():
         await es_client.close()
         es_client = None
         logger.info("Elasticsearch client connection closed.")
-
-# Initialize the client on module import
-try:
-    es_client = get_es_client()
-except ValueError as e:
-    logger.critical(f"Elasticsearch configuration error: {e}")
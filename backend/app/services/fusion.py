@@ -0,0 +1,101 @@
+"""
+Client-side fusion of BM25 and kNN result lists.
+
+Used when HYBRID_FUSION is "rrf" or "linear": the two retrievers run as
+separate sub-queries of one `_msearch` and their hits are fused here instead
+of by the (licensed) ES `rank.rrf` feature. Unlike server-side RRF, the
+per-retriever weights actually apply.
+
+Both methods are vectorized with numpy: hit ids are mapped to dense indices
+in one pass, per-hit contributions are summed with `np.bincount`,
+and the top k is taken with `argpartition`. Fusing two 50-hit lists costs a
+few tens of microseconds (see benchmarks/bench_fusion.py).
+
+Weights are rescaled to average 1, so weighted RRF scores stay on the same
+scale as server-side RRF (two top-ranked lists give 2/(rank_constant+1))
+and linear scores fall in [0, number of lists].
+"""
+import heapq
+import itertools
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+import numpy as np
+
+# One retriever's hits, best first: (ids, scores).
+RankedList = Tuple[Sequence[str], Sequence[float]]
+
+
+# Below this many distinct hits a full sort is cheaper than argpartition + sort.
+PARTITION_MIN_HITS = 256
+
+
+def _normalized_weights(weights: Sequence[float]) -> List[float]:
+    total = float(sum(weights))
+    if total <= 0:
+        raise ValueError("Fusion weights must sum to a positive value.")
+    return [float(w) * len(weights) / total for w in weights]
+
+
+@lru_cache(maxsize=64)
+def _reciprocal_ranks(length: int, rank_constant: int) -> np.ndarray:
+    ranks = 1.0 / (rank_constant + np.arange(1, length + 1, dtype=np.float64))
+    ranks.setflags(write=False)
+    return ranks
+
+
+def _accumulate(lists: Sequence[RankedList], contributions: List[np.ndarray], top_k: int) -> List[Tuple[str, float]]:
+    # Dense index per distinct id, in first-seen order (a dict beats np.unique on strings).
+    positions: dict = {}
+    inverse = [positions.setdefault(hit_id, len(positions)) for hit_ids, _ in lists for hit_id in hit_ids]
+    if not positions:
+        return []
+    unique_ids = list(positions)
+    fused = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(unique_ids))
+    k = min(top_k, fused.size)
+    if fused.size < PARTITION_MIN_HITS:
+        top = np.argsort(-fused, kind="stable")[:k]
+    else:
+        top = np.argpartition(-fused, k - 1)[:k]
+        top = top[np.argsort(-fused[top], kind="stable")]
+    return [(unique_ids[i], float(fused[i])) for i in top.tolist()]
+
+
+def fuse_rrf(lists: Sequence[RankedList], weights: Sequence[float], top_k: int,
+             rank_constant: int = 60) -> List[Tuple[str, float]]:
+    """Weighted reciprocal rank fusion: score(d) = sum_i w_i / (rank_constant + rank_i(d))."""
+    w = _normalized_weights(weights)
+    contributions = [w[i] * _reciprocal_ranks(len(hit_ids), rank_constant) for i, (hit_ids, _) in enumerate(lists)]
+    return _accumulate(lists, contributions, top_k)
+
+
+def fuse_linear(lists: Sequence[RankedList], weights: Sequence[float], top_k: int) -> List[Tuple[str, float]]:
+    """Weighted sum of min-max normalized scores (a list's only hit scores 1)."""
+    w = _normalized_weights(weights)
+    contributions = []
+    for i, (_, scores) in enumerate(lists):
+        s = np.asarray(scores, dtype=np.float64)
+        if s.size:
+            low = s.min()
+            spread = s.max() - low
+            s = (s - low) / spread if spread > 0 else np.ones_like(s)
+        contributions.append(w[i] * s)
+    return _accumulate(lists, contributions, top_k)
+
+
+def merge_by_score(lists: Sequence[List[Tuple[str, float]]], top_k: int) -> List[Tuple[str, float]]:
+    """
+    Merges already-fused result lists whose scores share a scale (the same
+    fusion run over different indices), keeping the top k by score. When the
+    lists' hits are disjoint, this equals fusing all of their input lists at
+    once (see search_service.combine_query_responses).
+    """
+    return heapq.nlargest(top_k, itertools.chain.from_iterable(lists), key=lambda item: item[1])
+
+
+def fuse(method: str, lists: Sequence[RankedList], weights: Sequence[float], top_k: int,
+         rank_constant: int = 60) -> List[Tuple[str, float]]:
+    if method == "rrf":
+        return fuse_rrf(lists, weights, top_k, rank_constant)
+    if method == "linear":
+        return fuse_linear(lists, weights, top_k)
+    raise ValueError(f"Unknown fusion method '{method}'.")
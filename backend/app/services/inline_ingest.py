@@ -0,0 +1,108 @@
+"""
+Inline fast path for small plain-text and markdown uploads.
+
+Small .txt/.md files are chunked, embedded and indexed directly in the API
+process instead of going through disk, Redis and a Celery worker, so they are
+searchable within milliseconds. CPU work (tokenizing, encoding) runs on a
+bounded thread pool with the search embedding model the API already has
+loaded. When every inline slot is busy, the upload falls back to Celery
+instead of queueing here. So does an upload whose bulk write fails in any
+way (failed chunks, an outage, a timeout after ES wrote some chunks): its
+chunk IDs are deleted first, so a 201 always means the whole file is indexed
+and the queued retry does not index it twice.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from elasticsearch.helpers import async_bulk
+from app.core.config import settings
+from app.core.metrics import time_ingestion_stage, ingested_chunks_total, es_errors_total
+from app.services.es_client import get_es_client
+from app.services.document_store import new_generation, bulk_delete_ids
+from app.services.embedding import embed_chunks
+from app.services.model_registry import get_embedding_model
+from app.services.circuit_breaker import breakers, is_bulk_outage
+from app.tasks.processing import split_into_chunks, create_index_if_not_exists, build_chunk_actions
+
+logger = logging.getLogger(__name__)
+
+INLINE_CONTENT_TYPES = {"text/plain", "text/markdown"}
+
+inline_executor = ThreadPoolExecutor(max_workers=settings.INLINE_INGEST_WORKERS, thread_name_prefix="inline-ingest")
+_inline_slots = asyncio.Semaphore(settings.INLINE_INGEST_WORKERS)
+_index_ready = False
+
+
+def is_inline_eligible(content_type: str, size_bytes: int) -> bool:
+    return content_type in INLINE_CONTENT_TYPES and 0 < size_bytes <= settings.INLINE_INGEST_MAX_BYTES
+
+
+def _chunk_and_embed(text: str) -> tuple[list[str], list]:
+    with time_ingestion_stage("chunk"):
+        chunks = split_into_chunks(text)
+    if not chunks:
+        return [], []
+    with time_ingestion_stage("embed"):
+        embedded = embed_chunks(get_embedding_model(), chunks)
+    return embedded.chunks, embedded.vectors.tolist()
+
+
+async def ingest_inline(user_id: str, file_name: str, content: bytes, refresh: str = "false") -> Optional[int]:
+    """
+    Indexes a small text upload in-process. Returns the number of chunks
+    indexed, or None if the upload should go to Celery instead (inline slots
+    busy, model not loaded, bulk circuit open, or content not valid UTF-8).
+    Raises if the write failed, after removing any chunks it wrote.
+    refresh=wait_for is sent as an explicit refresh ("true"): wait_for never
+    returns while periodic refresh is suspended (see suspended_refresh).
+    """
+    global _index_ready
+    if _inline_slots.locked() or not breakers["es_bulk"].available() or get_embedding_model() is None:
+        return None
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+    async with _inline_slots:
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        chunks, embeddings = await loop.run_in_executor(inline_executor, _chunk_and_embed, text)
+        if not chunks:
+            return 0
+
+        if not _index_ready:
+            await create_index_if_not_exists()
+            _index_ready = True
+
+        actions = build_chunk_actions(user_id, file_name, new_generation(), chunks, embeddings)
+        # Errors (including an open circuit) make the upload fall back to Celery.
+        try:
+            with time_ingestion_stage("bulk_index"):
+                async with breakers["es_bulk"].guard():
+                    success, failed = await async_bulk(
+                        get_es_client(), actions, refresh="true" if refresh == "wait_for" else refresh,
+                        raise_on_error=False, raise_on_exception=False
+                    )
+                    if is_bulk_outage(failed, success):
+                        raise ConnectionError(f"Elasticsearch rejected all {len(failed)} chunks: {failed[0]}")
+            if failed:
+                ingested_chunks_total.labels(outcome="failed").inc(len(failed))
+                es_errors_total.labels(operation="bulk").inc()
+                raise RuntimeError(f"Inline ingest of '{file_name}': {len(failed)} of {len(actions)} chunks failed. "
+                                   f"Example error: {failed[0]}")
+        except Exception:
+            # Never report a partial upload as indexed, and never leave chunks
+            # behind for the queued retry to duplicate: ES may have written
+            # some even if the call failed.
+            try:
+                await bulk_delete_ids(get_es_client(), [a["_id"] for a in actions])
+            except Exception as e:
+                logger.error("Could not remove inline chunks of '%s' for user '%s': %s", file_name, user_id, e)
+            raise
+        ingested_chunks_total.labels(outcome="indexed").inc(success)
+        logger.info("Inline-indexed '%s' for user '%s': %d chunks in %.1f ms (refresh=%s).",
+                    file_name, user_id, success, (time.perf_counter() - start) * 1000, refresh)
+        return success
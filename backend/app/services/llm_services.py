@@ -1,53 +1,208 @@
 import google.generativeai as genai
 from app.core.config import settings
+from app.core.metrics import record_llm_usage, gemini_blocked_total, query_plans_total
+from app.services.prompt_cache import prompt_cache, CachedPrompt
+from app.services.circuit_breaker import breakers, CircuitOpenError
+from pydantic import BaseModel, Field, ValidationError, field_validator
+import asyncio
+import json
 import logging
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 logger = logging.getLogger(__name__)
 
 # --- Gemini Client Initialization ---
-try:
-    if "MISSING" not in settings.GEMINI_API_KEY:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        logger.info("Google Generative AI client configured.")
-    else:
-        logger.critical("GEMINI_API_KEY is missing. LLM services will not function.")
-except Exception as e:
-    logger.error(f"Error configuring Google Generative AI client: {e}", exc_info=True)
+# Configured by the startup warm-up, after secrets have been loaded.
+gemini_configured = False
+
+def configure_gemini() -> bool:
+    """Configures the Gemini client with the current API key. Returns True on success."""
+    global gemini_configured
+    if gemini_configured:
+        return True
+    try:
+        if "MISSING" not in settings.GEMINI_API_KEY:
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+            gemini_configured = True
+            logger.info("Google Generative AI client configured.")
+        else:
+            logger.critical("GEMINI_API_KEY is missing. LLM services will not function.")
+    except Exception as e:
+        logger.error("Error configuring Google Generative AI client: %s", e, exc_info=True)
+    return gemini_configured
+
+def _response_has_content(call_site: str, response, prompt: Optional[CachedPrompt] = None) -> bool:
+    """Records token usage and returns False if the response was blocked or empty."""
+    record_llm_usage(call_site, response, static_tokens=prompt.static_tokens if prompt else 0)
+    if not response.parts:
+        gemini_blocked_total.labels(call_site=call_site).inc()
+        block_reason = getattr(getattr(response, 'prompt_feedback', None), 'block_reason', 'Unknown')
+        logger.warning("Gemini returned no content for '%s' (block reason: %s).", call_site, block_reason)
+        return False
+    return True
+
+# --- Static Prompts ---
+# Instructions and examples are sent once as each model's system_instruction
+# (see prompt_cache); requests only carry the dynamic part.
+
+ROUTER_SYSTEM_INSTRUCTION = """
+You are a query router. Your task is to classify the user's query into one of two categories:
+1.  'chit_chat': For conversational greetings, simple questions, or off-topic remarks.
+2.  'query_documents': For questions that require information from a knowledge base or specific documents.
+
+Analyze the user query and return ONLY the category name ('chit_chat' or 'query_documents').
+
+Examples:
+-   Query: "hello there" -> chit_chat
+-   Query: "how are you?" -> chit_chat
+-   Query: "what is the refund policy?" -> query_documents
+-   Query: "summarize the privacy agreement" -> query_documents
+-   Query: "what's the weather like?" -> chit_chat
+"""
+
+REWRITER_SYSTEM_INSTRUCTION = """
+You are a search query optimization expert. Your task is to rewrite the user's query to be more effective for a vector and keyword-based search engine.
+Focus on extracting key terms, removing conversational fluff, and structuring it as a concise, keyword-rich query.
+
+-   Do not answer the question.
+-   Do not add any preamble like "Here is the rewritten query:".
+-   Return only the optimized query text.
+
+Examples:
+-   Original: "Hey, can you tell me what the policy is for getting my money back?"
+-   Rewritten: "refund policy details money back"
+-   Original: "I need to know everything about data privacy."
+-   Rewritten: "data privacy policy summary"
+"""
+
+PLANNER_SYSTEM_INSTRUCTION = """
+You are a query planner for a document question-answering system. For the user's query, return one JSON object with these fields:
+-   "intent": "chit_chat" for conversational greetings, simple questions or off-topic remarks; "query_documents" for questions that require information from a knowledge base or specific documents.
+-   "search_query": for query_documents, the query rewritten for a vector and keyword-based search engine: key terms only, no conversational fluff, do not answer the question. For chit_chat, null.
+-   "file_name": if the user names a specific document file, that file name exactly as written in the query; otherwise null.
+
+Return only the JSON object.
+
+Examples:
+-   Query: "hello there" -> {"intent": "chit_chat", "search_query": null, "file_name": null}
+-   Query: "what's the weather like?" -> {"intent": "chit_chat", "search_query": null, "file_name": null}
+-   Query: "Hey, can you tell me what the policy is for getting my money back?" -> {"intent": "query_documents", "search_query": "refund policy details money back", "file_name": null}
+-   Query: "summarize the termination clause in contract_acme.docx" -> {"intent": "query_documents", "search_query": "termination clause summary", "file_name": "contract_acme.docx"}
+"""
+
+# Constrains the planner's JSON output (Gemini response_schema, OpenAPI subset).
+PLAN_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["chit_chat", "query_documents"]},
+        "search_query": {"type": "string", "nullable": True},
+        "file_name": {"type": "string", "nullable": True},
+    },
+    "required": ["intent"],
+}
+
+ANSWER_SYSTEM_INSTRUCTION = """
+You are a helpful AI assistant. Your task is to answer the user's question based *only* on the provided context.
+-   If the context contains the answer, synthesize it into a clear and concise response.
+-   If the context does not contain the answer, state that you could not find the information in the provided documents.
+-   Do not use any external knowledge or make up information.
+-   Cite the source of your information if possible (though not required for this implementation).
+"""
+
+NO_CONTEXT_SYSTEM_INSTRUCTION = """
+You are a helpful AI assistant. The user asked a question, but you could not find any relevant information in the provided documents.
+Politely inform the user that you couldn't find an answer in their documents and suggest they rephrase the question or upload more documents.
+Do not make up an answer.
+"""
+
+NO_RETRIEVAL_SYSTEM_INSTRUCTION = """
+You are a helpful AI assistant. The user's documents cannot be searched right now because the document search service is temporarily unavailable.
+-   If the message is a greeting or small talk, respond naturally.
+-   Otherwise, tell the user that document search is temporarily unavailable and ask them to try again in a few moments.
+-   Do not answer questions about their documents or make up information.
+"""
+
+# Offline only (app.cli.build_answer_index), so not warmed with STATIC_PROMPTS.
+QUESTION_MINING_SYSTEM_INSTRUCTION = """
+You write the questions users are likely to ask about a knowledge base. Given one passage, return a JSON array of up to the requested number of distinct questions that the passage answers.
+-   Phrase each question the way a user would type it into a chat box.
+-   Each question must be self-contained and answerable from the passage alone; never refer to "the passage" or "the text".
+-   Return only the JSON array of question strings.
+"""
+
+MINED_QUESTIONS_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+# Offline only: answers stored in the answer index must say explicitly whether the context had one.
+STORED_ANSWER_SYSTEM_INSTRUCTION = """
+You answer a user's question for a knowledge base, based *only* on the provided context.
+-   If the context answers the question, set "found" to true and put a clear and concise answer in "answer".
+-   If the context does not contain the answer, or only part of it, set "found" to false and leave "answer" empty. Never write an answer saying the information could not be found.
+-   Do not use any external knowledge or make up information.
+"""
+
+STORED_ANSWER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "found": {"type": "boolean"},
+        "answer": {"type": "string", "nullable": True},
+    },
+    "required": ["found"],
+}
+
+# Answers returned instead of raising when generation fails.
+ANSWER_BLOCKED_MESSAGE = "I cannot provide an answer to that request."
+ANSWER_ERROR_MESSAGE = "I'm sorry, but I encountered an error while trying to generate a response. Please try again."
+
+STATIC_PROMPTS = {
+    "route": ROUTER_SYSTEM_INSTRUCTION,
+    "rewrite": REWRITER_SYSTEM_INSTRUCTION,
+    "plan": PLANNER_SYSTEM_INSTRUCTION,
+    "generate": ANSWER_SYSTEM_INSTRUCTION,
+    "generate_no_context": NO_CONTEXT_SYSTEM_INSTRUCTION,
+    "generate_no_retrieval": NO_RETRIEVAL_SYSTEM_INSTRUCTION,
+}
+
+async def _get_prompt(name: str, system_instruction: str) -> CachedPrompt:
+    configure_gemini()
+    return await prompt_cache.get(name, system_instruction)
+
+async def warm_prompts() -> None:
+    """Builds the long-lived prompt models (and provider caches) ahead of the first request."""
+    await asyncio.gather(*(_get_prompt(name, text) for name, text in STATIC_PROMPTS.items()))
+
+async def _generate(call_site: str, prompt: CachedPrompt, contents: str, generation_config: Optional[dict] = None):
+    """
+    Calls Gemini through the call site's circuit breaker with a bounded timeout.
+    Raises CircuitOpenError without calling Gemini while the breaker is open.
+    """
+    async with breakers[f"gemini_{call_site}"].guard():
+        return await asyncio.wait_for(
+            prompt.model.generate_content_async(contents, generation_config=generation_config),
+            timeout=settings.GEMINI_TIMEOUT_SECONDS
+        )
+
 
 async def route_query(query: str) -> str:
     """
     Uses the LLM to classify the user's query.
     Returns 'chit_chat' or 'query_documents'.
     """
-    logger.debug(f"Routing query: '{query[:50]}...'")
+    logger.debug("Routing query: '%.50s...'", query)
     try:
-        model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME)
-        prompt = f"""
-        You are a query router. Your task is to classify the user's query into one of two categories:
-        1.  'chit_chat': For conversational greetings, simple questions, or off-topic remarks.
-        2.  'query_documents': For questions that require information from a knowledge base or specific documents.
-
-        Analyze the following user query and return ONLY the category name ('chit_chat' or 'query_documents').
-
-        Examples:
-        -   Query: "hello there" -> chit_chat
-        -   Query: "how are you?" -> chit_chat
-        -   Query: "what is the refund policy?" -> query_documents
-        -   Query: "summarize the privacy agreement" -> query_documents
-        -   Query: "what's the weather like?" -> chit_chat
-
-        User Query: "{query}"
-        Category:
-        """
-        response = await model.generate_content_async(prompt)
+        prompt = await _get_prompt("route", ROUTER_SYSTEM_INSTRUCTION)
+        response = await _generate("route", prompt, f'User Query: "{query}"\nCategory:')
+        if not _response_has_content("route", response, prompt):
+            return 'query_documents'
         intent = response.text.strip().lower()
         if intent not in ['chit_chat', 'query_documents']:
-            logger.warning(f"Router returned unexpected intent '{intent}'. Defaulting to 'query_documents'.")
+            logger.warning("Router returned unexpected intent '%s'. Defaulting to 'query_documents'.", intent)
             return 'query_documents'
         return intent
+    except CircuitOpenError as e:
+        logger.warning("Skipping routing: %s", e)
+        return 'query_documents'
     except Exception as e:
-        logger.error(f"Error in route_query: {e}", exc_info=True)
+        logger.error("Error in route_query: %s", e, exc_info=True)
         # Default to the safer option of searching documents if routing fails.
         return 'query_documents'
 
@@ -56,34 +211,146 @@ async def rewrite_query_for_search(query: str) -> str:
     """
     Uses the LLM to rewrite the user's query for better search results.
     """
-    logger.debug(f"Rewriting query: '{query[:50]}...'")
+    logger.debug("Rewriting query: '%.50s...'", query)
     try:
-        model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME)
-        prompt = f"""
-        You are a search query optimization expert. Your task is to rewrite the user's query to be more effective for a vector and keyword-based search engine.
-        Focus on extracting key terms, removing conversational fluff, and structuring it as a concise, keyword-rich query.
-
-        -   Do not answer the question.
-        -   Do not add any preamble like "Here is the rewritten query:".
-        -   Return only the optimized query text.
-
-        Examples:
-        -   Original: "Hey, can you tell me what the policy is for getting my money back?"
-        -   Rewritten: "refund policy details money back"
-        -   Original: "I need to know everything about data privacy."
-        -   Rewritten: "data privacy policy summary"
-
-        Original Query: "{query}"
-        Rewritten Query:
-        """
-        response = await model.generate_content_async(prompt)
+        prompt = await _get_prompt("rewrite", REWRITER_SYSTEM_INSTRUCTION)
+        response = await _generate("rewrite", prompt, f'Original Query: "{query}"\nRewritten Query:')
+        if not _response_has_content("rewrite", response, prompt):
+            return query
         return response.text.strip()
+    except CircuitOpenError as e:
+        logger.warning("Skipping query rewrite: %s", e)
+        return query
     except Exception as e:
-        logger.error(f"Error in rewrite_query_for_search: {e}", exc_info=True)
+        logger.error("Error in rewrite_query_for_search: %s", e, exc_info=True)
         # If rewriting fails, use the original query as a fallback.
         return query
 
 
+class QueryPlan(BaseModel):
+    """Intent, search query and optional file filter for one user query."""
+    intent: Literal["chit_chat", "query_documents"]
+    search_query: Optional[str] = None
+    file_name: Optional[str] = None
+    source: Literal["planner", "two_call"] = Field("planner", exclude=True) # Set by plan_query, not the model
+
+    @field_validator("search_query", "file_name")
+    @classmethod
+    def _blank_to_none(cls, value: Optional[str]) -> Optional[str]:
+        value = value.strip() if value else None
+        return value or None
+
+
+async def _plan_with_single_call(query: str) -> Optional[QueryPlan]:
+    """One structured Gemini call for intent, rewrite and filters. None if the call or its JSON is unusable."""
+    try:
+        prompt = await _get_prompt("plan", PLANNER_SYSTEM_INSTRUCTION)
+        response = await _generate("plan", prompt, f'User Query: "{query}"', generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": PLAN_RESPONSE_SCHEMA,
+        })
+        if not _response_has_content("plan", response, prompt):
+            query_plans_total.labels(outcome="fallback_blocked").inc()
+            return None
+        plan = QueryPlan.model_validate_json(response.text)
+    except CircuitOpenError as e:
+        logger.warning("Skipping the query planner: %s", e)
+        query_plans_total.labels(outcome="fallback_circuit_open").inc()
+        return None
+    except (ValidationError, ValueError) as e:
+        logger.warning("Query planner returned an invalid plan (%s). Falling back to route + rewrite.", e)
+        query_plans_total.labels(outcome="fallback_invalid").inc()
+        return None
+    except Exception as e:
+        logger.error("Error in the query planner: %s", e, exc_info=True)
+        query_plans_total.labels(outcome="fallback_error").inc()
+        return None
+
+    if plan.intent == "chit_chat":
+        plan.search_query = plan.file_name = None
+    else:
+        plan.search_query = plan.search_query or query
+        if plan.file_name and plan.file_name.lower() not in query.lower():
+            # Only filter on a file name the user actually wrote; a guessed one would hide every hit.
+            logger.debug("Dropping planner file filter '%s' not present in the query.", plan.file_name)
+            plan.file_name = None
+    query_plans_total.labels(outcome="planned").inc()
+    return plan
+
+
+async def plan_query(query: str, rewrite: bool = True) -> QueryPlan:
+    """
+    Plans a query. With QUERY_PLANNER=single, one structured JSON call returns
+    the intent, the rewritten search query and an optional file filter; if it
+    fails or does not validate, this falls back to `route_query` plus
+    `rewrite_query_for_search` (the default two-call path). With
+    `rewrite=False` the fallback searches the original query.
+    """
+    if settings.QUERY_PLANNER == "single":
+        plan = await _plan_with_single_call(query)
+        if plan is not None:
+            return plan
+    intent = await route_query(query)
+    if intent == "chit_chat":
+        return QueryPlan(intent=intent, source="two_call")
+    search_query = await rewrite_query_for_search(query) if rewrite else query
+    return QueryPlan(intent=intent, search_query=search_query or query, source="two_call")
+
+
+async def mine_questions(passage: str, count: int) -> List[str]:
+    """
+    Asks for up to `count` questions that a passage answers (offline answer index).
+    Returns an empty list if the response is blocked or unusable; raises
+    CircuitOpenError while the mining circuit is open.
+    """
+    try:
+        prompt = await _get_prompt("mine", QUESTION_MINING_SYSTEM_INSTRUCTION)
+        response = await _generate(
+            "mine", prompt, f"Number of questions: {count}\n--- PASSAGE ---\n{passage}\n--- END PASSAGE ---",
+            generation_config={"response_mime_type": "application/json", "response_schema": MINED_QUESTIONS_SCHEMA}
+        )
+        if not _response_has_content("mine", response, prompt):
+            return []
+        questions = json.loads(response.text)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.warning("Question mining failed for a passage: %s", e)
+        return []
+    if not isinstance(questions, list):
+        return []
+    return [q.strip() for q in questions if isinstance(q, str) and q.strip()][:count]
+
+
+async def generate_stored_answer(question: str, context: List[str]) -> Optional[str]:
+    """
+    Answers a question from context for the offline answer index. Returns None
+    when the context does not answer it, or when the response is blocked or
+    unusable, so no "could not find" reply is ever stored. Raises
+    CircuitOpenError while the circuit is open.
+    """
+    try:
+        prompt = await _get_prompt("store_answer", STORED_ANSWER_SYSTEM_INSTRUCTION)
+        response = await _generate(
+            "store_answer", prompt,
+            f"--- CONTEXT ---\n{truncate_context(context, settings.MAX_CONTEXT_TOKENS)}\n--- END CONTEXT ---\n\n"
+            f"User's Question: \"{question}\"",
+            generation_config={"response_mime_type": "application/json", "response_schema": STORED_ANSWER_SCHEMA}
+        )
+        if not _response_has_content("store_answer", response, prompt):
+            return None
+        result = json.loads(response.text)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.warning("Stored answer generation failed for a question: %s", e)
+        return None
+    if not isinstance(result, dict) or result.get("found") is not True:
+        return None
+    answer = result.get("answer")
+    return answer.strip() if isinstance(answer, str) and answer.strip() else None
+
+
 def truncate_context(context_chunks: List[str], max_tokens: int) -> str:
     """
     Truncates a list of context strings to fit within a maximum token limit.
@@ -102,54 +369,46 @@ def truncate_context(context_chunks: List[str], max_tokens: int) -> str:
         total_chars += len(chunk)
 
     if len(truncated_context) < len(context_chunks):
-        logger.warning(f"Context truncated from {len(context_chunks)} chunks to {len(truncated_context)} to fit token limit.")
+        logger.warning("Context truncated from %d chunks to %d to fit token limit.", len(context_chunks), len(truncated_context))
 
     return "\n---\n".join(truncated_context)
 
 
-async def generate_final_answer(original_query: str, elastic_context: List[str], session_context: Optional[str]) -> str:
+async def generate_final_answer(original_query: str, elastic_context: List[str], session_context: Optional[str],
+                                retrieval_available: bool = True) -> str:
     """
     Uses the LLM to generate a final, grounded answer based on the retrieved context.
+    With `retrieval_available=False` (search circuit open) it answers without
+    retrieval and tells the user document search is temporarily unavailable.
+    Raises CircuitOpenError while the generation circuit is open.
     """
-    logger.debug(f"Generating final answer for query: '{original_query[:50]}...'")
+    logger.debug("Generating final answer for query: '%.50s...'", original_query)
 
     # Combine and truncate context if necessary
     combined_context = truncate_context(elastic_context, settings.MAX_CONTEXT_TOKENS)
 
-    if not combined_context:
-        # Handle cases where no context was found
-        logger.info("No context found. Generating a 'not found' response.")
-        prompt = f"""
-        You are a helpful AI assistant. The user asked a question, but you could not find any relevant information in the provided documents.
-        Politely inform the user that you couldn't find an answer in their documents and suggest they rephrase the question or upload more documents.
-        Do not make up an answer.
-
-        User's Question: "{original_query}"
-
-        Your polite response:
-        """
-    else:
-        # Main prompt for generating a grounded answer
-        prompt = f"""
-        You are a helpful AI assistant. Your task is to answer the user's question based *only* on the provided context.
-        -   If the context contains the answer, synthesize it into a clear and concise response.
-        -   If the context does not contain the answer, state that you could not find the information in the provided documents.
-        -   Do not use any external knowledge or make up information.
-        -   Cite the source of your information if possible (though not required for this implementation).
-
-        --- CONTEXT ---
-        {combined_context}
-        --- END CONTEXT ---
-
-        User's Question: "{original_query}"
-
-        Answer:
-        """
-
     try:
-        model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME)
-        response = await model.generate_content_async(prompt)
+        if not combined_context and not retrieval_available:
+            logger.info("Document search unavailable. Generating a response without retrieval.")
+            prompt = await _get_prompt("generate_no_retrieval", NO_RETRIEVAL_SYSTEM_INSTRUCTION)
+            contents = f"User's Message: \"{original_query}\"\n\nYour response:"
+        elif not combined_context:
+            # Handle cases where no context was found
+            logger.info("No context found. Generating a 'not found' response.")
+            prompt = await _get_prompt("generate_no_context", NO_CONTEXT_SYSTEM_INSTRUCTION)
+            contents = f"User's Question: \"{original_query}\"\n\nYour polite response:"
+        else:
+            prompt = await _get_prompt("generate", ANSWER_SYSTEM_INSTRUCTION)
+            contents = (
+                f"--- CONTEXT ---\n{combined_context}\n--- END CONTEXT ---\n\n"
+                f"User's Question: \"{original_query}\"\n\nAnswer:"
+            )
+        response = await _generate("generate", prompt, contents)
+        if not _response_has_content("generate", response, prompt):
+            return ANSWER_BLOCKED_MESSAGE
         return response.text.strip()
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        logger.error(f"Error in generate_final_answer: {e}", exc_info=True)
-        return "I'm sorry, but I encountered an error while trying to generate a response. Please try again."
+        logger.error("Error in generate_final_answer: %s", e, exc_info=True)
+        return ANSWER_ERROR_MESSAGE
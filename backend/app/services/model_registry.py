@@ -0,0 +1,128 @@
+"""
+Process-wide registry of loaded models.
+
+The API process serves search, /api/embed and inline ingestion, and workers
+run ingestion; all of them need the same MiniLM encoder. Every call site gets
+it from here, so each process holds exactly one copy per (model name, device)
+no matter which module asks first. Models load lazily on first use (normally
+the startup warm-up or the worker_process_init hook), and loads of the same
+key are serialized so concurrent first requests don't load twice.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RegisteredModel:
+    kind: str # sentence_transformer | tokenizer
+    name: str
+    device: str
+    instance: Any
+    load_seconds: float
+    loaded_at: float = field(default_factory=time.time)
+
+    def parameter_bytes(self) -> int:
+        """Bytes held by the model's parameters and buffers (0 for non-torch objects)."""
+        try:
+            tensors = list(self.instance.parameters()) + list(self.instance.buffers())
+        except AttributeError:
+            return 0
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, if it can be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._models: dict[tuple[str, str, str], RegisteredModel] = {}
+        self._locks: dict[tuple[str, str, str], threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    def _lock_for(self, key: tuple[str, str, str]) -> threading.Lock:
+        with self._registry_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _get_or_load(self, kind: str, name: str, device: str, loader) -> Any:
+        key = (kind, name, device)
+        entry = self._models.get(key)
+        if entry is not None:
+            return entry.instance
+        with self._lock_for(key):
+            entry = self._models.get(key)
+            if entry is None:
+                logger.info(f"Model registry: loading {kind} '{name}' (device={device}).")
+                start = time.perf_counter()
+                instance = loader()
+                entry = RegisteredModel(kind, name, device, instance, round(time.perf_counter() - start, 3))
+                self._models[key] = entry
+                logger.info(f"Model registry: loaded {kind} '{name}' in {entry.load_seconds}s.")
+        return entry.instance
+
+    def sentence_transformer(self, name: Optional[str] = None, device: Optional[str] = None):
+        """Returns the shared SentenceTransformer for (name, device), loading it on first use."""
+        name = name or settings.EMBEDDING_MODEL_NAME
+        device = device or settings.EMBEDDING_DEVICE
+
+        def load():
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(name, device=None if device == "auto" else device)
+        return self._get_or_load("sentence_transformer", name, device, load)
+
+    def tokenizer(self, name: Optional[str] = None):
+        """
+        Returns the tokenizer for a model. Reuses the tokenizer of an already
+        loaded SentenceTransformer; otherwise loads only the tokenizer.
+        """
+        name = name or settings.EMBEDDING_MODEL_NAME
+        for (kind, model_name, _), entry in list(self._models.items()):
+            if kind == "sentence_transformer" and model_name == name:
+                return entry.instance.tokenizer
+
+        def load():
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(name)
+        return self._get_or_load("tokenizer", name, "cpu", load)
+
+    def report(self) -> dict:
+        models = [
+            {
+                "kind": entry.kind,
+                "name": entry.name,
+                "device": entry.device,
+                "parameter_bytes": entry.parameter_bytes(),
+                "load_seconds": entry.load_seconds,
+                "loaded_at": entry.loaded_at,
+            }
+            for entry in self._models.values()
+        ]
+        return {
+            "process_rss_bytes": process_rss_bytes(),
+            "model_parameter_bytes": sum(m["parameter_bytes"] for m in models),
+            "models": models,
+        }
+
+
+model_registry = ModelRegistry()
+
+
+def get_embedding_model():
+    """Returns the shared embedding model, or None if it could not be loaded."""
+    try:
+        return model_registry.sentence_transformer()
+    except Exception as e:
+        logger.error(f"CRITICAL: Failed to load embedding model: {e}", exc_info=True)
+        return None
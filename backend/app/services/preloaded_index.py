@@ -0,0 +1,90 @@
+"""
+Read-optimized index for the shared preloaded corpus.
+
+With PRELOADED_INDEX_ALIAS set, preloaded documents do not live in the tenant
+index (ES_INDEX_NAME), where uploads keep adding segments and refreshes.
+Instead each rebuild (`python -m app.cli.bulk_load DIR --rebuild-preloaded`)
+writes a fresh, timestamped index:
+
+1. `create_index`: same mapping as the tenant index, PRELOADED_INDEX_SHARDS
+   shards, no replicas and refresh disabled while loading.
+2. The bulk loader fills it and force-merges it to one segment.
+3. `publish`: adds PRELOADED_INDEX_REPLICAS replicas, makes it read-only,
+   waits for the replicas, then moves the alias from the previous index to
+   the new one in a single `_aliases` call, so searches never see a
+   half-built corpus. Older indices are deleted unless asked to keep them.
+
+Searches (search_service) query the tenant index and the alias in one
+`_msearch` and merge the two result lists.
+"""
+import logging
+import time
+from typing import Optional
+from app.core.config import settings
+from app.tasks.processing import CHUNK_MAPPING
+
+logger = logging.getLogger(__name__)
+
+
+def new_index_name() -> str:
+    """Concrete index name for a rebuild, e.g. rag_preloaded-20240610-120301."""
+    return f"{settings.PRELOADED_INDEX_ALIAS}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}"
+
+
+async def aliased_indices(es_client, alias: Optional[str] = None) -> list[str]:
+    """Indices the alias (default: PRELOADED_INDEX_ALIAS) points to (empty before the first build)."""
+    alias = alias or settings.PRELOADED_INDEX_ALIAS
+    if not await es_client.indices.exists_alias(name=alias):
+        return []
+    response = await es_client.indices.get_alias(name=alias)
+    return sorted(response.keys())
+
+
+async def create_index(es_client, index: str) -> bool:
+    """Creates an empty build index tuned for loading (no replicas, no refresh). Returns False if it already existed."""
+    if await es_client.indices.exists(index=index):
+        logger.info(f"Preloaded build index '{index}' already exists; resuming into it.")
+        return False
+    await es_client.indices.create(
+        index=index,
+        mappings=CHUNK_MAPPING,
+        settings={
+            "number_of_shards": settings.PRELOADED_INDEX_SHARDS,
+            "number_of_replicas": 0,
+            "refresh_interval": "-1",
+        },
+    )
+    logger.info(f"Created preloaded build index '{index}'.")
+    return True
+
+
+async def publish(es_client, index: str, keep_previous: bool = False, health_timeout: str = "10m") -> dict:
+    """
+    Makes a loaded (and force-merged) index read-only and replicated, then
+    atomically points the alias at it. Returns what was swapped.
+    """
+    alias = settings.PRELOADED_INDEX_ALIAS
+    await es_client.indices.put_settings(index=index, settings={"index": {
+        "number_of_replicas": settings.PRELOADED_INDEX_REPLICAS,
+        "refresh_interval": "-1", # Never written again; the final refresh below is the last one needed
+        "blocks.write": True,
+    }})
+    await es_client.indices.refresh(index=index)
+
+    health = await es_client.cluster.health(
+        index=index, wait_for_status="green", timeout=health_timeout, request_timeout=3600
+    )
+    if health.get("timed_out"):
+        # Still searchable on the primaries; replicas keep allocating after the swap.
+        logger.warning(f"Index '{index}' is {health.get('status')} after {health_timeout}; publishing anyway.")
+
+    previous = [name for name in await aliased_indices(es_client) if name != index]
+    actions = [{"remove": {"index": name, "alias": alias}} for name in previous]
+    actions.append({"add": {"index": index, "alias": alias}})
+    await es_client.indices.update_aliases(actions=actions)
+    logger.info(f"Alias '{alias}' now points to '{index}' (was: {previous or 'none'}).")
+
+    if previous and not keep_previous:
+        await es_client.indices.delete(index=",".join(previous), ignore_unavailable=True)
+        logger.info(f"Deleted previous preloaded indices: {previous}.")
+    return {"alias": alias, "index": index, "previous": previous, "deleted_previous": bool(previous and not keep_previous)}
@@ -0,0 +1,122 @@
+"""
+Long-lived Gemini model objects for the static prompt prefixes.
+
+Each LLM call site (router, rewriter, answer generator) has a fixed block of
+instructions and examples. That block is set once as the model's
+`system_instruction`, and each request sends only its dynamic part (the query
+and retrieved context). With GEMINI_CONTEXT_CACHE=auto the instruction is also
+stored with Gemini context caching, so its tokens are billed at the cached rate.
+Prefixes below GEMINI_CONTEXT_CACHE_MIN_TOKENS (the model's minimum cacheable
+size) are not sent to the cache API and use the in-process model. Models are
+built in a worker thread, since cache creation is a blocking API call.
+GEMINI_CONTEXT_CACHE=local (the default) skips the provider cache entirely.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+import google.generativeai as genai
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Provider caches are recreated this long before they expire.
+CACHE_REFRESH_MARGIN_SECONDS = 300
+
+
+@dataclass
+class CachedPrompt:
+    name: str
+    system_instruction: str
+    model: "genai.GenerativeModel"
+    static_tokens: int # Tokens in the system instruction, sent (or cached) with every request
+    cache_name: Optional[str] = None # Provider cache resource, if one was created
+    expires_at: Optional[float] = None
+
+    @property
+    def stale(self) -> bool:
+        return self.expires_at is not None and time.time() > self.expires_at - CACHE_REFRESH_MARGIN_SECONDS
+
+
+class PromptCache:
+    """Builds one model per static prompt on first use and reuses it across requests."""
+
+    def __init__(self, mode: str, ttl_seconds: int, min_tokens: int = 0):
+        self.mode = mode
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self._prompts: dict[str, CachedPrompt] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, name: str, system_instruction: str) -> CachedPrompt:
+        prompt = self._prompts.get(name)
+        if prompt is not None and not prompt.stale:
+            return prompt
+        async with self._lock:
+            prompt = self._prompts.get(name)
+            if prompt is None or prompt.stale:
+                prompt = await asyncio.to_thread(self._build, name, system_instruction)
+                self._prompts[name] = prompt
+        return prompt
+
+    def _build(self, name: str, system_instruction: str) -> CachedPrompt:
+        """Blocking (token count, cache creation): runs in a worker thread via `get`."""
+        static_tokens = self._count_tokens(system_instruction)
+        if self.mode == "auto" and static_tokens < self.min_tokens:
+            logger.info("Prompt '%s': %d tokens is below the context cache minimum (%s). Using system_instruction only.",
+                        name, static_tokens, self.min_tokens)
+        elif self.mode == "auto":
+            try:
+                cached = genai.caching.CachedContent.create(
+                    model=settings.GEMINI_MODEL_NAME,
+                    display_name=f"rag-{name}",
+                    system_instruction=system_instruction,
+                    ttl=timedelta(seconds=self.ttl_seconds),
+                )
+                static_tokens = getattr(cached.usage_metadata, "total_token_count", 0) or static_tokens
+                logger.info("Prompt '%s': using Gemini context cache '%s' (%d tokens).", name, cached.name, static_tokens)
+                return CachedPrompt(
+                    name=name,
+                    system_instruction=system_instruction,
+                    model=genai.GenerativeModel.from_cached_content(cached_content=cached),
+                    static_tokens=static_tokens,
+                    cache_name=cached.name,
+                    expires_at=time.time() + self.ttl_seconds,
+                )
+            except Exception as e:
+                logger.info("Prompt '%s': context cache unavailable (%s). Using system_instruction only.", name, e)
+
+        model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME, system_instruction=system_instruction)
+        return CachedPrompt(
+            name=name,
+            system_instruction=system_instruction,
+            model=model,
+            static_tokens=static_tokens,
+        )
+
+    @staticmethod
+    def _count_tokens(text: str) -> int:
+        try:
+            return genai.GenerativeModel(settings.GEMINI_MODEL_NAME).count_tokens(text).total_tokens
+        except Exception as e:
+            logger.debug("count_tokens failed (%s); estimating static prompt size.", e)
+            return len(text) // 4
+
+    def report(self) -> dict:
+        return {
+            name: {"static_tokens": p.static_tokens, "provider_cache": p.cache_name, "expires_at": p.expires_at}
+            for name, p in self._prompts.items()
+        }
+
+    def clear(self) -> None:
+        """Drops all models (e.g. after the API key changes). Provider caches expire on their own."""
+        self._prompts.clear()
+
+
+prompt_cache = PromptCache(
+    mode=settings.GEMINI_CONTEXT_CACHE,
+    ttl_seconds=settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+    min_tokens=settings.GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+)
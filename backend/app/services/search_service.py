@@ -1,104 +1,341 @@
-from app.services.es_client import es_client
 from app.core.config import settings
-from sentence_transformers import SentenceTransformer
+from app.core.metrics import time_stage, es_errors_total
+from app.services.slow_query_log import timed_search, timed_msearch
+from app.services.model_registry import get_embedding_model
+from app.services.circuit_breaker import breakers, CircuitOpenError
+from app.services.fusion import fuse, merge_by_score
+import asyncio
 import logging
-from typing import List
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-# --- Embedding Model Loading ---
-embedding_model_search = None
-try:
-    logger.info(f"Search Service: Loading embedding model: {settings.EMBEDDING_MODEL_NAME}")
-    embedding_model_search = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
-    logger.info("Search Service: Embedding model loaded successfully.")
-except Exception as e:
-    logger.error(f"CRITICAL: Failed to load embedding model for search service: {e}", exc_info=True)
-
+def _user_filter(user_id: str) -> dict:
+    """Filter Logic: Include user's docs OR preloaded docs."""
+    return {
+        "bool": {
+            "should": [
+                {"term": {"user_id": user_id}},
+                {"term": {"user_id": settings.PRELOADED_DOCS_USER_ID}}
+            ],
+            "minimum_should_match": 1 # Must match one of the user IDs
+        }
+    }
 
-async def perform_hybrid_search(user_id: str, query_text: str, top_k: int = 5) -> List[str]:
+def _search_targets(user_id: str) -> List[Tuple[str, Optional[dict]]]:
     """
-    Performs an asynchronous hybrid search (BM25 + Vector) in Elasticsearch,
-    filtering by the user's ID AND including pre-loaded documents.
+    (index, filter) pairs searched for a user's query. With PRELOADED_INDEX_ALIAS
+    the preloaded corpus has its own read-optimized index, searched without a
+    filter, and the tenant index only needs a term filter. Otherwise both live
+    in ES_INDEX_NAME behind the user-or-preloaded filter.
     """
-    if not embedding_model_search:
-        logger.error("Search Service: Embedding model not loaded. Cannot perform vector search.")
-        return []
-    if not query_text:
-         logger.warning("Search Service: Received empty query text.")
-         return []
-    if not es_client:
-         logger.error("Search Service: Elasticsearch client not available.")
-         return []
+    if settings.PRELOADED_INDEX_ALIAS:
+        return [
+            (settings.ES_INDEX_NAME, {"term": {"user_id": user_id}}),
+            (settings.PRELOADED_INDEX_ALIAS, None),
+        ]
+    return [(settings.ES_INDEX_NAME, _user_filter(user_id))]
 
+def _fusion_window(top_k: int) -> int:
+    """How many top results from each method are considered for fusion."""
+    return max(50, top_k * 5)
 
-    logger.debug(f"Performing hybrid search for user '{user_id}' (plus preloaded) with query: '{query_text}'")
-
-    try:
-        query_vector = embedding_model_search.encode(query_text).tolist()
+def build_hybrid_query(user_id: str, query_text: str, query_vector: List[float], top_k: int = 5,
+                       filters: Optional[List[dict]] = None) -> dict:
+    """
+    Builds the hybrid (BM25 + kNN, RRF-fused) search body for one query.
+    `filters` defaults to the user-or-preloaded filter; pass [] for none.
+    Note that ES RRF fuses by rank only and ignores the clause boosts; use a
+    client-side HYBRID_FUSION mode for weighted fusion.
+    """
+    if filters is None:
+        filters = [_user_filter(user_id)]
 
-        # --- Filter Logic: Include user's docs OR preloaded docs ---
-        user_filter = {
+    query_body = {
+        "size": top_k,
+        "_source": ["chunk_text"],
+        "query": {
             "bool": {
+                "filter": filters, # Apply the user ID filter
                 "should": [
-                    {"term": {"user_id": user_id}},
-                    {"term": {"user_id": settings.PRELOADED_DOCS_USER_ID}}
+                    {
+                        "match": {
+                            "chunk_text": { "query": query_text, "boost": 0.3 }
+                        }
+                    }
                 ],
-                "minimum_should_match": 1 # Must match one of the user IDs
+                "minimum_should_match": 1
+            }
+        },
+        "knn": {
+            "field": "chunk_vector",
+            "query_vector": query_vector,
+            "k": top_k * 2, # Fetch more candidates initially across both user/preloaded
+            "num_candidates": max(100, top_k * 10),
+            "boost": 0.7,
+            "filter": filters # Apply filter within KNN as well
+        },
+        # Use RRF for better merging of BM25 and kNN scores across potentially different score scales
+        "rank": {
+            "rrf": {
+                "window_size": _fusion_window(top_k),
+                "rank_constant": settings.FUSION_RANK_CONSTANT
             }
         }
+    }
+    return query_body
 
-        query_body = {
-            "size": top_k,
-            "_source": ["chunk_text"],
-            "query": {
-                "bool": {
-                    "filter": [user_filter], # Apply the combined user ID filter
-                    "should": [
-                        {
-                            "match": {
-                                "chunk_text": { "query": query_text, "boost": 0.3 }
-                            }
-                        }
-                    ],
-                    "minimum_should_match": 1
-                }
-            },
-            "knn": {
-                "field": "chunk_vector",
-                "query_vector": query_vector,
-                "k": top_k * 2, # Fetch more candidates initially across both user/preloaded
-                "num_candidates": max(100, top_k * 10),
-                "boost": 0.7,
-                "filter": [user_filter] # Apply filter within KNN as well
-            },
-             # Use RRF for better merging of BM25 and kNN scores across potentially different score scales
-             "rank": {
-                 "rrf": {
-                     "window_size": max(50, top_k * 5), # How many top results from each method to consider
-                     "rank_constant": 60 # Standard default for RRF
-                 }
-             }
+def build_fusion_subqueries(user_id: str, query_text: str, query_vector: List[float], top_k: int = 5,
+                            filters: Optional[List[dict]] = None) -> Tuple[dict, dict]:
+    """
+    Builds separate BM25 and kNN bodies for one query, for client-side fusion.
+    Each returns the fusion window of hits so both lists can be fused.
+    """
+    if filters is None:
+        filters = [_user_filter(user_id)]
+    window = _fusion_window(top_k)
+    bm25_body = {
+        "size": window,
+        "_source": ["chunk_text"],
+        "query": {
+            "bool": {
+                "filter": filters,
+                "must": [{"match": {"chunk_text": query_text}}]
+            }
+        }
+    }
+    knn_body = {
+        "size": window,
+        "_source": ["chunk_text"],
+        "knn": {
+            "field": "chunk_vector",
+            "query_vector": query_vector,
+            "k": window,
+            "num_candidates": max(100, window * 2),
+            "filter": filters
         }
+    }
+    return bm25_body, knn_body
+
+def build_query_searches(user_id: str, query_text: str, query_vector: List[float], top_k: int = 5,
+                         file_name: Optional[str] = None) -> List[Tuple[str, dict]]:
+    """
+    All (index, body) sub-searches for one query: per target index, one
+    server-fused body or, with client-side fusion, a BM25 and a kNN body.
+    `file_name` restricts the search to one document.
+    """
+    searches = []
+    for index, user_filter in _search_targets(user_id):
+        filters = [user_filter] if user_filter else []
+        if file_name:
+            filters.append({"term": {"file_name": file_name}})
+        if _client_side_fusion():
+            searches.extend((index, body) for body in build_fusion_subqueries(user_id, query_text, query_vector, top_k, filters))
+        else:
+            searches.append((index, build_hybrid_query(user_id, query_text, query_vector, top_k, filters)))
+    return searches
+
+def combine_query_responses(responses: List[dict], top_k: int) -> List[Tuple[str, float]]:
+    """
+    Turns the sub-responses of `build_query_searches` into one (chunk_text, score)
+    list: fuses BM25/kNN per index (client-side fusion, or ES rank.rrf with
+    HYBRID_FUSION=server), then merges the tenant and preloaded lists by score.
+
+    The merge is not an approximation: a chunk lives in exactly one index, so
+    its score in one RRF (or linear) fusion over all four BM25/kNN lists only
+    has terms from its own index's two lists, which is its per-index score.
+    Interleaving the per-index results by score therefore gives the joint
+    ranking. Like any RRF, it ranks by position within each list, so the top
+    preloaded hit and the top tenant hit score alike.
+    """
+    if _client_side_fusion():
+        per_index = [fuse_responses(responses[n], responses[n + 1], top_k) for n in range(0, len(responses), 2)]
+    else:
+        per_index = [extract_scored_chunks(response) for response in responses]
+    return per_index[0] if len(per_index) == 1 else merge_by_score(per_index, top_k)
+
+def _msearch_lines(searches: List[Tuple[str, dict]]) -> List[dict]:
+    lines = []
+    for index, body in searches:
+        header = {"index": index}
+        if index == settings.PRELOADED_INDEX_ALIAS:
+            header["ignore_unavailable"] = True # Before the first build, the alias does not exist yet.
+        lines.extend((header, body))
+    return lines
+
+def fuse_responses(bm25_response: dict, knn_response: dict, top_k: int) -> List[Tuple[str, float]]:
+    """Fuses the BM25 and kNN sub-search responses of one query into (chunk_text, score) pairs, best first."""
+    texts = {}
+    lists = []
+    for response in (bm25_response, knn_response):
+        hits = [
+            hit for hit in response.get("hits", {}).get("hits", [])
+            if "chunk_text" in hit.get("_source", {})
+        ]
+        texts.update((hit["_id"], hit["_source"]["chunk_text"]) for hit in hits)
+        lists.append(([hit["_id"] for hit in hits], [hit.get("_score") or 0.0 for hit in hits]))
+    fused = fuse(
+        settings.HYBRID_FUSION, lists, (settings.FUSION_BM25_WEIGHT, settings.FUSION_KNN_WEIGHT),
+        top_k, settings.FUSION_RANK_CONSTANT
+    )
+    return [(texts[doc_id], score) for doc_id, score in fused]
+
+def _client_side_fusion() -> bool:
+    return settings.HYBRID_FUSION in ("rrf", "linear")
+
+def extract_scored_chunks(response: dict) -> List[Tuple[str, float]]:
+    """Returns (chunk_text, score) for a search response's hits, best first."""
+    return [
+        (hit["_source"]["chunk_text"], hit.get("_score") or 0.0)
+        for hit in response.get("hits", {}).get("hits", [])
+        if "_source" in hit and "chunk_text" in hit["_source"]
+    ]
 
-        response = await es_client.search(
-            index=settings.ES_INDEX_NAME,
-            body=query_body,
-            request_timeout=30
-        )
+def extract_chunks(response: dict) -> List[str]:
+    """Returns the chunk texts of a search response's hits."""
+    return [text for text, _ in extract_scored_chunks(response)]
 
-        context_chunks = [hit["_source"]["chunk_text"] for hit in response.get("hits", {}).get("hits", []) if "_source" in hit and "chunk_text" in hit["_source"]]
+
+def _sub_responses(response: dict, expected: int, operation: str) -> List[dict]:
+    """
+    Returns the `_msearch` sub-responses, with failed ones (logged and counted)
+    replaced by empty results so the remaining sub-searches are still used.
+    """
+    items = list(response.get("responses", []))[:expected]
+    items += [{}] * (expected - len(items))
+    for n, item in enumerate(items):
+        if "error" in item:
+            es_errors_total.labels(operation=operation).inc()
+            logger.warning("Search Service: sub-search %s failed: %s", n, item['error'])
+            items[n] = {}
+    return items
+
+
+async def perform_hybrid_search(user_id: str, query_text: str, top_k: int = 5, file_name: Optional[str] = None) -> List[str]:
+    """
+    Performs an asynchronous hybrid search (BM25 + Vector) in Elasticsearch,
+    filtering by the user's ID AND including pre-loaded documents
+    (and, if given, by file name).
+    """
+    return [text for text, _ in await perform_hybrid_search_scored(user_id, query_text, top_k, file_name)]
+
+
+async def perform_hybrid_search_scored(user_id: str, query_text: str, top_k: int = 5,
+                                       file_name: Optional[str] = None) -> List[Tuple[str, float]]:
+    """Like `perform_hybrid_search`, but returns (chunk_text, fused score) pairs."""
+    embedding_model = get_embedding_model()
+    if not embedding_model:
+        logger.error("Search Service: Embedding model not loaded. Cannot perform vector search.")
+        return []
+    if not query_text:
+         logger.warning("Search Service: Received empty query text.")
+         return []
+    logger.debug("Performing hybrid search for user '%s' (plus preloaded) with query: '%s'", user_id, query_text)
+
+    try:
+        with time_stage("embed"):
+            query_vector = embedding_model.encode(query_text).tolist()
+
+        searches = build_query_searches(user_id, query_text, query_vector, top_k, file_name)
+        with time_stage("es_search"):
+            async with breakers["es_search"].guard():
+                if len(searches) == 1:
+                    index, query_body = searches[0]
+                    responses = [await timed_search(
+                        index,
+                        query_body,
+                        user_id,
+                        request_timeout=settings.ES_SEARCH_TIMEOUT_SECONDS
+                    )]
+                else:
+                    # Tenant and preloaded indices (and/or BM25 and kNN) in one _msearch round trip.
+                    response = await timed_msearch(
+                        _msearch_lines(searches), [user_id] * len(searches),
+                        request_timeout=settings.ES_SEARCH_TIMEOUT_SECONDS
+                    )
+                    responses = _sub_responses(response, len(searches), "msearch")
+
+        context_chunks = combine_query_responses(responses, top_k)
 
         if not context_chunks:
-             logger.info(f"Hybrid search returned no results for user '{user_id}' query '{query_text}'.")
+             logger.info("Hybrid search returned no results for user '%s' query '%s'.", user_id, query_text)
         else:
-             logger.info(f"Retrieved {len(context_chunks)} chunks for user '{user_id}' query '{query_text}'.")
+             logger.info("Retrieved %d chunks for user '%s' query '%s'.", len(context_chunks), user_id, query_text)
 
         return context_chunks
 
+    except CircuitOpenError as e:
+        logger.warning("Search Service: skipping hybrid search: %s", e)
+        return []
     except ConnectionError as ce:
-        logger.error(f"Search Service: Connection error during hybrid search: {ce}", exc_info=True)
+        es_errors_total.labels(operation="search").inc()
+        logger.error("Search Service: Connection error during hybrid search: %s", ce, exc_info=True)
         return []
     except Exception as e:
-        logger.error(f"Search Service: Unexpected error during hybrid search: {e}", exc_info=True)
+        es_errors_total.labels(operation="search").inc()
+        logger.error("Search Service: Unexpected error during hybrid search: %s", e, exc_info=True)
+        return []
+
+
+async def perform_hybrid_search_batch(queries: List[Tuple[str, str]], top_k: int = 5, with_scores: bool = False,
+                                      file_names: Optional[List[Optional[str]]] = None) -> List[List]:
+    """
+    Batched variant of `perform_hybrid_search` for (user_id, query_text) pairs.
+    All queries are embedded in a single `encode` call and retrieved with a
+    single `_msearch` round trip. Results are returned in input order; a query
+    that fails (or is empty) yields an empty list. With `with_scores`, each
+    result is a list of (chunk_text, score) pairs. `file_names`, if given,
+    holds an optional file name filter per query.
+    """
+    if not queries:
         return []
+    embedding_model = get_embedding_model()
+    if not embedding_model:
+        logger.error("Search Service: Embedding model not loaded. Cannot perform batch vector search.")
+        return [[] for _ in queries]
+    # Empty queries are skipped but keep their slot in the output.
+    positions = [i for i, (_, query_text) in enumerate(queries) if query_text]
+    results: List[List] = [[] for _ in queries]
+    if not positions:
+        return results
+
+    try:
+        texts = [queries[i][1] for i in positions]
+        with time_stage("embed"):
+            vectors = await asyncio.to_thread(
+                embedding_model.encode, texts, batch_size=64, show_progress_bar=False
+            )
+
+        # Each query contributes one or more sub-searches (see build_query_searches).
+        searches = []
+        spans = []
+        user_ids = []
+        for i, vector in zip(positions, vectors):
+            user_id, query_text = queries[i]
+            file_name = file_names[i] if file_names else None
+            query_searches = build_query_searches(user_id, query_text, vector.tolist(), top_k, file_name)
+            spans.append((len(searches), len(searches) + len(query_searches)))
+            searches.extend(query_searches)
+            user_ids.extend([user_id] * len(query_searches))
+
+        with time_stage("es_search"):
+            async with breakers["es_search"].guard():
+                response = await timed_msearch(
+                    _msearch_lines(searches), user_ids, request_timeout=settings.ES_SEARCH_TIMEOUT_SECONDS * 2
+                )
+
+        items = _sub_responses(response, len(searches), "msearch")
+        for i, (start, end) in zip(positions, spans):
+            scored = combine_query_responses(items[start:end], top_k)
+            results[i] = scored if with_scores else [text for text, _ in scored]
+
+        logger.info("Batch hybrid search retrieved context for %d/%d queries.", sum(1 for r in results if r), len(queries))
+        return results
+
+    except CircuitOpenError as e:
+        logger.warning("Search Service: skipping batch hybrid search: %s", e)
+        return results
+    except Exception as e:
+        es_errors_total.labels(operation="msearch").inc()
+        logger.error("Search Service: Unexpected error during batch hybrid search: %s", e, exc_info=True)
+        return results
@@ -0,0 +1,199 @@
+import asyncio
+import copy
+import json
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from app.core.config import settings
+from app.services.es_client import get_es_client
+from app.services.circuit_breaker import breakers
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows `rate_per_minute` events per minute on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class SlowQueryLog:
+    """
+    Bounded in-memory ring buffer of slow (or sampled) hybrid searches, with an
+    optional JSONL sink. Each record holds the query body, timings and the ES
+    profile trees of the query's components, captured off the request path.
+
+    Profiling re-runs the query up to three times, and during an ES slowdown
+    every query is slow. So profiles are rate-limited (token bucket), capped
+    at `max_in_flight` concurrent re-runs and skipped while the search circuit
+    is not closed; such entries are still recorded, with timings only.
+    """
+
+    def __init__(self, threshold_ms: float, sample_rate: float, max_entries: int, jsonl_path: str | None = None,
+                 profiles_per_minute: float = 6.0, max_in_flight: int = 2):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.entries: deque[dict] = deque(maxlen=max_entries)
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else None
+        self.max_in_flight = max_in_flight
+        self._profile_budget = TokenBucket(profiles_per_minute, burst=max(1, max_in_flight))
+        self._pending: set[asyncio.Task] = set() # Profiling re-runs in flight
+        self._writes: set[asyncio.Task] = set() # Entries recorded without a profile
+        self.profiles_skipped = 0
+
+    def should_capture(self, duration_ms: float) -> str | None:
+        """Returns the capture reason ('slow' or 'sampled'), or None to skip."""
+        if duration_ms >= self.threshold_ms:
+            return "slow"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def capture(self, index: str, query_body: dict, duration_ms: float, took_ms: int | None, reason: str, user_id: str) -> None:
+        """Schedules a profiled re-run of the query in the background, budget permitting."""
+        if len(self._pending) >= self.max_in_flight:
+            skipped = "max_in_flight"
+        elif breakers["es_search"].state != "closed":
+            skipped = "search_circuit_not_closed"
+        elif not self._profile_budget.take():
+            skipped = "rate_limited"
+        else:
+            skipped = None
+        if skipped:
+            self.profiles_skipped += 1
+        task = asyncio.create_task(self._profile_and_store(index, query_body, duration_ms, took_ms, reason, user_id, skipped))
+        tasks = self._writes if skipped else self._pending
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def slowest(self, limit: int = 20) -> list[dict]:
+        return sorted(self.entries, key=lambda e: e["duration_ms"], reverse=True)[:limit]
+
+    async def _profile_and_store(self, index: str, query_body: dict, duration_ms: float, took_ms: int | None, reason: str,
+                                 user_id: str, skipped: str | None = None):
+        if skipped:
+            profiles = {"skipped": skipped}
+        else:
+            try:
+                profiles = await self._profile_components(index, query_body)
+            except Exception as e:
+                logger.warning("Slow query log: profiling failed: %s", e)
+                profiles = {"error": str(e)}
+
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "reason": reason,
+            "user_id": user_id,
+            "duration_ms": round(duration_ms, 2),
+            "es_took_ms": took_ms,
+            "query_body": _redact_vectors(query_body),
+            "profiles": profiles,
+        }
+        self.entries.append(record)
+        if self.jsonl_path:
+            try:
+                await asyncio.to_thread(self._append_jsonl, record)
+            except Exception as e:
+                logger.warning("Slow query log: could not write to %s: %s", self.jsonl_path, e)
+        logger.info("Slow query captured (%s): %.0f ms total, ES took %s ms.", reason, duration_ms, took_ms)
+
+    async def _profile_components(self, index: str, query_body: dict) -> dict:
+        """
+        Profiles the fused query and, separately, its BM25 and kNN halves, so the
+        cost of each (and, by difference, of RRF fusion) can be told apart.
+        """
+        es_client = get_es_client()
+        variants = {"fused": copy.deepcopy(query_body)}
+        if "query" in query_body:
+            bm25 = {k: v for k, v in query_body.items() if k not in ("knn", "rank")}
+            variants["bm25"] = bm25
+        if "knn" in query_body:
+            knn = {k: v for k, v in query_body.items() if k not in ("query", "rank")}
+            variants["knn"] = knn
+
+        async def run(body: dict) -> dict:
+            try:
+                response = await es_client.search(index=index, body={**body, "profile": True}, request_timeout=30)
+                return {"took_ms": response.get("took"), "profile": response.get("profile")}
+            except Exception as e:
+                # e.g. clusters where `profile` cannot be combined with `rank`
+                return {"error": str(e)}
+
+        results = await asyncio.gather(*(run(body) for body in variants.values()))
+        return dict(zip(variants.keys(), results))
+
+    def _append_jsonl(self, record: dict) -> None:
+        self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def _redact_vectors(body):
+    """Replaces dense query vectors with their dimension to keep records small."""
+    if isinstance(body, dict):
+        return {
+            k: (f"<vector dims={len(v)}>" if k == "query_vector" and isinstance(v, list) else _redact_vectors(v))
+            for k, v in body.items()
+        }
+    if isinstance(body, list):
+        return [_redact_vectors(v) for v in body]
+    return body
+
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS,
+    sample_rate=settings.SLOW_QUERY_SAMPLE_RATE,
+    max_entries=settings.SLOW_QUERY_LOG_SIZE,
+    jsonl_path=settings.SLOW_QUERY_LOG_PATH,
+    profiles_per_minute=settings.SLOW_QUERY_PROFILES_PER_MINUTE,
+    max_in_flight=settings.SLOW_QUERY_MAX_IN_FLIGHT,
+)
+
+
+async def timed_search(index: str, query_body: dict, user_id: str, **kwargs) -> dict:
+    """Runs `es_client.search` and hands slow or sampled queries to the slow-query log."""
+    es_client = get_es_client()
+    start = time.perf_counter()
+    response = await es_client.search(index=index, body=query_body, **kwargs)
+    duration_ms = (time.perf_counter() - start) * 1000
+    reason = slow_query_log.should_capture(duration_ms)
+    if reason:
+        slow_query_log.capture(index, query_body, duration_ms, response.get("took"), reason, user_id)
+    return response
+
+
+async def timed_msearch(searches: list[dict], user_ids: list[str], **kwargs) -> dict:
+    """
+    Runs `es_client.msearch` (header/body lines) and hands slow or sampled
+    round trips to the slow-query log. The sub-search ES spent longest on is
+    the one recorded and profiled; `user_ids` holds the user of each sub-search.
+    """
+    es_client = get_es_client()
+    start = time.perf_counter()
+    response = await es_client.msearch(searches=searches, **kwargs)
+    duration_ms = (time.perf_counter() - start) * 1000
+    reason = slow_query_log.should_capture(duration_ms)
+    if reason:
+        items = list(response.get("responses", []))
+        took = [item.get("took") or 0 if "error" not in item else -1 for item in items[:len(user_ids)]]
+        if took:
+            n = max(range(len(took)), key=took.__getitem__)
+            header, body = searches[2 * n], searches[2 * n + 1]
+            slow_query_log.capture(header["index"], body, duration_ms, items[n].get("took"), reason, user_ids[n])
+    return response
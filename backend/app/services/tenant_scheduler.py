@@ -0,0 +1,187 @@
+"""
+Tenant-aware scheduling for ingestion tasks on the shared Celery queue.
+
+- Admission control: each tenant (user_id) has a backlog of queued and running
+  uploads. Past its quota, uploads are rejected with 429 instead of queued.
+- Priority lane and weighted fair queuing: the Redis broker serves Celery
+  priorities strictly in order (0 first). Small files get priority 0. Other
+  files get 1-9, growing with log2 of the tenant's backlog divided by its
+  weight (TENANT_WEIGHTS, default 1), so a tenant with thousands of uploads
+  queued sinks below tenants with a handful, and a weight-4 tenant sinks as
+  if its backlog were a quarter as long.
+- Concurrency caps: a task runs only if its tenant has a free slot;
+  otherwise it is retried later, which leaves the worker free for other
+  tenants. The delay doubles per deferral up to TENANT_RETRY_MAX_SECONDS,
+  and a task still capped TENANT_MAX_DEFER_SECONDS after enqueue fails.
+- Queue wait: the time from enqueue until a task gets its slot is recorded
+  per tenant (Redis) and per lane (Prometheus).
+
+All state is kept in Redis, shared by the API and every worker. Keys expire
+so a crashed worker cannot leak backlog or slots forever. If Redis is
+unavailable, admission fails open and tasks run uncapped.
+"""
+import logging
+import math
+import random
+from typing import Optional
+from app.core.config import settings
+from app.core.metrics import ingestion_queue_wait_seconds
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "rag:ingest"
+SMALL_FILE_PRIORITY = 0
+MAX_PRIORITY = 9 # Lowest priority served by the Redis transport
+STATE_TTL_SECONDS = 24 * 3600
+
+
+class TenantBacklogFull(Exception):
+    def __init__(self, user_id: str, backlog: int, quota: int):
+        super().__init__(f"Tenant '{user_id}' has {backlog} uploads pending (quota {quota}).")
+        self.user_id = user_id
+        self.backlog = backlog
+        self.quota = quota
+
+
+def _parse_overrides(raw: Optional[str], cast=int) -> dict:
+    """Parses 'user_a=1000,user_b=50' into {user_id: value}."""
+    overrides = {}
+    for item in (raw or "").split(","):
+        if "=" in item:
+            user_id, value = item.split("=", 1)
+            try:
+                overrides[user_id.strip()] = cast(value)
+            except ValueError:
+                logger.warning("Ignoring invalid tenant override '%s'.", item)
+    return overrides
+
+
+class TenantScheduler:
+    def __init__(self, redis_url: str):
+        self.redis_url = redis_url
+        self._redis = None
+        self.quota_overrides = _parse_overrides(settings.TENANT_QUOTA_OVERRIDES)
+        self.weights = {user_id: weight for user_id, weight in _parse_overrides(settings.TENANT_WEIGHTS, float).items() if weight > 0}
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url, decode_responses=True)
+        return self._redis
+
+    @staticmethod
+    def _key(kind: str, user_id: str) -> str:
+        return f"{KEY_PREFIX}:{kind}:{user_id}"
+
+    def quota_for(self, user_id: str) -> int:
+        return self.quota_overrides.get(user_id, settings.TENANT_MAX_BACKLOG)
+
+    def weight_for(self, user_id: str) -> float:
+        return self.weights.get(user_id, 1.0)
+
+    # --- API side ---
+
+    def admit(self, user_id: str) -> int:
+        """Reserves a backlog slot for one upload. Returns the new backlog; raises TenantBacklogFull over quota."""
+        key = self._key("backlog", user_id)
+        try:
+            r = self._get_redis()
+            backlog = r.incr(key)
+            r.expire(key, STATE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning("Tenant admission unavailable (%s); admitting upload for '%s'.", e, user_id)
+            return 0
+        quota = self.quota_for(user_id)
+        if backlog > quota:
+            r.decr(key)
+            raise TenantBacklogFull(user_id, backlog - 1, quota)
+        return backlog
+
+    def priority_for(self, user_id: str, size_bytes: int, backlog: int) -> int:
+        if size_bytes <= settings.SMALL_FILE_BYTES:
+            return SMALL_FILE_PRIORITY
+        return min(MAX_PRIORITY, 1 + int(math.log2(max(backlog / self.weight_for(user_id), 1))))
+
+    # --- Worker side ---
+
+    def acquire_slot(self, user_id: str) -> bool:
+        """Claims one of the tenant's concurrent-processing slots. False if all are in use."""
+        key = self._key("running", user_id)
+        try:
+            r = self._get_redis()
+            running = r.incr(key)
+            r.expire(key, settings.TENANT_SLOT_TTL_SECONDS)
+        except Exception as e:
+            logger.warning("Tenant concurrency cap unavailable (%s); running task for '%s'.", e, user_id)
+            return True
+        if running > settings.TENANT_MAX_CONCURRENCY:
+            r.decr(key)
+            return False
+        return True
+
+    @staticmethod
+    def retry_delay(deferrals: int) -> float:
+        """Seconds before a capped task retries: doubling per deferral, capped, with jitter so retries spread out."""
+        delay = min(settings.TENANT_RETRY_MAX_SECONDS, settings.TENANT_RETRY_SECONDS * 2 ** min(deferrals, 16))
+        return delay * random.uniform(0.75, 1.0)
+
+    def release_slot(self, user_id: str) -> None:
+        try:
+            if self._get_redis().decr(self._key("running", user_id)) < 0:
+                self._get_redis().set(self._key("running", user_id), 0)
+        except Exception as e:
+            logger.warning("Could not release processing slot for '%s': %s", user_id, e)
+
+    def finish(self, user_id: str) -> None:
+        """Removes a finished (or finally failed) upload from the tenant's backlog."""
+        try:
+            if self._get_redis().decr(self._key("backlog", user_id)) < 0:
+                self._get_redis().set(self._key("backlog", user_id), 0)
+        except Exception as e:
+            logger.warning("Could not update backlog for '%s': %s", user_id, e)
+
+    def record_wait(self, task_id: str, user_id: str, lane: str, seconds: float) -> None:
+        """Records a task's queue wait the first time it starts (not again on retries)."""
+        key = self._key("wait", user_id)
+        try:
+            if not self._get_redis().set(f"{KEY_PREFIX}:started:{task_id}", 1, nx=True, ex=STATE_TTL_SECONDS):
+                return
+            ingestion_queue_wait_seconds.labels(lane=lane).observe(seconds)
+            pipe = self._get_redis().pipeline()
+            pipe.hincrby(key, "count", 1)
+            pipe.hincrbyfloat(key, "total_seconds", seconds)
+            pipe.hset(key, "last_seconds", round(seconds, 3))
+            pipe.expire(key, STATE_TTL_SECONDS)
+            pipe.execute()
+            current_max = float(self._get_redis().hget(key, "max_seconds") or 0)
+            if seconds > current_max:
+                self._get_redis().hset(key, "max_seconds", round(seconds, 3))
+        except Exception as e:
+            logger.debug("Could not record queue wait for '%s': %s", user_id, e)
+
+    # --- Reporting ---
+
+    def report(self) -> dict:
+        """Backlog, running tasks and queue-wait statistics for every tenant with recent activity."""
+        r = self._get_redis()
+        tenants: dict[str, dict] = {}
+        for kind in ("backlog", "running", "wait"):
+            for key in r.scan_iter(match=f"{KEY_PREFIX}:{kind}:*", count=500):
+                user_id = key.split(":", 3)[3]
+                entry = tenants.setdefault(user_id, {"backlog": 0, "running": 0, "quota": self.quota_for(user_id),
+                                                     "weight": self.weight_for(user_id)})
+                if kind == "wait":
+                    stats = r.hgetall(key)
+                    count = int(stats.get("count", 0))
+                    entry["queue_wait"] = {
+                        "count": count,
+                        "avg_seconds": round(float(stats.get("total_seconds", 0)) / count, 3) if count else 0.0,
+                        "max_seconds": float(stats.get("max_seconds", 0)),
+                        "last_seconds": float(stats.get("last_seconds", 0)),
+                    }
+                else:
+                    entry[kind] = int(r.get(key) or 0)
+        return tenants
+
+
+tenant_scheduler = TenantScheduler(settings.REDIS_URL)
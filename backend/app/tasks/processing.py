@@ -1,11 +1,22 @@
 from app.core.celery_app import celery
-from app.core.config import settings
+from app.core.config import settings, load_secrets
 from app.services.es_client import get_es_client
-from sentence_transformers import SentenceTransformer
+from app.core.worker_resources import apply_thread_limits, resource_report, cpu_share
+from app.core.metrics import time_ingestion_stage, ingested_chunks_total, es_errors_total
+from app.services.embedding import embed_chunks, get_chunk_tokenizer
+from app.services.model_registry import get_embedding_model
+from app.services.circuit_breaker import breakers, CircuitOpenError, is_bulk_outage
+from app.services.tenant_scheduler import tenant_scheduler
+from app.services.document_store import (
+    document_key, new_generation, chunk_id, fetch_chunk_ids, bulk_delete_ids, suspended_refresh
+)
+from celery.signals import worker_process_init
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from elasticsearch.helpers import async_bulk
 import logging
-import pypdf2
+import time
+import billiard
+import PyPDF2
 import docx
 from pathlib import Path
 import asyncio
@@ -13,16 +24,76 @@ import asyncio
 logger = logging.getLogger(__name__)
 
 # --- Embedding Model Loading ---
-# Load the model once when the worker starts.
-embedding_model = None
-try:
-    logger.info(f"Worker: Loading embedding model: {settings.EMBEDDING_MODEL_NAME}")
-    embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
-    logger.info("Worker: Embedding model loaded successfully.")
-except Exception as e:
-    logger.error(f"CRITICAL: Failed to load embedding model in worker: {e}", exc_info=True)
-    # The worker will not be able to process tasks without the model.
-    # Depending on the setup, this might cause the worker to fail to start.
+# The model comes from the process-wide registry and is not loaded at import,
+# so the API process (which imports this module to enqueue tasks) shares the
+# copy used for search. With WORKER_PRELOAD_MODEL the worker parent loads it
+# before forking (see worker_resources); otherwise each child loads its own.
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Loads secrets and the embedding model once per worker process, before any task runs."""
+    load_secrets()
+    apply_thread_limits()
+    get_embedding_model()
+    logger.info(f"Worker child resources: {resource_report()}")
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> str:
+    """Extracts text from pages [start, end) of a PDF."""
+    with open(file_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return "".join(reader.pages[i].extract_text() or "" for i in range(start, end))
+
+def _extract_pdf_block(file_path: str, start: int, end: int, sender) -> None:
+    """Process target: sends (True, text) for pages [start, end), or (False, error)."""
+    try:
+        sender.send((True, _extract_pdf_page_range(file_path, start, end)))
+    except Exception as e:
+        sender.send((False, repr(e)))
+    finally:
+        sender.close()
+
+def extract_pdf_text(file_path: str, workers: int | None = None) -> str:
+    """
+    Extracts PDF text, in page order. Large PDFs are split into one contiguous
+    block of pages per process, so each process parses the file once; small
+    ones stay on a single-process path.
+    The processes come from billiard (Celery's multiprocessing fork), which,
+    unlike multiprocessing, lets daemonic processes such as Celery prefork
+    children start them, so process_document takes the parallel path too.
+    By default a worker child uses at most its share of the cores.
+    """
+    workers = min(settings.PDF_EXTRACT_WORKERS, cpu_share()) if workers is None else workers
+    with open(file_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        page_count = len(reader.pages)
+        if page_count < settings.PDF_PARALLEL_MIN_PAGES or workers <= 1:
+            return "".join(page.extract_text() or "" for page in reader.pages)
+
+    workers = min(workers, page_count)
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    logger.info(f"Extracting {page_count} PDF pages in {workers} processes.")
+    blocks = []
+    try:
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            receiver, sender = billiard.Pipe(duplex=False)
+            process = billiard.Process(target=_extract_pdf_block, args=(file_path, start, end, sender), daemon=True)
+            process.start()
+            sender.close()
+            blocks.append((process, receiver))
+        # Receive before joining: a block's text can exceed the pipe buffer.
+        parts = []
+        for process, receiver in blocks:
+            ok, payload = receiver.recv()
+            if not ok:
+                raise RuntimeError(f"PDF page-range extraction failed: {payload}")
+            parts.append(payload)
+        return "".join(parts)
+    finally:
+        for process, receiver in blocks:
+            receiver.close()
+            if process.is_alive():
+                process.terminate()
+            process.join()
 
 def parse_file(file_path: str) -> str:
     """Parses the content of a file based on its extension."""
@@ -34,10 +105,7 @@ def parse_file(file_path: str) -> str:
     content = ""
     try:
         if path.suffix == ".pdf":
-            with open(file_path, "rb") as f:
-                reader = pypdf2.PdfReader(f)
-                for page in reader.pages:
-                    content += page.extract_text() or ""
+            content = extract_pdf_text(file_path)
         elif path.suffix == ".docx":
             doc = docx.Document(file_path)
             for para in doc.paragraphs:
@@ -52,24 +120,49 @@ def parse_file(file_path: str) -> str:
         logger.error(f"Error parsing file {file_path}: {e}", exc_info=True)
         raise
 
+CHUNK_SIZE = 1000 # characters, used when CHUNK_SIZE_TOKENS is 0
+CHUNK_OVERLAP = 150 # characters
+
+def split_into_chunks(document_text: str) -> list[str]:
+    """
+    Splits document text into overlapping chunks for embedding. Chunk size is
+    measured in embedding-model tokens (CHUNK_SIZE_TOKENS) so chunks fit the
+    model's max_seq_length; set it to 0 for the legacy character-based size.
+    """
+    if settings.CHUNK_SIZE_TOKENS > 0:
+        text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            get_chunk_tokenizer(),
+            chunk_size=settings.CHUNK_SIZE_TOKENS,
+            chunk_overlap=settings.CHUNK_OVERLAP_TOKENS
+        )
+    else:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
+        )
+    return text_splitter.split_text(document_text)
+
+# Mapping of chunk documents; shared by the tenant index and the preloaded corpus index.
+CHUNK_MAPPING = {
+    "properties": {
+        "user_id": {"type": "keyword"},
+        "file_name": {"type": "keyword"},
+        "generation": {"type": "keyword"}, # Identifies one upload of a file (see document_store)
+        "chunk_text": {"type": "text"},
+        "chunk_vector": {
+            "type": "dense_vector",
+            "dims": settings.EMBEDDING_DIM
+        }
+    }
+}
+
 async def create_index_if_not_exists():
     """Creates the Elasticsearch index with the correct mapping if it doesn't exist."""
     es_client = get_es_client()
     try:
         if not await es_client.indices.exists(index=settings.ES_INDEX_NAME):
             logger.info(f"Index '{settings.ES_INDEX_NAME}' not found. Creating new index.")
-            mapping = {
-                "properties": {
-                    "user_id": {"type": "keyword"},
-                    "file_name": {"type": "keyword"},
-                    "chunk_text": {"type": "text"},
-                    "chunk_vector": {
-                        "type": "dense_vector",
-                        "dims": settings.EMBEDDING_DIM
-                    }
-                }
-            }
-            await es_client.indices.create(index=settings.ES_INDEX_NAME, mappings=mapping)
+            await es_client.indices.create(index=settings.ES_INDEX_NAME, mappings=CHUNK_MAPPING)
             logger.info(f"Successfully created index '{settings.ES_INDEX_NAME}'.")
     except Exception as e:
         logger.error(f"Error during index creation check: {e}", exc_info=True)
@@ -77,29 +170,99 @@ async def create_index_if_not_exists():
         raise
 
 
-@celery.task(name="tasks.process_document", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 5})
-def process_document(file_path: str, user_id: str, file_name: str):
+def build_chunk_actions(user_id: str, file_name: str, generation: str, chunks: list[str], embeddings: list) -> list[dict]:
+    """Bulk index actions for one upload's chunks, with deterministic IDs (see document_store)."""
+    doc_key = document_key(user_id, file_name)
+    actions = []
+    for i, chunk in enumerate(chunks):
+        action = {
+            "_index": settings.ES_INDEX_NAME,
+            "_id": chunk_id(doc_key, generation, i),
+            "_source": {
+                "user_id": user_id,
+                "file_name": file_name,
+                "generation": generation,
+                "chunk_text": chunk,
+                "chunk_vector": embeddings[i],
+            }
+        }
+        actions.append(action)
+    return actions
+
+
+def _cleanup_temp_file(file_path: str) -> None:
+    try:
+        Path(file_path).unlink(missing_ok=True)
+        logger.info(f"Successfully cleaned up temporary file: {file_path}")
+    except Exception as e_clean:
+        logger.error(f"Failed to cleanup temp file {file_path}: {e_clean}")
+
+
+MAX_PROCESSING_RETRIES = 3
+PROCESSING_RETRY_SECONDS = 5
+
+@celery.task(bind=True, name="tasks.process_document")
+def process_document(self, file_path: str, user_id: str, file_name: str, replace: bool = False,
+                     enqueued_at: float | None = None, lane: str = "standard", failures: int = 0, deferrals: int = 0):
     """
     Celery task to parse, chunk, embed, and index a document.
+    With `replace`, previously indexed chunks of the same (user_id, file_name)
+    are removed once the new version is written.
+    The task only runs when its tenant has a free processing slot (see
+    tenant_scheduler) and the Elasticsearch bulk circuit is not open;
+    otherwise it is deferred without counting as a failure. A task deferred
+    for its tenant's cap backs off and fails after TENANT_MAX_DEFER_SECONDS.
     This is a synchronous wrapper for the main async processing logic.
     """
-    if not embedding_model:
-        logger.error("Embedding model not loaded, cannot process document. Failing task.")
-        # This will cause the task to be retried, giving the model time to load if it's a transient issue.
-        raise RuntimeError("Embedding model is not available.")
+    task_kwargs = {"replace": replace, "enqueued_at": enqueued_at, "lane": lane, "failures": failures, "deferrals": deferrals}
+    bulk_breaker = breakers["es_bulk"]
+    if not bulk_breaker.available():
+        logger.info(f"Bulk indexing circuit is open; deferring '{file_name}'.")
+        raise self.retry(countdown=max(1, bulk_breaker.retry_after()), max_retries=None, kwargs=task_kwargs)
+    if not tenant_scheduler.acquire_slot(user_id):
+        if enqueued_at is not None and time.time() - enqueued_at > settings.TENANT_MAX_DEFER_SECONDS:
+            logger.error(f"Tenant '{user_id}' has been at its concurrency limit for over "
+                         f"{settings.TENANT_MAX_DEFER_SECONDS} s; giving up on '{file_name}'.")
+            _cleanup_temp_file(file_path)
+            tenant_scheduler.finish(user_id)
+            raise RuntimeError(f"'{file_name}' waited too long for a processing slot of tenant '{user_id}'.")
+        countdown = tenant_scheduler.retry_delay(deferrals)
+        logger.info(f"Tenant '{user_id}' is at its concurrency limit; deferring '{file_name}' by {countdown:.0f} s.")
+        raise self.retry(countdown=countdown, max_retries=None, kwargs={**task_kwargs, "deferrals": deferrals + 1})
+    if enqueued_at is not None:
+        tenant_scheduler.record_wait(self.request.id, user_id, lane, time.time() - enqueued_at)
+
+    done = False
     try:
+        if not get_embedding_model():
+            logger.error("Embedding model not loaded, cannot process document. Failing task.")
+            # This will cause the task to be retried, giving the model time to load if it's a transient issue.
+            raise RuntimeError("Embedding model is not available.")
         # Run the async processing function within the sync celery task
-        return asyncio.run(process_document_async(file_path, user_id, file_name))
+        with time_ingestion_stage("total"):
+            result = asyncio.run(process_document_async(file_path, user_id, file_name, replace=replace))
+        done = True
+        return result
+    except CircuitOpenError as e:
+        logger.warning(f"Deferring '{file_name}': {e}")
+        raise self.retry(countdown=max(1, e.retry_after), max_retries=None, kwargs=task_kwargs)
     except Exception as e:
         logger.error(f"Unhandled exception in process_document for {file_path}: {e}", exc_info=True)
-        # Clean up the temporary file on failure to prevent disk space issues.
-        try:
-            Path(file_path).unlink(missing_ok=True)
-        except Exception as e_clean:
-            logger.error(f"Failed to cleanup temp file {file_path}: {e_clean}")
-        raise # Re-raise to let Celery handle the retry/failure.
-
-async def process_document_async(file_path: str, user_id: str, file_name: str):
+        if failures < MAX_PROCESSING_RETRIES:
+            raise self.retry(
+                exc=e, countdown=PROCESSING_RETRY_SECONDS, max_retries=None,
+                kwargs={**task_kwargs, "failures": failures + 1}
+            )
+        done = True
+        # Clean up the temporary file once retries are exhausted to prevent disk space issues.
+        _cleanup_temp_file(file_path)
+        raise # Re-raise so Celery records the failure.
+    finally:
+        tenant_scheduler.release_slot(user_id)
+        if done:
+            tenant_scheduler.finish(user_id)
+
+async def process_document_async(file_path: str, user_id: str, file_name: str, replace: bool = False):
     """
     The core asynchronous logic for document processing.
     """
@@ -110,56 +273,74 @@ async def process_document_async(file_path: str, user_id: str, file_name: str):
         await create_index_if_not_exists()
 
         # 1. Parse File Content
-        document_text = parse_file(file_path)
+        with time_ingestion_stage("parse"):
+            document_text = parse_file(file_path)
         if not document_text.strip():
             logger.warning(f"Document {file_name} is empty or could not be parsed. Skipping.")
+            _cleanup_temp_file(file_path)
             return {"status": "skipped", "reason": "empty content"}
 
         # 2. Chunk Text
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=150
-        )
-        chunks = text_splitter.split_text(document_text)
+        with time_ingestion_stage("chunk"):
+            chunks = split_into_chunks(document_text)
         logger.info(f"Split document into {len(chunks)} chunks.")
 
         # 3. Generate Embeddings
-        embeddings = embedding_model.encode(chunks, show_progress_bar=False).tolist()
+        with time_ingestion_stage("embed"):
+            embedded = embed_chunks(get_embedding_model(), chunks)
+        # Re-split overflowing chunks are indexed as separate chunks.
+        chunks = embedded.chunks
+        embeddings = embedded.vectors.tolist()
+        logger.info(f"Embedded {len(chunks)} chunks at {embedded.chunks_per_second:.1f} chunks/s "
+                    f"({embedded.overflowing_chunks} exceeded max_seq_length and were re-split).")
 
         # 4. Prepare for Bulk Indexing
-        actions = []
-        for i, chunk in enumerate(chunks):
-            action = {
-                "_index": settings.ES_INDEX_NAME,
-                "_source": {
-                    "user_id": user_id,
-                    "file_name": file_name,
-                    "chunk_text": chunk,
-                    "chunk_vector": embeddings[i],
-                }
-            }
-            actions.append(action)
+        generation = new_generation()
+        actions = build_chunk_actions(user_id, file_name, generation, chunks, embeddings)
 
         # 5. Perform Async Bulk Indexing
+        # Large writes suspend periodic refresh so segments aren't flushed
+        # mid-write. A replace is not atomic: a refresh between writing the
+        # new generation and deleting the old one (periodic, or another
+        # writer's) briefly serves both, so the delete follows immediately.
+        large_write = len(actions) >= settings.BULK_REFRESH_SUSPEND_THRESHOLD
+        replaced_chunks = 0
         if actions:
-            logger.info(f"Bulk indexing {len(actions)} documents...")
-            success, failed = await async_bulk(es_client, actions, raise_on_error=False, raise_on_exception=False)
-            logger.info(f"Bulk indexing complete. Success: {success}, Failed: {len(failed)}")
-            if failed:
-                logger.error(f"Failed to index {len(failed)} documents. Example error: {failed[0]}")
-                # Depending on requirements, you might want to raise an exception here
-                # to trigger a retry of the whole task.
-                # For now, we log the error and continue.
+            async with suspended_refresh(es_client, enabled=large_write):
+                logger.info(f"Bulk indexing {len(actions)} documents...")
+                with time_ingestion_stage("bulk_index"):
+                    async with breakers["es_bulk"].guard():
+                        success, failed = await async_bulk(es_client, actions, raise_on_error=False, raise_on_exception=False)
+                        if is_bulk_outage(failed, success):
+                            es_errors_total.labels(operation="bulk").inc()
+                            raise ConnectionError(f"Elasticsearch rejected all {len(failed)} chunks: {failed[0]}")
+                logger.info(f"Bulk indexing complete. Success: {success}, Failed: {len(failed)}")
+                ingested_chunks_total.labels(outcome="indexed").inc(success)
+                if failed:
+                    ingested_chunks_total.labels(outcome="failed").inc(len(failed))
+                    es_errors_total.labels(operation="bulk").inc()
+                    logger.error(f"Failed to index {len(failed)} documents. Example error: {failed[0]}")
+                    if replace:
+                        # Never swap in a partial new version: drop it and let Celery retry.
+                        await bulk_delete_ids(es_client, [a["_id"] for a in actions])
+                        raise RuntimeError(f"Replace of '{file_name}' aborted: {len(failed)} chunks failed to index.")
+                    # For plain uploads, we log the error and continue.
 
-        return {"status": "success", "indexed_chunks": len(actions)}
+                if replace:
+                    stale_ids = await fetch_chunk_ids(es_client, user_id, file_name, exclude_generation=generation)
+                    replaced_chunks = await bulk_delete_ids(es_client, stale_ids)
+                    logger.info(f"Removed {replaced_chunks} stale chunks of '{file_name}' for user '{user_id}'.")
+
+            if large_write or replace:
+                await es_client.indices.refresh(index=settings.ES_INDEX_NAME)
+
+        result = {"status": "success", "indexed_chunks": len(actions), "replaced_chunks": replaced_chunks}
 
     except Exception as e:
         logger.error(f"Error during async processing of {file_name} for user {user_id}: {e}", exc_info=True)
+        # The file is kept for the retry; the sync wrapper removes it once retries are exhausted.
         raise # Re-raise to be caught by the sync wrapper for Celery retry.
-    finally:
-        # 6. Cleanup
-        try:
-            Path(file_path).unlink(missing_ok=True)
-            logger.info(f"Successfully cleaned up temporary file: {file_path}")
-        except Exception as e_clean:
-            logger.error(f"Failed to cleanup temp file {file_path}: {e_clean}")
+
+    # 6. Cleanup
+    _cleanup_temp_file(file_path)
+    return result
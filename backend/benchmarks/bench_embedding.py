@@ -0,0 +1,72 @@
+"""
+Benchmarks chunking + embedding before and after length-aware embedding:
+
+- "baseline": 1000-character chunks encoded in input order with a plain
+  `model.encode` call (long chunks are silently truncated).
+- "bucketed": token-sized chunks (CHUNK_SIZE_TOKENS) embedded with
+  `embed_chunks`, which re-splits overflow and encodes length-sorted buckets.
+
+Reports chunks/sec and the share of chunks beyond the model's max_seq_length.
+Needs the real embedding model (sentence-transformers + torch).
+
+Usage (from backend/):
+    python -m benchmarks.bench_embedding --words 200000 --batch-size 64
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from app.core.config import settings
+from app.services.embedding import embed_chunks, token_lengths
+from app.services.model_registry import get_embedding_model
+from app.tasks.processing import split_into_chunks
+from benchmarks.fixtures import lorem
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=200_000, help="Size of the synthetic document.")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    model = get_embedding_model()
+    if model is None:
+        raise SystemExit("Embedding model is not available.")
+    text = lorem(args.words)
+    max_tokens = model.max_seq_length
+
+    # Baseline: character-sized chunks, input order, truncation.
+    token_chunk_size = settings.CHUNK_SIZE_TOKENS
+    settings.CHUNK_SIZE_TOKENS = 0
+    char_chunks = split_into_chunks(text)
+    char_lengths = token_lengths(model.tokenizer, char_chunks)
+    start = time.perf_counter()
+    model.encode(char_chunks, batch_size=args.batch_size, show_progress_bar=False)
+    baseline_seconds = time.perf_counter() - start
+
+    # Token-sized chunks, re-split overflow, length-bucketed batches.
+    settings.CHUNK_SIZE_TOKENS = token_chunk_size or 224
+    token_chunks = split_into_chunks(text)
+    result = embed_chunks(model, token_chunks, batch_size=args.batch_size)
+
+    results = {
+        "max_seq_length": max_tokens,
+        "baseline": {
+            "chunks": len(char_chunks),
+            "chunks_per_second": round(len(char_chunks) / baseline_seconds, 1),
+            "truncation_rate": round(float((char_lengths > max_tokens).mean()), 4),
+        },
+        "bucketed": {
+            "chunks": len(result.chunks),
+            "chunks_per_second": round(result.chunks_per_second, 1),
+            "truncation_rate": round(result.truncation_rate, 4),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmarks client-side hybrid fusion (app.services.fusion).
+
+Offline (default): fuses synthetic BM25/kNN lists of each window size with
+the vectorized `fuse_rrf` / `fuse_linear` and with a plain-Python reference
+implementation, checks they agree, and reports microseconds per fusion.
+
+Live (--live): runs the same queries against Elasticsearch with server-side
+RRF (HYBRID_FUSION=server) and with client-side fusion over one `_msearch`,
+and reports end-to-end search latency percentiles for each mode. Needs a
+reachable cluster and the embedding model.
+
+Usage (from backend/):
+    python -m benchmarks.bench_fusion --windows 50 100 250 500
+    python -m benchmarks.bench_fusion --live --user-id some_user --queries "refund policy" "data retention"
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from pathlib import Path
+from app.core.config import settings
+from app.services.fusion import fuse_rrf, fuse_linear
+
+
+def reference_rrf(lists, weights, top_k, rank_constant=60):
+    total = sum(weights)
+    scores = {}
+    for (ids, _), w in zip(lists, weights):
+        w = w * len(weights) / total
+        for rank, doc_id in enumerate(ids, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + w / (rank_constant + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+
+
+def reference_linear(lists, weights, top_k):
+    total = sum(weights)
+    scores = {}
+    for (ids, raw), w in zip(lists, weights):
+        w = w * len(weights) / total
+        low, high = min(raw), max(raw)
+        for doc_id, s in zip(ids, raw):
+            norm = (s - low) / (high - low) if high > low else 1.0
+            scores[doc_id] = scores.get(doc_id, 0.0) + w * norm
+    return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+
+
+def synthetic_lists(window: int, overlap: float, rng: random.Random):
+    """Two ranked lists of `window` hits sharing about `overlap` of their ids."""
+    shared = [f"doc-{i}" for i in range(int(window * overlap))]
+    bm25_ids = shared + [f"bm25-{i}" for i in range(window - len(shared))]
+    knn_ids = shared + [f"knn-{i}" for i in range(window - len(shared))]
+    rng.shuffle(bm25_ids)
+    rng.shuffle(knn_ids)
+    bm25_scores = sorted((rng.uniform(1, 25) for _ in bm25_ids), reverse=True)
+    knn_scores = sorted((rng.uniform(0.5, 1.0) for _ in knn_ids), reverse=True)
+    return [(bm25_ids, bm25_scores), (knn_ids, knn_scores)]
+
+
+def time_per_call(fn, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def run_offline(args) -> list:
+    rng = random.Random(0)
+    weights = (settings.FUSION_BM25_WEIGHT, settings.FUSION_KNN_WEIGHT)
+    rows = []
+    print(f"{'window':>7} {'rrf us':>8} {'ref rrf us':>11} {'linear us':>10} {'ref linear us':>14}")
+    for window in args.windows:
+        lists = synthetic_lists(window, args.overlap, rng)
+        fused = fuse_rrf(lists, weights, args.top_k)
+        expected = reference_rrf(lists, weights, args.top_k)
+        assert [d for d, _ in fused] == [d for d, _ in expected], "RRF mismatch with reference"
+        fused = fuse_linear(lists, weights, args.top_k)
+        expected = reference_linear(lists, weights, args.top_k)
+        assert all(abs(a[1] - b[1]) < 1e-9 for a, b in zip(fused, expected)), "Linear mismatch with reference"
+        row = {
+            "window": window,
+            "rrf_us": round(time_per_call(lambda: fuse_rrf(lists, weights, args.top_k), args.repeats), 1),
+            "reference_rrf_us": round(time_per_call(lambda: reference_rrf(lists, weights, args.top_k), args.repeats), 1),
+            "linear_us": round(time_per_call(lambda: fuse_linear(lists, weights, args.top_k), args.repeats), 1),
+            "reference_linear_us": round(time_per_call(lambda: reference_linear(lists, weights, args.top_k), args.repeats), 1),
+        }
+        rows.append(row)
+        print(f"{window:>7} {row['rrf_us']:>8} {row['reference_rrf_us']:>11} {row['linear_us']:>10} {row['reference_linear_us']:>14}")
+    return rows
+
+
+async def run_live(args) -> dict:
+    from app.services.search_service import perform_hybrid_search_scored
+    from app.services.es_client import close_es_client
+
+    def percentiles(samples):
+        ordered = sorted(samples)
+        return {
+            "p50_ms": round(statistics.median(ordered), 2),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        }
+
+    results = {}
+    try:
+        for mode in ("server", args.mode):
+            settings.HYBRID_FUSION = mode
+            await perform_hybrid_search_scored(args.user_id, args.queries[0], args.top_k) # warm-up
+            samples = []
+            for _ in range(args.live_rounds):
+                for query in args.queries:
+                    start = time.perf_counter()
+                    await perform_hybrid_search_scored(args.user_id, query, args.top_k)
+                    samples.append((time.perf_counter() - start) * 1000)
+            results[mode] = percentiles(samples)
+            print(f"{mode:>7}: {results[mode]}")
+    finally:
+        await close_es_client()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", type=int, nargs="+", default=[50, 100, 250, 500])
+    parser.add_argument("--overlap", type=float, default=0.3, help="Share of ids found by both retrievers.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--live", action="store_true", help="Also compare against server-side RRF on a live cluster.")
+    parser.add_argument("--mode", choices=["rrf", "linear"], default="rrf", help="Client-side mode for --live.")
+    parser.add_argument("--user-id", default=settings.PRELOADED_DOCS_USER_ID)
+    parser.add_argument("--queries", nargs="+", default=["refund policy", "how is customer data retained"])
+    parser.add_argument("--live-rounds", type=int, default=20)
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    results = {"offline": run_offline(args)}
+    if args.live:
+        results["live"] = asyncio.run(run_live(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
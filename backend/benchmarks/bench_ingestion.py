@@ -0,0 +1,342 @@
+"""
+Benchmarks document ingestion (`process_document_async`) without a cluster.
+
+Generates PDF, DOCX and TXT fixtures in three sizes and runs each through the
+real pipeline. Elasticsearch is replaced by `FakeBulkSink`, an in-process
+client that accepts `_bulk` requests. It can add latency per request and per
+document and can fail items or whole requests. Reported per fixture:
+
+- per-stage seconds: parse, chunk, embed, serialize (bulk NDJSON encoding)
+  and bulk (sink round trips);
+- docs/sec, chunks/sec and the outcome of each document;
+- CPU utilization (process + child CPU seconds / wall seconds, so >1 means
+  more than one core was busy) and peak RSS. Peak RSS is the process
+  high-water mark, so compare it across runs of the same fixture set.
+
+The real embedding model is used by default. `--embedder fake` swaps in a
+whitespace tokenizer and random vectors (and character-based chunking, since
+the token splitter needs a Hugging Face tokenizer), so the pipeline
+overhead can be measured without torch.
+
+Results are written as JSON; `--compare` prints the docs/sec change per
+fixture against an earlier results file, e.g. from the previous commit.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ingestion --output ingest.json
+    python -m benchmarks.bench_ingestion --embedder fake --bulk-latency-ms 20 --item-error-rate 0.01
+    python -m benchmarks.bench_ingestion --sizes large --repeats 3 --compare ingest.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from elasticsearch import ConnectionError as ESConnectionError
+from elasticsearch.serializer import JsonSerializer
+from app.core.config import settings
+from app.core.traffic_recorder import recording
+from app.tasks import processing
+from benchmarks.fixtures import write_pdf, write_docx, write_txt
+
+# (writer, size argument) per format and size.
+FIXTURES = {
+    "pdf": {"small": (write_pdf, 2), "medium": (write_pdf, 20), "large": (write_pdf, 120)},
+    "docx": {"small": (write_docx, 10), "medium": (write_docx, 100), "large": (write_docx, 600)},
+    "txt": {"small": (write_txt, 1_000), "medium": (write_txt, 20_000), "large": (write_txt, 120_000)},
+}
+STAGES = ("parse", "chunk", "embed", "serialize", "bulk")
+
+
+class _TimedSerializer(JsonSerializer):
+    """JSON serializer that accumulates the time spent encoding bulk lines."""
+
+    def __init__(self):
+        super().__init__()
+        self.seconds = 0.0
+
+    def dumps(self, data) -> bytes:
+        start = time.perf_counter()
+        try:
+            return super().dumps(data)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+class _Serializers:
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def get_serializer(self, mimetype):
+        return self.serializer
+
+
+class _Transport:
+    def __init__(self, serializer):
+        self.serializers = _Serializers(serializer)
+
+
+class _BulkResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+
+class _FakeIndices:
+    def __init__(self):
+        self.created: set[str] = set()
+
+    async def exists(self, index: str, **kwargs) -> bool:
+        return True
+
+    async def create(self, index: str, **kwargs) -> None:
+        self.created.add(index)
+
+    async def refresh(self, **kwargs) -> None:
+        pass
+
+    async def put_settings(self, **kwargs) -> None:
+        pass
+
+
+class FakeBulkSink:
+    """
+    Stands in for AsyncElasticsearch in the ingestion path. Each `bulk` call
+    sleeps `latency_ms` plus `per_doc_us` per action, then fails the whole
+    request with probability `request_error_rate` or fails single items
+    with probability `item_error_rate` (with `error_status`).
+    """
+
+    def __init__(self, latency_ms: float = 0.0, per_doc_us: float = 0.0, item_error_rate: float = 0.0,
+                 request_error_rate: float = 0.0, error_status: int = 429, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.per_doc_us = per_doc_us
+        self.item_error_rate = item_error_rate
+        self.request_error_rate = request_error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.serializer = _TimedSerializer()
+        self.transport = _Transport(self.serializer)
+        self.indices = _FakeIndices()
+        self.requests = 0
+        self.bytes_received = 0
+        self.docs_indexed = 0
+        self.docs_rejected = 0
+        self.requests_failed = 0
+
+    def options(self, **kwargs):
+        return self
+
+    async def bulk(self, operations, **kwargs) -> _BulkResponse:
+        self.requests += 1
+        self.bytes_received += sum(len(line) + 1 for line in operations)
+        headers = [json.loads(line) for line in operations[::2]]
+        await asyncio.sleep((self.latency_ms + self.per_doc_us * len(headers) / 1000) / 1000)
+        if self.rng.random() < self.request_error_rate:
+            self.requests_failed += 1
+            raise ESConnectionError("Injected bulk request failure")
+
+        items, errors = [], False
+        for header in headers:
+            op, meta = next(iter(header.items()))
+            if self.rng.random() < self.item_error_rate:
+                errors = True
+                self.docs_rejected += 1
+                items.append({op: {"_id": meta.get("_id"), "status": self.error_status,
+                                   "error": {"type": "injected_error", "reason": "Injected item failure"}}})
+            else:
+                self.docs_indexed += 1
+                items.append({op: {"_id": meta.get("_id"), "status": 201, "result": "created"}})
+        return _BulkResponse({"took": int(self.latency_ms), "errors": errors, "items": items})
+
+    def report(self) -> dict:
+        return {
+            "requests": self.requests,
+            "requests_failed": self.requests_failed,
+            "docs_indexed": self.docs_indexed,
+            "docs_rejected": self.docs_rejected,
+            "mb_received": round(self.bytes_received / 1e6, 2),
+        }
+
+    async def close(self) -> None:
+        pass
+
+
+class WhitespaceTokenizer:
+    """Minimal tokenizer with the call signature `app.services.embedding` uses."""
+
+    def __call__(self, texts, add_special_tokens: bool = True, return_offsets_mapping: bool = False, **kwargs):
+        batch = [texts] if isinstance(texts, str) else texts
+        extra = 2 if add_special_tokens else 0
+        spans = [[m.span() for m in re.finditer(r"\S+", text)] for text in batch]
+        out = {"input_ids": [list(range(len(s) + extra)) for s in spans]}
+        if return_offsets_mapping:
+            out["offset_mapping"] = spans
+        return {k: v[0] for k, v in out.items()} if isinstance(texts, str) else out
+
+
+class FakeEmbedder:
+    """Random unit vectors; isolates the pipeline from model cost."""
+    max_seq_length = 256
+
+    def __init__(self):
+        self.tokenizer = WhitespaceTokenizer()
+        self.rng = np.random.default_rng(0)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return settings.EMBEDDING_DIM
+
+    def encode(self, texts, **kwargs) -> np.ndarray:
+        vectors = self.rng.standard_normal((len(texts), settings.EMBEDDING_DIM)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _cpu_seconds() -> float:
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def _peak_rss_mb() -> float:
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1) # bytes on macOS, KiB on Linux
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run_fixture(path: Path, copies: int, sink: FakeBulkSink, workdir: Path) -> dict:
+    """Ingests `copies` copies of one fixture (the pipeline deletes its input file)."""
+    stages = dict.fromkeys(STAGES, 0.0)
+    outcomes: dict[str, int] = {}
+    chunks = 0
+    wall = cpu = 0.0
+    for n in range(copies):
+        upload = workdir / f"{n}-{path.name}"
+        shutil.copyfile(path, upload)
+        record: dict = {}
+        serialize_before = sink.serializer.seconds
+        cpu_start, start = _cpu_seconds(), time.perf_counter()
+        with recording(record):
+            try:
+                result = await processing.process_document_async(str(upload), "bench_user", path.name)
+                outcome = result["status"]
+                chunks += result.get("indexed_chunks", 0)
+            except Exception as e:
+                outcome = f"error:{type(e).__name__}"
+        wall += time.perf_counter() - start
+        cpu += _cpu_seconds() - cpu_start
+        upload.unlink(missing_ok=True)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        stage_ms = record.get("stage_ms", {})
+        serialize = sink.serializer.seconds - serialize_before
+        for stage in ("parse", "chunk", "embed"):
+            stages[stage] += stage_ms.get(stage, 0.0) / 1000
+        stages["serialize"] += serialize
+        stages["bulk"] += max(0.0, stage_ms.get("bulk_index", 0.0) / 1000 - serialize)
+
+    return {
+        "docs": copies,
+        "chunks": chunks,
+        "outcomes": outcomes,
+        "wall_seconds": round(wall, 4),
+        "docs_per_second": round(copies / wall, 2) if wall else None,
+        "chunks_per_second": round(chunks / wall, 1) if wall else None,
+        "cpu_utilization": round(cpu / wall, 2) if wall else None,
+        "stage_seconds": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+async def run(args) -> dict:
+    sink = FakeBulkSink(args.bulk_latency_ms, args.bulk_per_doc_us, args.item_error_rate,
+                        args.request_error_rate, args.error_status)
+    processing.get_es_client = lambda: sink
+    # The sink has no refresh to suspend; skip the Redis-coordinated suspension.
+    settings.BULK_REFRESH_SUSPEND_THRESHOLD = sys.maxsize
+    if args.embedder == "fake":
+        embedder = FakeEmbedder()
+        processing.get_embedding_model = lambda: embedder
+        settings.CHUNK_SIZE_TOKENS = 0
+    elif processing.get_embedding_model() is None:
+        raise SystemExit("Embedding model is not available (use --embedder fake).")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture_dir, workdir = Path(tmp, "fixtures"), Path(tmp, "uploads")
+        fixture_dir.mkdir()
+        workdir.mkdir()
+        for fmt in args.formats:
+            for size in args.sizes:
+                writer, amount = FIXTURES[fmt][size]
+                path = writer(fixture_dir / f"{size}.{fmt}", amount)
+                await run_fixture(path, 1, sink, workdir) # warm-up (model load, parser imports)
+                row = {"fixture": f"{fmt}/{size}", "bytes": path.stat().st_size,
+                       **await run_fixture(path, args.repeats, sink, workdir)}
+                results.append(row)
+                stage_text = " ".join(f"{stage}={row['stage_seconds'][stage]:.3f}s" for stage in STAGES)
+                print(f"{row['fixture']:>12}: {row['docs_per_second']} docs/s, {row['chunks_per_second']} chunks/s, "
+                      f"cpu {row['cpu_utilization']}, rss {row['peak_rss_mb']} MB | {stage_text}")
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "embedder": args.embedder,
+            "chunk_size_tokens": settings.CHUNK_SIZE_TOKENS,
+            "repeats": args.repeats,
+            "bulk_latency_ms": args.bulk_latency_ms,
+            "bulk_per_doc_us": args.bulk_per_doc_us,
+            "item_error_rate": args.item_error_rate,
+            "request_error_rate": args.request_error_rate,
+        },
+        "sink": sink.report(),
+        "fixtures": results,
+    }
+
+
+def compare(current: dict, previous_path: str) -> None:
+    previous = {row["fixture"]: row for row in json.loads(Path(previous_path).read_text())["fixtures"]}
+    print(f"\nvs. {previous_path}:")
+    for row in current["fixtures"]:
+        before = previous.get(row["fixture"])
+        if not before or not before.get("docs_per_second") or not row["docs_per_second"]:
+            continue
+        change = (row["docs_per_second"] / before["docs_per_second"] - 1) * 100
+        print(f"{row['fixture']:>12}: {before['docs_per_second']} -> {row['docs_per_second']} docs/s ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", nargs="+", choices=list(FIXTURES), default=list(FIXTURES))
+    parser.add_argument("--sizes", nargs="+", choices=["small", "medium", "large"], default=["small", "medium", "large"])
+    parser.add_argument("--repeats", type=int, default=5, help="Documents ingested per fixture.")
+    parser.add_argument("--embedder", choices=["model", "fake"], default="model")
+    parser.add_argument("--bulk-latency-ms", type=float, default=0.0, help="Sink latency per bulk request.")
+    parser.add_argument("--bulk-per-doc-us", type=float, default=0.0, help="Extra sink latency per indexed chunk.")
+    parser.add_argument("--item-error-rate", type=float, default=0.0, help="Share of chunks the sink rejects.")
+    parser.add_argument("--request-error-rate", type=float, default=0.0, help="Share of bulk requests that fail outright.")
+    parser.add_argument("--error-status", type=int, default=429, help="Status of rejected chunks.")
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare docs/sec against.")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
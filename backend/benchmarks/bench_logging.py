@@ -0,0 +1,125 @@
+"""
+Benchmarks the per-request cost of logging on the event loop
+(app.core.log_export).
+
+Simulated requests, running concurrently on one event loop, each emit
+`--lines` INFO records shaped like the chat path's (user id, query text)
+plus one DEBUG record that is filtered out. The root handler writes to a
+sink that takes `--write-latency-us` per write, standing in for a
+back-pressured stdout pipe or log agent. Three modes are compared:
+
+- "direct": the handler runs inline, as without queued export;
+- "queued": install_queue_logging(), so handlers run on the exporter thread;
+- "queued+sampled": the same with LOG_INFO_SAMPLE_RATE=--sample-rate.
+
+Reports microseconds spent inside logging calls per request (mean, p50,
+p99), total wall time, and the exporter's exported, dropped and batch counts.
+
+Usage (from backend/):
+    python -m benchmarks.bench_logging --requests 5000 --concurrency 50 --write-latency-us 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from pathlib import Path
+from app.core import log_export
+from app.core.config import settings
+
+logger = logging.getLogger("bench.chat")
+
+
+class SlowSink:
+    """Write target that blocks for a fixed time per write call."""
+
+    def __init__(self, latency_us: float):
+        self.latency = latency_us / 1e6
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, text: str) -> None:
+        self.writes += 1
+        self.bytes += len(text)
+        if self.latency:
+            deadline = time.perf_counter() + self.latency
+            while time.perf_counter() < deadline: # sleep() is too coarse for microseconds
+                pass
+
+    def flush(self) -> None:
+        pass
+
+
+async def fake_request(n: int, lines: int, samples: list) -> None:
+    spent = 0.0
+    for i in range(lines):
+        start = time.perf_counter()
+        logger.info("Received query from user '%s': '%.50s...'", f"user-{n % 97}", "how long do we retain customer data")
+        logger.debug("Rewritten query for search: '%s'", "customer data retention policy")
+        spent += time.perf_counter() - start
+        await asyncio.sleep(0) # The rest of the request's work
+    samples.append(spent * 1e6)
+
+
+async def run_mode(args) -> dict:
+    samples: list = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(n):
+        async with semaphore:
+            await fake_request(n, args.lines, samples)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(args.requests)))
+    wall = time.perf_counter() - start
+    ordered = sorted(samples)
+    return {
+        "wall_seconds": round(wall, 3),
+        "logging_us_per_request_mean": round(statistics.fmean(ordered), 1),
+        "logging_us_per_request_p50": round(ordered[len(ordered) // 2], 1),
+        "logging_us_per_request_p99": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=4, help="INFO lines per request.")
+    parser.add_argument("--write-latency-us", type=float, default=50.0, help="Sink cost per write call.")
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    sink = SlowSink(args.write_latency_us)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    settings.LOG_QUEUE_ENABLED = True
+    settings.LOG_SAMPLED_LOGGERS = "bench"
+
+    results = {}
+    for mode, sample_rate in (("direct", None), ("queued", 1.0), ("queued+sampled", args.sample_rate)):
+        sink.writes = sink.bytes = 0
+        if sample_rate is not None:
+            settings.LOG_INFO_SAMPLE_RATE = sample_rate
+            log_export.install_queue_logging()
+        row = asyncio.run(run_mode(args))
+        if sample_rate is not None:
+            row["exporter"] = log_export.logging_report()
+            log_export.stop_queue_logging() # Flushes what is still queued
+        row["sink_writes"] = sink.writes
+        row["sink_mb"] = round(sink.bytes / 1e6, 2)
+        results[mode] = row
+        print(f"{mode:>15}: {row['logging_us_per_request_mean']} us/request mean, "
+              f"p99 {row['logging_us_per_request_p99']} us, {sink.writes} sink writes, wall {row['wall_seconds']}s")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmarks sequential vs. parallel page-range PDF extraction. Both run in
+a daemonic child process, as in a Celery prefork worker.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pdf_extraction --pages 16 64 256 1024 --workers 4
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+import billiard
+from app.tasks.processing import extract_pdf_text
+from benchmarks.fixtures import write_pdf
+
+
+def best_of(repeats: int, fn) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def measure(pdf: str, workers: int, repeats: int, results) -> None:
+    """Runs in a daemonic child; puts (sequential, parallel) best timings, or the error, on `results`."""
+    from app.core.config import settings
+    # Force the parallel path for every size so the crossover point is visible.
+    settings.PDF_PARALLEL_MIN_PAGES = 1
+    try:
+        sequential_text = extract_pdf_text(pdf, workers=1)
+        parallel_text = extract_pdf_text(pdf, workers=workers)
+        assert sequential_text == parallel_text, "parallel extraction changed page order or content"
+        results.put((
+            best_of(repeats, lambda: extract_pdf_text(pdf, workers=1)),
+            best_of(repeats, lambda: extract_pdf_text(pdf, workers=workers)),
+        ))
+    except Exception as e:
+        results.put(e)
+
+
+def in_worker_child(pdf: str, workers: int, repeats: int) -> tuple:
+    results = billiard.Queue()
+    child = billiard.Process(target=measure, args=(pdf, workers, repeats, results), daemon=True)
+    child.start()
+    timings = results.get()
+    child.join()
+    if isinstance(timings, Exception):
+        raise timings
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[16, 64, 256, 1024])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'pages':>6} {'sequential s':>13} {'parallel s':>11} {'speedup':>8}")
+        for pages in args.pages:
+            pdf = write_pdf(Path(tmp) / f"bench_{pages}.pdf", pages)
+            sequential, parallel = in_worker_child(str(pdf), args.workers, args.repeats)
+            results.append({
+                "pages": pages,
+                "workers": args.workers,
+                "sequential_seconds": round(sequential, 4),
+                "parallel_seconds": round(parallel, 4),
+                "speedup": round(sequential / parallel, 2),
+            })
+            print(f"{pages:>6} {sequential:>13.3f} {parallel:>11.3f} {sequential / parallel:>7.2f}x")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Measures hybrid search latency while the tenant index is being written to.
+
+Runs the same queries with and without PRELOADED_INDEX_ALIAS (preloaded corpus
+in its own read-optimized index vs. in ES_INDEX_NAME), first idle and then
+while background writers bulk-index synthetic chunks into ES_INDEX_NAME with
+a short refresh interval, as uploads do. Reports p50/p95/p99 per setup.
+
+Needs a reachable cluster, the embedding model, preloaded docs in
+ES_INDEX_NAME (`bulk_load`) and a published alias (`bulk_load --rebuild-preloaded`).
+The synthetic chunks are deleted afterwards.
+
+Usage (from backend/):
+    python -m benchmarks.bench_search_load --alias rag_preloaded --queries "refund policy" "data retention"
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from pathlib import Path
+import numpy as np
+from elasticsearch.helpers import async_bulk
+from app.core.config import settings
+
+BENCH_USER_ID = "_bench_search_load_"
+
+
+def percentiles(samples: list) -> dict:
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 2)
+    return {"n": len(ordered), "p50_ms": round(statistics.median(ordered), 2), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+async def write_load(es_client, stop: asyncio.Event, batch_size: int, counter: list) -> None:
+    """Bulk-indexes random chunks for BENCH_USER_ID until stopped."""
+    rng = np.random.default_rng()
+    while not stop.is_set():
+        vectors = rng.standard_normal((batch_size, settings.EMBEDDING_DIM)).astype(np.float32)
+        actions = [{
+            "_index": settings.ES_INDEX_NAME,
+            "_id": f"bench-{uuid.uuid4().hex}",
+            "_source": {
+                "user_id": BENCH_USER_ID,
+                "file_name": "bench.txt",
+                "generation": "bench",
+                "chunk_text": f"synthetic load chunk {counter[0] + i}",
+                "chunk_vector": vector.tolist(),
+            },
+        } for i, vector in enumerate(vectors)]
+        success, _ = await async_bulk(es_client, actions, raise_on_error=False, request_timeout=120)
+        counter[0] += success
+
+
+async def search_rounds(args) -> list:
+    from app.services.search_service import perform_hybrid_search_scored
+    samples = []
+    for _ in range(args.rounds):
+        for query in args.queries:
+            start = time.perf_counter()
+            await perform_hybrid_search_scored(args.user_id, query, args.top_k)
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def run(args) -> dict:
+    from app.services.es_client import get_es_client, close_es_client
+    from app.services.search_service import perform_hybrid_search_scored
+
+    es_client = get_es_client()
+    results = {}
+    await es_client.indices.put_settings(index=settings.ES_INDEX_NAME, settings={"index": {"refresh_interval": args.refresh_interval}})
+    try:
+        for label, alias in (("shared_index", None), ("preloaded_alias", args.alias)):
+            settings.PRELOADED_INDEX_ALIAS = alias
+            await perform_hybrid_search_scored(args.user_id, args.queries[0], args.top_k) # warm-up
+            results[label] = {"idle": percentiles(await search_rounds(args))}
+
+            stop, written = asyncio.Event(), [0]
+            writers = [asyncio.create_task(write_load(es_client, stop, args.bulk_size, written)) for _ in range(args.writers)]
+            try:
+                results[label]["under_ingest"] = percentiles(await search_rounds(args))
+            finally:
+                stop.set()
+                await asyncio.gather(*writers, return_exceptions=True)
+            results[label]["chunks_written"] = written[0]
+            print(f"{label:>16}: {results[label]}")
+    finally:
+        await es_client.delete_by_query(
+            index=settings.ES_INDEX_NAME, query={"term": {"user_id": BENCH_USER_ID}}, refresh=True, request_timeout=600
+        )
+        await es_client.indices.put_settings(index=settings.ES_INDEX_NAME, settings={"index": {"refresh_interval": settings.ES_REFRESH_INTERVAL}})
+        await close_es_client()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alias", default=settings.PRELOADED_INDEX_ALIAS or "rag_preloaded", help="Published preloaded alias.")
+    parser.add_argument("--user-id", default="bench_user", help="Tenant whose searches are timed.")
+    parser.add_argument("--queries", nargs="+", default=["refund policy", "how is customer data retained"])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--writers", type=int, default=4, help="Concurrent bulk writers during the load phase.")
+    parser.add_argument("--bulk-size", type=int, default=500)
+    parser.add_argument("--refresh-interval", default="1s", help="Tenant index refresh interval during the run.")
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
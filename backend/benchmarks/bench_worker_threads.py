@@ -0,0 +1,91 @@
+"""
+Benchmarks embedding throughput of forked worker children against pool
+concurrency, with and without thread partitioning (app.core.worker_resources).
+
+The parent loads the model once, without running inference, and forks
+`concurrency` children like the Celery prefork pool does. Every child encodes
+the same chunks at the same moment. Two thread modes are compared:
+
+- "unpartitioned": each child uses one torch thread per usable CPU, which
+  is torch's default.
+- "partitioned": each child uses usable CPUs // concurrency threads.
+
+Reports aggregate chunks/sec per concurrency level and mode, plus one child's
+shared vs. private memory, which shows the copy-on-write sharing of weights.
+Needs the real embedding model (sentence-transformers + torch) and Linux
+(fork).
+
+Usage (from backend/):
+    python -m benchmarks.bench_worker_threads --concurrency 1 2 4 8 --chunks 256
+"""
+import argparse
+import json
+import multiprocessing
+import time
+from pathlib import Path
+from app.core.worker_resources import usable_cpus, resource_report
+from app.services.model_registry import get_embedding_model
+from benchmarks.fixtures import lorem
+
+
+def child(model, chunks: list, threads: int, batch_size: int, barrier, results) -> None:
+    import torch
+    torch.set_num_threads(threads)
+    barrier.wait()
+    start = time.perf_counter()
+    model.encode(chunks, batch_size=batch_size, show_progress_bar=False)
+    elapsed = time.perf_counter() - start
+    results.put({"seconds": elapsed, "torch_threads": torch.get_num_threads(), **resource_report()})
+
+
+def run_level(model, chunks: list, concurrency: int, threads: int, batch_size: int) -> dict:
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(concurrency)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=child, args=(model, chunks, threads, batch_size, barrier, results))
+                 for _ in range(concurrency)]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    slowest = max(r["seconds"] for r in reports)
+    return {
+        "concurrency": concurrency,
+        "threads_per_child": threads,
+        "chunks_per_second": round(len(chunks) * concurrency / slowest, 1),
+        "slowest_child_seconds": round(slowest, 3),
+        "child_shared_mb": round((reports[0].get("shared_bytes") or 0) / 1e6, 1),
+        "child_private_mb": round((reports[0].get("private_bytes") or 0) / 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--chunks", type=int, default=256, help="Chunks encoded by each child.")
+    parser.add_argument("--chunk-words", type=int, default=160)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    model = get_embedding_model()
+    if model is None:
+        raise SystemExit("Embedding model is not available.")
+    chunks = [lorem(args.chunk_words, seed=i) for i in range(args.chunks)]
+    cpus = usable_cpus()
+    print(f"{cpus} usable CPUs; parent: {resource_report()}")
+
+    rows = []
+    for concurrency in args.concurrency:
+        for mode, threads in (("unpartitioned", cpus), ("partitioned", max(1, cpus // concurrency))):
+            row = {"mode": mode, **run_level(model, chunks, concurrency, threads, args.batch_size)}
+            rows.append(row)
+            print(f"c={concurrency:<3} {mode:>13}: {row['chunks_per_second']:>8} chunks/s "
+                  f"({threads} threads/child, child shared {row['child_shared_mb']} MB, private {row['child_private_mb']} MB)")
+    if args.output:
+        Path(args.output).write_text(json.dumps({"usable_cpus": cpus, "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
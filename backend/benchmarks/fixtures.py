@@ -0,0 +1,103 @@
+"""
+Synthetic document fixtures for benchmarks. Everything is generated on the fly
+with the standard library so benchmarks need no checked-in binaries.
+"""
+import random
+import zipfile
+from pathlib import Path
+
+WORDS = (
+    "policy revenue quarter customer refund privacy contract employee remote "
+    "security report project deadline budget forecast compliance onboarding "
+    "infrastructure latency throughput retention analysis summary proposal"
+).split()
+
+
+def lorem(word_count: int, seed: int = 0) -> str:
+    """Deterministic pseudo-prose made of sentences of 8-20 words."""
+    rng = random.Random(seed)
+    sentences, remaining = [], word_count
+    while remaining > 0:
+        n = min(remaining, rng.randint(8, 20))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(n))
+        sentences.append(sentence.capitalize() + ".")
+        remaining -= n
+    return " ".join(sentences)
+
+
+def write_pdf(path: Path, pages: int, lines_per_page: int = 45, seed: int = 0) -> Path:
+    """Writes a minimal valid PDF with `pages` pages of Helvetica text."""
+    objects: list[bytes] = []
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    catalog_id = add(b"") # placeholders, filled in below
+    pages_id = add(b"")
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for page_number in range(pages):
+        text = lorem(lines_per_page * 12, seed=seed + page_number)
+        words = text.split()
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)][:lines_per_page]
+        stream_lines = [b"BT /F1 10 Tf 40 800 Td 14 TL"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            stream_lines.append(f"({escaped}) '".encode("latin-1"))
+        stream_lines.append(b"ET")
+        stream = b"\n".join(stream_lines)
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+    objects[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    kids = b" ".join(b"%d 0 R" % pid for pid in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_offset)
+    path.write_bytes(bytes(out))
+    return path
+
+
+def write_docx(path: Path, paragraphs: int, seed: int = 0) -> Path:
+    """Writes a minimal valid .docx with `paragraphs` paragraphs."""
+    body = "".join(
+        f"<w:p><w:r><w:t>{lorem(60, seed=seed + i)}</w:t></w:r></w:p>" for i in range(paragraphs)
+    )
+    document_xml = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>')
+        z.writestr("_rels/.rels",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>')
+        z.writestr("word/document.xml", document_xml)
+    return path
+
+
+def write_txt(path: Path, words: int, seed: int = 0) -> Path:
+    paragraphs = [lorem(120, seed=seed + i) for i in range(max(1, words // 120))]
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    return path
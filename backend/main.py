@@ -1,7 +1,11 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import ingestion, chat
-from app.services.es_client import close_es_client, get_es_client
+from fastapi.responses import JSONResponse, Response
+from app.api import ingestion, chat, admin, embed
+from app.core.lifespan import lifespan, readiness
+from app.core.metrics import render_metrics
+from app.core.traffic_recorder import TrafficRecorderMiddleware, get_traffic_recorder
+from app.core.log_export import install_queue_logging
 import logging
 import google.cloud.logging
 
@@ -22,25 +26,13 @@ except Exception as e:
     logger = logging.getLogger(__name__)
     logger.warning(f"Could not set up Google Cloud Logging: {e}. Falling back to standard logging.")
 
+# Handlers configured above now run on a background exporter thread (see app.core.log_export).
+install_queue_logging()
+
 
 # --- Lifespan Events ---
-async def startup_event():
-    """Tasks to run on application startup."""
-    logger.info("Application startup...")
-    # Initialize Elasticsearch client
-    try:
-        get_es_client()
-        logger.info("Elasticsearch client is ready.")
-    except Exception as e:
-        logger.critical(f"Failed to initialize Elasticsearch on startup: {e}", exc_info=True)
-        # Depending on the desired behavior, you might want to prevent the app from starting.
-        # For now, we log it as critical and let it continue.
-
-async def shutdown_event():
-    """Tasks to run on application shutdown."""
-    logger.info("Application shutdown...")
-    # Cleanly close the Elasticsearch client connection
-    await close_es_client()
+# Startup warm-up (secrets, Elasticsearch, Gemini, embedding model) and
+# shutdown cleanup live in app.core.lifespan.
 
 
 # --- FastAPI App Initialization ---
@@ -48,7 +40,7 @@ app = FastAPI(
     title="Multi-Tenant RAG API",
     description="An API for a multi-tenant RAG chatbot application using FastAPI, Elasticsearch, and Gemini.",
     version="1.0.0",
-    lifespan=lambda app: (startup_event(), shutdown_event())
+    lifespan=lifespan
 )
 
 
@@ -63,11 +55,18 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# --- Traffic Recording (opt-in via TRAFFIC_RECORD_PATH) ---
+traffic_recorder = get_traffic_recorder()
+if traffic_recorder:
+    app.add_middleware(TrafficRecorderMiddleware, recorder=traffic_recorder)
+
 
 # --- API Routers ---
 # Include the routers for different parts of the API.
 app.include_router(ingestion.router, prefix="/api", tags=["Ingestion"])
 app.include_router(chat.router, prefix="/api", tags=["Chat"])
+app.include_router(admin.router, prefix="/api", tags=["Admin"])
+app.include_router(embed.router, prefix="/api", tags=["Embedding"])
 
 
 # --- Root Endpoint ---
@@ -75,3 +74,25 @@ app.include_router(chat.router, prefix="/api", tags=["Chat"])
 async def read_root():
     """A simple health check endpoint."""
     return {"status": "ok", "message": "Welcome to the RAG API!"}
+
+
+# --- Health Probes ---
+@app.get("/healthz", tags=["Root"])
+async def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["Root"])
+async def readiness_probe():
+    """Readiness probe: 200 only once every dependency has been warmed up."""
+    report = readiness.report()
+    status_code = status.HTTP_200_OK if report["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(status_code=status_code, content=report)
+
+
+# --- Metrics ---
+@app.get("/metrics", tags=["Root"], include_in_schema=False)
+async def metrics():
+    """Prometheus exposition of pipeline latency, intent, error and token metrics."""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
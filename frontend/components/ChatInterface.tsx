@@ -29,6 +29,8 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // The server stores the session document once; later turns send only its id.
+  const [sessionId, setSessionId] = useState<string | null>(null);
   const scrollAreaViewportRef = useRef<HTMLDivElement>(null);
 
   const scrollToBottom = useCallback(() => {
@@ -39,6 +41,8 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
 
   useEffect(() => { scrollToBottom(); }, [messages, scrollToBottom]);
 
+  useEffect(() => { setSessionId(null); }, [sessionContextText, userId]);
+
   const handleSend = useCallback(async () => {
     const trimmedInput = input.trim();
     if (!trimmedInput || isLoading || !userId) return;
@@ -50,12 +54,22 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
 
     const queryUrl = `${backendUrl}/query`;
 
+    const postQuery = (withSessionId: boolean) => axios.post<{ answer: string; session_id?: string | null }>(queryUrl, {
+      user_id: userId,
+      query_text: userMessage.text,
+      ...(withSessionId ? { session_id: sessionId } : { session_context_text: sessionContextText }),
+    });
+
     try {
-      const response = await axios.post<{ answer: string }>(queryUrl, {
-        user_id: userId,
-        query_text: userMessage.text,
-        session_context_text: sessionContextText,
-      });
+      let response;
+      try {
+        response = await postQuery(sessionId !== null);
+      } catch (error) {
+        // The session expired or lives on another instance: send the document again.
+        if (sessionId === null || !sessionContextText || !axios.isAxiosError(error) || error.response?.status !== 404) throw error;
+        response = await postQuery(false);
+      }
+      if (response.data.session_id) setSessionId(response.data.session_id);
 
       const botMessage: ChatMessage = { id: `bot-${Date.now()}`, sender: 'bot', text: response.data.answer || "Received empty answer." };
       setMessages((prev) => [...prev, botMessage]);
@@ -74,7 +88,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
     } finally {
       setIsLoading(false);
     }
-  }, [input, isLoading, userId, backendUrl, sessionContextText, scrollToBottom]);
+  }, [input, isLoading, userId, backendUrl, sessionContextText, sessionId, scrollToBottom]);
 
   const handleInputChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     setInput(e.target.value);